@@ -196,6 +196,52 @@ def meanSumBenchmark(ns):
         
     return sumTimeArray *  1000.0
 
+def dotBenchmark(nnzs, n=10**6, k=10): 
+    """
+    Time sparse matrix-vector (SpMV) and sparse matrix-dense matrix products for 
+    square matrices with the given numbers of nonzeros. The dense matrix has k columns. 
+    Wall clock time is used since pdot is multithreaded. 
+    """
+    methodNames = ["csc_matrix", "csr_matrix", "csarray col", "csarray row", "csarray row pdot"]
+    numMethods = len(methodNames)
+    dot1dTimeArray = numpy.zeros((numMethods, len(nnzs)))
+    dot2dTimeArray = numpy.zeros((numMethods, len(nnzs)))
+    repetitions = 5 
+    
+    for s in range(len(nnzs)):
+        numVals = nnzs[s]
+        logging.debug("nnz="+str(numVals))
+        
+        rowInds, colInds, vals = getRandomElements(numVals, (n, n))
+        rowInds = numpy.array(rowInds, numpy.int32)
+        colInds = numpy.array(colInds, numpy.int32)
+        v = numpy.random.rand(n)
+        V = numpy.random.rand(n, k)
+        
+        A1 = csc_matrix((vals, (rowInds, colInds)), shape=(n, n))
+        A2 = csr_matrix((vals, (rowInds, colInds)), shape=(n, n))
+        A3 = csarray((n, n), storagetype="col")
+        A3.put(vals, rowInds, colInds, init=True)
+        A4 = csarray((n, n), storagetype="row")
+        A4.put(vals, rowInds, colInds, init=True)
+        
+        products = [A1.dot, A2.dot, A3.dot, A4.dot, A4.pdot]
+        
+        for i, product in enumerate(products): 
+            logging.debug("Benchmarking SpMV of " + methodNames[i])
+            startTime = time.time()
+            for j in range(repetitions): 
+                u = product(v)
+            dot1dTimeArray[i, s] = (time.time() - startTime)/repetitions
+            
+            logging.debug("Benchmarking SpMM of " + methodNames[i])
+            startTime = time.time()
+            for j in range(repetitions): 
+                U = product(V)
+            dot2dTimeArray[i, s] = (time.time() - startTime)/repetitions
+    
+    return dot1dTimeArray, dot2dTimeArray, methodNames
+
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG) 
 numpy.set_printoptions(suppress=True)
 
@@ -207,6 +253,9 @@ setTimeArray, getTimeArray = setGetBenchmark(ns)
 addTimeArray, multTimeArray = addMultBenchmark(ns)
 sumTimeArray = meanSumBenchmark(ns)
 
+nnzs = [10**6, 10**7, 2*10**7]
+dot1dTimeArray, dot2dTimeArray, dotMethodNames = dotBenchmark(nnzs)
+
 plt.figure(0)
 for i in range(len(methodNames)): 
     plt.plot(ns, setTimeArray[i, :], label=methodNames[i])
@@ -247,11 +296,29 @@ plt.xlabel("x")
 plt.ylabel("time")
 plt.legend()
 
+plt.figure(5)
+for i in range(len(dotMethodNames)): 
+    plt.plot(nnzs, dot1dTimeArray[i, :], label=dotMethodNames[i])
+plt.title("SpMV")
+plt.xlabel("nnz")
+plt.ylabel("time")
+plt.legend()
+
+plt.figure(6)
+for i in range(len(dotMethodNames)): 
+    plt.plot(nnzs, dot2dTimeArray[i, :], label=dotMethodNames[i])
+plt.title("SpMM")
+plt.xlabel("nnz")
+plt.ylabel("time")
+plt.legend()
+
 print(setTimeArray)
 print(getTimeArray)
 print(addTimeArray)
 print(multTimeArray)
 print(sumTimeArray)
+print(dot1dTimeArray)
+print(dot2dTimeArray)
 
 plt.show()
 
@@ -9,6 +9,7 @@ from sppy.csarray1d_sub import csarray1d_int, csarray1d_double, csarray1d_float,
 from sppy.csarray1d_sub cimport csarray1d_int, csarray1d_double, csarray1d_float, csarray1d_long, csarray1d_short, csarray1d_signed_char 
 import struct
 import array
+import pickle
 import numpy 
 cimport numpy
 import cython 
@@ -107,28 +108,97 @@ class csarray(object):
         self._dtype = dtype
         self.storagetype = storagetype
     
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs): 
+        """
+        Apply numpy ufuncs with one output which map zero to zero, such as numpy.sqrt(A), 
+        numpy.log1p(A) or numpy.multiply(A, 2), to the nonzero elements of this 2d array 
+        using mapValues, so that the array is never made dense. The other inputs must be 
+        scalars, and out=A changes A in place. Multiplying by or dividing by a numpy array 
+        of shape (m, 1) or (n, ), as in A * d[:, None], scales the rows or columns. Adding 
+        or subtracting a numpy array D of the same shape as A gives a dense array, written 
+        to out if it is a numpy array (e.g. numpy.add(D, A, out=D)), and multiplying by D 
+        gives a sparse array (see hadamard). 
+        """
+        if method != "__call__" or ufunc.nout != 1 or self.ndim != 2: 
+            return NotImplemented 
+        
+        out = kwargs.pop("out", None)
+        if out is not None: 
+            if len(out) != 1: 
+                return NotImplemented 
+            out = out[0]
+        
+        dtype = kwargs.pop("dtype", None)
+        if len(kwargs) != 0: 
+            return NotImplemented 
+        
+        position = [i for i, x in enumerate(inputs) if x is self][0]
+        args = inputs[0:position] + inputs[position+1:]
+        
+        #Adding or multiplying by a dense array of the same shape 
+        if len(args) == 1 and isinstance(args[0], numpy.ndarray) and args[0].shape == self.shape: 
+            if dtype is not None: 
+                return NotImplemented 
+            elif (ufunc is numpy.add or ufunc is numpy.subtract) and (out is None or isinstance(out, numpy.ndarray)): 
+                return self.__addDense(args[0], ufunc is numpy.subtract, position == 0, out)
+            elif ufunc is numpy.multiply and (out is None or out is self): 
+                return self.__hadamardDense(args[0], out)
+            else: 
+                return NotImplemented 
+        
+        if out is not None and out is not self: 
+            return NotImplemented 
+        
+        #Scaling the rows or columns by a broadcast vector 
+        if len(args) == 1 and numpy.ndim(args[0]) != 0 and not isinstance(args[0], csarray): 
+            d, rows = self.__broadcastLine(args[0])
+            
+            if d is None or dtype is not None or not (ufunc is numpy.multiply or ufunc is numpy.true_divide and position == 0): 
+                return NotImplemented 
+            
+            return self.__scaleLines(d, rows, ufunc is numpy.true_divide, out, None)
+        
+        for arg in args: 
+            if numpy.ndim(arg) != 0 or isinstance(arg, csarray): 
+                return NotImplemented 
+        
+        with numpy.errstate(all="ignore"): 
+            zero = ufunc(*(args[0:position] + (numpy.zeros(1, self.dtype), ) + args[position:]))
+        
+        if zero[0] != 0: 
+            raise ValueError("numpy." + ufunc.__name__ + " does not map 0 to 0, so its result is not sparse")
+        
+        if out is self: 
+            self._array.mapValues(ufunc, args, None, "same_kind", None, position)
+            return self 
+        
+        result, values = self.__structureCopy(self.__resultType(zero.dtype) if dtype is None else dtype)
+        self._array.mapValues(ufunc, args, values, "unsafe", None, position)
+        return result 
+
     def __abs__(self): 
         """
         Compute the absolute value of the elements of this matrix. 
         """
         resultArray = self._array.__abs__()
-        result = csarray(resultArray.shape, self.dtype)
+        result = csarray(resultArray.shape, self.dtype, self.storagetype)
         result._array = resultArray
         return result    
 
     def __add__(self, A): 
         """
-        Add this matrix to another one with identical dimentions. If A is a numpy 
-        array it will be converted to a csarray. 
+        Add this matrix to another one with identical dimentions. If A is a 2d numpy 
+        array the result is a dense numpy array, made by adding the nonzero elements of 
+        this one to a copy of A. 
         
         :param A: The matrix to add, a numpy or csarray. 
         """
-        if isinstance(A, numpy.ndarray):
+        if isinstance(A, numpy.ndarray) and self.ndim == 2: 
+            return self.__addDense(A, False, True, None)
+        elif isinstance(A, numpy.ndarray):
             A = csarray(A)        
         
-        result = csarray(self.shape, self.dtype)
-        result._array = self._array.__add__(A._array)
-        return result
+        return self.__fromBase(self._array.__add__(A._array), self.dtype, self.storagetype)
 
     def __convertBase(self, array, dtype): 
         """
@@ -138,6 +208,17 @@ class csarray(object):
         self._array = array       
         self._dtype = dtype 
 
+    @staticmethod 
+    def __fromBase(array, dtype, storagetype): 
+        """
+        Return a csarray which wraps the base array, without first creating an empty one. 
+        """
+        result = csarray.__new__(csarray)
+        result._array = array 
+        result._dtype = dtype 
+        result.storagetype = storagetype 
+        return result 
+
     def __getattr__(self, name):
         try: 
             return getattr(self, name)
@@ -174,6 +255,23 @@ class csarray(object):
 
         return objDict
 
+    def __reduce_ex__(self, protocol): 
+        """
+        Used for pickling. A 2d array is pickled as its compressed arrays, which for 
+        protocol 5 and above are PickleBuffer objects so that they can be passed out-of-band 
+        without copying. On unpickling the buffers become the storage of the array directly 
+        (copied only when it is first written to) and no sorting is done. 
+        """
+        if self.ndim != 2: 
+            return object.__reduce_ex__(self, protocol)
+        
+        buffers = [self.outerIndexPtr(), self.innerIndexPtr(), self.valuePtr()]
+        
+        if protocol >= 5: 
+            buffers = [pickle.PickleBuffer(buffer) for buffer in buffers]
+            
+        return (unpickleCompressed, (self.shape, numpy.dtype(self.dtype).str, self.storagetype) + tuple(buffers))
+
     def __mul__(self, A):
         """
         Multiply this matrix with another one with identical dimentions.
@@ -181,18 +279,88 @@ class csarray(object):
         :param A: The matrix to multiply. 
         
         """
+        if self.ndim == 2 and numpy.ndim(A) == 0 and not isinstance(A, csarray): 
+            return self.mapValues(numpy.multiply, (A, ), dtype=self.dtype)
+        elif self.ndim == 2 and isinstance(A, numpy.ndarray): 
+            return numpy.multiply(self, A)
+        
         newArray = self.copy() 
         newArray._array = newArray._array*A
         return newArray
 
+    __rmul__ = __mul__ 
+
+    def __truediv__(self, x): 
+        """
+        Divide the elements of this 2d matrix by a scalar x, or its rows or columns by a 
+        numpy array x of shape (m, 1) or (n, ), returning a new array with the same 
+        structure, which is floating point for integer arrays. 
+        
+        :param x: The scalar or array to divide by. 
+        """
+        if self.ndim != 2 or isinstance(x, csarray): 
+            return NotImplemented 
+        elif numpy.ndim(x) != 0: 
+            return numpy.true_divide(self, x)
+        
+        return self.mapValues(numpy.true_divide, (x, ))
+
+    def __iadd__(self, A): 
+        """
+        Add a csarray A of the same dtype to this one in place. The storage of this 
+        array is reused when the nonzero elements of A are a subset of its own, for 
+        example when they have the same structure, and otherwise the two are merged once. 
+        
+        :param A: The csarray to add. 
+        """
+        if not isinstance(A, csarray): 
+            return NotImplemented 
+        
+        self._array.addScaled(A._array, 1)
+        return self 
+
+    def __isub__(self, A): 
+        """
+        Subtract a csarray A of the same dtype from this one in place, see __iadd__. 
+        
+        :param A: The csarray to subtract. 
+        """
+        if not isinstance(A, csarray): 
+            return NotImplemented 
+        
+        self._array.addScaled(A._array, -1)
+        return self 
+
+    def __imul__(self, x): 
+        """
+        Multiply the elements of this 2d array by a scalar x in place. 
+        
+        :param x: The scalar to multiply by. 
+        """
+        if self.ndim != 2 or numpy.ndim(x) != 0 or isinstance(x, csarray): 
+            return NotImplemented 
+        
+        return self.mapValues(numpy.multiply, (x, ), out=self)
+
+    def __itruediv__(self, x): 
+        """
+        Divide the elements of this 2d floating point array by a scalar x in place. 
+        
+        :param x: The scalar to divide by. 
+        """
+        if self.ndim != 2 or numpy.ndim(x) != 0 or isinstance(x, csarray): 
+            return NotImplemented 
+        
+        return self.mapValues(numpy.true_divide, (x, ), out=self)
+
     def __neg__(self): 
         """
         Negate all the elements of this matrix. 
         """
-        resultArray = self._array.__neg__()
-        result = csarray(resultArray.shape, self.dtype)
-        result._array = resultArray
-        return result
+        if self.ndim == 2: 
+            return self.mapValues(numpy.negative)
+        
+        return self.__fromBase(self._array.__neg__(), self.dtype, self.storagetype)
           
         
     def __setitem__(self, inds, val):
@@ -248,19 +416,40 @@ class csarray(object):
     def __sub__(self, A):
         """
         Subtract this matrix from another one with identical dimentions.
-        If A is a numpy array it will be converted to a csarray. 
+        If A is a 2d numpy array the result is a dense numpy array, see __add__. 
         """
-        if isinstance(A, numpy.ndarray):
+        if isinstance(A, numpy.ndarray) and self.ndim == 2: 
+            return self.__addDense(A, True, True, None)
+        elif isinstance(A, numpy.ndarray):
             A = csarray(A)
             
-        result = csarray(self.shape, self.dtype)
-        result._array = self._array.__sub__(A._array)
-        return result
+        return self.__fromBase(self._array.__sub__(A._array), self.dtype, self.storagetype)
+
+    def argmax(self, axis=None): 
+        """
+        Return the index of the first maximum element of this 2d array in the flattened 
+        (row major) array, or the indices of the first maximum elements along an axis. 
+        
+        :param axis: The axis along which to find the maximum elements, or None for the whole array. 
+        """
+        return self._array.argmax(axis)
+
+    def argmin(self, axis=None): 
+        """
+        Return the index of the first minimum element of this 2d array in the flattened 
+        (row major) array, or the indices of the first minimum elements along an axis. 
+        
+        :param axis: The axis along which to find the minimum elements, or None for the whole array. 
+        """
+        return self._array.argmin(axis)
 
     def ceil(self): 
         """
         Take the ceil of the nonzero elements of this array, and return a new array. 
         """
+        if self.ndim == 2: 
+            return self.mapValues(numpy.ceil, dtype=long)
+        
         result = csarray(self.shape, long)
         result._array = self._array.ceil()
         return result   
@@ -293,10 +482,22 @@ class csarray(object):
         newArray._array = self._array.copy()
         return newArray 
         
+    def countNonzero(self, axis=None): 
+        """
+        Return the number of nonzero elements of this 2d array, not counting explicitly 
+        stored zeros, or the number along an axis. 
+        
+        :param axis: The axis along which to count, or None for the whole array. 
+        """
+        return self._array.countNonzero(axis)
+
     def cos(self): 
         """
         Take the cosine of the nonzero elements of this array, and return a new array. 
         """
+        if self.ndim == 2: 
+            return self.mapValues(numpy.cos, dtype=numpy.float64)
+        
         result = csarray(self.shape, self.dtype)
         result._array = self._array.cos()
         return result              
@@ -309,12 +510,26 @@ class csarray(object):
         """
         return self._array.diag()       
     
-    def dot(self, A): 
-        """
-        Compute the dot product between this and either a csarray or numpy array A.
+    def dot(self, A, threshold=None, topk=None, num_threads=None): 
+        """
+        Compute the dot product between this and either a csarray or numpy array A. 
+        If A is a numpy array with the same dtype as this array then the result 
+        has that dtype, otherwise the product is computed in float64. The product of 
+        two 2d csarrays is computed in parallel, and can be pruned as it is found, for 
+        example to keep the 10 largest similarities of each item with 
+        A.T.dot(A, topk=10), so that the full product is never stored. 
         
         :param A: The input numpy array or csarray. 
+        
+        :param threshold: For a csarray A, drop the elements of the product with absolute value below threshold. 
+        
+        :param topk: For a csarray A, keep only the topk elements of largest absolute value in each row of the product (each column for column major arrays). 
+        
+        :param num_threads: The number of threads for the product of 2d csarrays, by default the number of CPUs. 
         """
+        if (threshold is not None or topk is not None) and (isinstance(A, numpy.ndarray) or A.ndim != 2): 
+            raise ValueError("threshold and topk only apply to the product of 2d csarrays")
+        
         if isinstance(A, numpy.ndarray):  
             if A.ndim == 2: 
                 A = numpy.ascontiguousarray(A)
@@ -323,7 +538,7 @@ class csarray(object):
                 result = self._array.dotNumpy1d(A)
         else: 
             if A.ndim == 2: 
-                resultArray = self._array.dotCsarray2d(A._array)
+                return self.__fromBase(self._array.dotCsarray2d(A._array, threshold, topk, num_threads), A.dtype, self.storagetype)
             else: 
                 resultArray = self._array.dotCsarray1d(A._array)
             
@@ -339,14 +554,90 @@ class csarray(object):
         """
         Take the floor of the nonzero elements of this array, and return a new array. 
         """
+        if self.ndim == 2: 
+            return self.mapValues(numpy.floor, dtype=long)
+        
         result = csarray(self.shape, long)
         result._array = self._array.floor()
         return result   
 
+    @staticmethod 
+    def fromChunks(shape, chunks, dtype=numpy.float, storagetype="col", duplicates="sum"): 
+        """
+        Build a csarray from a stream of chunks, each a tuple (rowInds, colInds, values) 
+        where values is an array or a scalar. The elements are written straight into the 
+        compressed storage, so the peak memory is about that of the output array rather 
+        than all the triplets at once. 
+        
+        If chunks is a callable returning an iterator over the chunks (or a list) it is 
+        iterated twice, first to count the elements of each row/column and then to fill 
+        exactly that much room. A one-off iterator such as a generator is read once and 
+        the room grows geometrically as needed. 
+        
+        :param shape: The shape of the output array (m, n)
+        
+        :param chunks: A callable returning an iterator, or an iterable, over chunks of elements. 
+        
+        :param dtype: A numpy dtype for the elements 
+        
+        :param storagetype: The storage order of the elements of the output csarray.
+        :type storagetype: `str`
+        
+        :param duplicates: How to combine repeated indices: "sum", "last", "max" or "min". 
+        :type duplicates: `str`
+        """
+        result = csarray(shape, dtype=dtype, storagetype=storagetype)
+        result._array.putChunks(chunks, duplicates)
+        return result 
+
+    @staticmethod 
+    def fromCompressed(shape, outerIndexPtr, innerIndexPtr, values, storagetype="col", check=True, copy=True): 
+        """
+        Create a 2d csarray from the compressed (CSC or CSR) arrays outerIndexPtr, innerIndexPtr 
+        and values, which are copied directly into the storage of the new array without sorting. 
+        For column major storage these are the column pointers, row indices and values as in 
+        scipy.sparse.csc_matrix (indptr, indices, data), and for row major storage they are 
+        the row pointers, column indices and values of a csr_matrix. The dtype of the output 
+        is that of values. 
+        
+        :param shape: The shape of the output array (m, n)
+        
+        :param outerIndexPtr: An array of outer size + 1 positions with outerIndexPtr[0] = 0. 
+        
+        :param innerIndexPtr: The inner indices, sorted and unique within each outer vector. 
+        
+        :param values: The values of the nonzero elements. 
+        
+        :param storagetype: The storage order of the elements of the output csarray.
+        :type storagetype: `str`
+        
+        :param check: Whether to check that the arrays describe a valid compressed array. 
+        :type check: `bool`
+        
+        :param copy: If False the output uses the (int32 and contiguous) arrays as its storage without copying, and is read-only. 
+        :type copy: `bool`
+        """
+        values = numpy.ascontiguousarray(values)
+        result = csarray(shape, dtype=values.dtype, storagetype=storagetype)
+        outerIndexPtr = numpy.ascontiguousarray(outerIndexPtr, numpy.int32)
+        innerIndexPtr = numpy.ascontiguousarray(innerIndexPtr, numpy.int32)
+        
+        if check: 
+            checkCompressed(shape, storagetype, outerIndexPtr, innerIndexPtr, values)
+        
+        if copy: 
+            result._array.setCompressed(outerIndexPtr, innerIndexPtr, values)
+        else: 
+            result._array.mapCompressed(outerIndexPtr, innerIndexPtr, values)
+        
+        return result 
+
     @staticmethod 
     def fromScipySparse(A, storagetype="col"): 
         """
-        Take a scipy sparse matrix A and return a csarray, copying the data. 
+        Take a scipy sparse matrix A and return a csarray, copying the data. If A is a 
+        csc_matrix (for storagetype="col") or csr_matrix (for storagetype="row") in canonical 
+        form the compressed arrays are copied directly, otherwise A is first converted. 
         
         :param A: A scipy.sparse matrix 
         
@@ -358,11 +649,18 @@ class csarray(object):
         except ImportError: 
             raise         
         
-        rowInds, colInds = A.nonzero() 
-        B = csarray(A.shape, dtype=A.dtype, storagetype=storagetype)
-        B.put(A.data, rowInds, colInds, init=True)
+        if storagetype == "col": 
+            A = A.tocsc()
+        elif storagetype == "row": 
+            A = A.tocsr()
+        else: 
+            raise ValueError("Unknown storage type: " + str(storagetype))
+        
+        if not A.has_canonical_format: 
+            A = A.copy()
+            A.sum_duplicates()
         
-        return B 
+        return csarray.fromCompressed(A.shape, A.indptr, A.indices, A.data, storagetype, check=False) 
 
     def getnnz(self): 
         """
@@ -372,36 +670,248 @@ class csarray(object):
 
     def hadamard(self, A): 
         """
-        Compute the hadamard (element-wise) product between this array and A.
+        Compute the hadamard (element-wise) product between this array and A. If A is a 
+        2d numpy array the result is sparse, and only the elements of A at the nonzero 
+        elements of this array are read. 
         
         :param A: The input numpy array or csarray. 
         """
-        result = csarray(self.shape, self.dtype)
+        if isinstance(A, numpy.ndarray) and self.ndim == 2: 
+            return self.__hadamardDense(A, None)
+        
+        result = csarray(self.shape, self.dtype, self.storagetype)
         result._array = self._array.hadamard(A._array)
         return result
 
-    def max(self): 
+    def max(self, axis=None): 
         """
         Find the maximum element of this array. 
+        
+        :param axis: The axis along which to find the maximum elements, or None for the whole array. 
         """
-        return self._array.max()
+        if self.ndim == 2: 
+            return self._array.max(axis)
+        else: 
+            return self._array.max()
+
+    def innerIndexPtr(self): 
+        """
+        Return the inner indices of the nonzero elements, i.e. row indices for column 
+        major arrays and column indices for row major ones, as a read-only numpy view of 
+        the underlying storage (compressing the array first). The view must not be used 
+        after the nonzero elements of this array change. 
+        """
+        return self._array.innerIndexPtr()
+
+    def mapValues(self, ufunc, args=(), out=None, dtype=None, num_threads=None): 
+        """
+        Apply a numpy ufunc to the nonzero elements of this 2d array, as ufunc(v, *args) 
+        for each value v, keeping the nonzero structure. The values are mapped in 
+        parallel blocks straight from the storage, and with out=A this array A is changed 
+        in place, otherwise a new array with the same structure is returned. For example 
+        A.mapValues(numpy.log1p) or A.mapValues(numpy.multiply, (2, ), out=A). 
+        
+        :param ufunc: A numpy ufunc with one output. 
+        
+        :param args: The other inputs of ufunc, usually scalars. 
+        
+        :param out: None or this array. 
+        
+        :param dtype: The dtype of a new array, by default the dtype of the result of ufunc if it is that of this array, and otherwise float64 or int64. 
+        
+        :param num_threads: The number of threads to use, by default the number of CPUs. 
+        """
+        if self.ndim != 2: 
+            raise ValueError("Can only map the values of 2d arrays")
+        
+        if out is self: 
+            self._array.mapValues(ufunc, args, None, "same_kind", num_threads)
+            return self 
+        elif out is not None: 
+            raise ValueError("out must be None or this array")
+        
+        if dtype is None: 
+            with numpy.errstate(all="ignore"): 
+                dtype = self.__resultType(ufunc(numpy.zeros(1, self.dtype), *args).dtype)
+        
+        result, values = self.__structureCopy(dtype)
+        self._array.mapValues(ufunc, args, values, "unsafe", num_threads)
+        return result 
+    
+    def multiplyRows(self, d, out=None, num_threads=None): 
+        """
+        Multiply each row i of this 2d array by d[i], for example to weight the rows, in 
+        one parallel pass over the nonzero elements. This is the same as A * d[:, None]. 
+        
+        :param d: An array with one element for each row. 
+        
+        :param out: None to return a new array with the same structure, or this array to change it in place. 
+        
+        :param num_threads: The number of threads to use, by default the number of CPUs. 
+        """
+        return self.__scaleLines(d, True, False, out, num_threads)
+
+    def multiplyCols(self, d, out=None, num_threads=None): 
+        """
+        Multiply each column j of this 2d array by d[j], see multiplyRows. This is the 
+        same as A * d. 
+        
+        :param d: An array with one element for each column. 
+        """
+        return self.__scaleLines(d, False, False, out, num_threads)
+
+    def divideRows(self, d, out=None, num_threads=None): 
+        """
+        Divide each row i of this 2d array by d[i], for example to normalise the rows with 
+        A.divideRows(A.norm(1)), see multiplyRows. The result is floating point. 
+        
+        :param d: An array with one element for each row. 
+        """
+        return self.__scaleLines(d, True, True, out, num_threads)
+
+    def divideCols(self, d, out=None, num_threads=None): 
+        """
+        Divide each column j of this 2d array by d[j], see multiplyRows. The result is 
+        floating point. 
+        
+        :param d: An array with one element for each column. 
+        """
+        return self.__scaleLines(d, False, True, out, num_threads)
+
+    def __scaleLines(self, d, rows, divide, out, numThreads): 
+        """
+        Multiply or divide the rows (or columns) of this 2d array by d, see multiplyRows. 
+        New arrays have the dtype of this array if possible, otherwise float64 or int64. 
+        """
+        if self.ndim != 2: 
+            raise ValueError("Can only scale the rows and columns of 2d arrays")
+        
+        d = numpy.asarray(d)
+        
+        if out is self: 
+            if (divide and self.dtype.kind != "f") or not numpy.can_cast(d.dtype, self.dtype, "same_kind"): 
+                raise TypeError("Cannot scale an array of dtype " + str(self.dtype) + " by " + str(d.dtype) + " in place")
+            
+            self._array.scaleLines(d, rows, divide, None, numThreads)
+            return self 
+        elif out is not None: 
+            raise ValueError("out must be None or this array")
+        
+        result, values = self.__structureCopy(self.__resultType(d.dtype, divide))
+        self._array.scaleLines(d, rows, divide, values, numThreads)
+        return result 
+
+    def __resultType(self, dtype, divide=False): 
+        """
+        Return the dtype of the result of an operation between this array and one of the 
+        given dtype: the dtype of this array if numpy would keep it, and otherwise float64 
+        or int64, which the base arrays also support. Booleans are treated as integers. 
+        """
+        dtype = numpy.result_type(self.dtype, dtype)
+        if dtype.kind not in "biuf": 
+            raise TypeError("Unsupported dtype of result: " + str(dtype))
+        if divide and dtype.kind != "f": 
+            dtype = numpy.dtype(numpy.float64)
+        if dtype != self.dtype: 
+            dtype = numpy.dtype(numpy.float64 if dtype.kind == "f" else numpy.int64)
+        
+        return dtype 
+
+    def __addDense(self, D, subtract, first, out): 
+        """
+        Return this 2d array plus the numpy array D of the same shape, or minus D if 
+        subtract is True, or D minus this array if subtract is True and first is False. 
+        The result is dense: D (or its negation) is copied to out, or a new array if out is 
+        None, and the nonzero elements of this array are added to it in parallel. 
+        """
+        D = numpy.asarray(D)
+        if D.shape != self.shape: 
+            raise ValueError("Cannot add arrays of shapes " + str(self.shape) + " and " + str(D.shape))
+        
+        if out is None: 
+            out = numpy.array(D, self.__resultType(D.dtype))
+        elif out.shape != self.shape: 
+            raise ValueError("Expecting out of shape " + str(self.shape) + ", got " + str(out.shape))
+        elif out is not D: 
+            out[...] = D 
+        
+        if subtract and first: 
+            numpy.negative(out, out)
+        
+        self._array.scatterAdd(out, -1 if subtract and not first else 1)
+        return out 
+
+    def __hadamardDense(self, D, out): 
+        """
+        Return the element-wise product of this 2d array and the numpy array D of the same 
+        shape as a sparse array with the nonzero structure of this one, reading D only at 
+        the nonzero elements. If out is this array it is changed in place. 
+        """
+        D = numpy.asarray(D)
+        if D.shape != self.shape: 
+            raise ValueError("Cannot multiply arrays of shapes " + str(self.shape) + " and " + str(D.shape))
+        
+        if out is self: 
+            if not numpy.can_cast(D.dtype, self.dtype, "same_kind"): 
+                raise TypeError("Cannot multiply an array of dtype " + str(self.dtype) + " by " + str(D.dtype) + " in place")
+            
+            self._array.gatherMultiply(numpy.asarray(D, self.dtype))
+            return self 
+        
+        dtype = self.__resultType(D.dtype)
+        result, values = self.__structureCopy(dtype)
+        self._array.gatherMultiply(numpy.asarray(D, dtype), values)
+        return result 
+
+    def __broadcastLine(self, d): 
+        """
+        Return d as a vector and True if it broadcasts over the rows of this array (it has 
+        shape (m, 1)) or False if it broadcasts over the columns (shape (1, n) or (n, )), 
+        and otherwise None, None. 
+        """
+        d = numpy.asarray(d)
+        
+        if d.shape == (self.shape[0], 1): 
+            return d[:, 0], True 
+        elif d.shape == (1, self.shape[1]) or d.shape == (self.shape[1], ): 
+            return d.ravel(), False 
+        else: 
+            return None, None 
+
+    def __structureCopy(self, dtype): 
+        """
+        Return a new 2d array of the given dtype with the nonzero structure of this one, 
+        and a writeable view of its values to fill in. 
+        """
+        result = csarray(self.shape, dtype, self.storagetype)
+        outerIndexPtr, innerIndexPtr, values = result._array.allocateCompressed(self.getnnz())
+        outerIndexPtr[:] = self.outerIndexPtr()
+        innerIndexPtr[:] = self.innerIndexPtr()
+        return result, values 
 
-    def mean(self, axis=None): 
+    def mean(self, axis=None, dtype=None): 
         """
         Find the mean value of this array. 
         
         :param axis: The axis of the array to compute the mean. 
+        
+        :param dtype: The dtype of the mean along an axis, by default float64 for integer arrays and the dtype of this array otherwise. 
         """
         if self.ndim == 2: 
-            return self._array.mean(axis)
+            return self._array.mean(axis, dtype)
         else: 
             return self._array.mean()
 
-    def min(self): 
+    def min(self, axis=None): 
         """
         Find the minimum element of this array. 
+        
+        :param axis: The axis along which to find the minimum elements, or None for the whole array. 
         """
-        return self._array.min()
+        if self.ndim == 2: 
+            return self._array.min(axis)
+        else: 
+            return self._array.min()
 
     def nonzero(self): 
         """
@@ -438,30 +948,52 @@ class csarray(object):
         Returns two arrays indPtr, colInds, such that colInds[indPtr[i]:indPtr[i+1]] 
         is the set of nonzero elements in the ith row of this matrix. 
         """        
-        cdef numpy.ndarray[int, ndim=1, mode="c"] rowInds = numpy.zeros(self.nnz, dtype=numpy.int32) 
-        cdef numpy.ndarray[int, ndim=1, mode="c"] colInds = numpy.zeros(self.nnz, dtype=numpy.int32) 
-        cdef numpy.ndarray[int, ndim=1, mode="c"] indPtr
+        if self.storagetype == "row": 
+            return numpy.array(self.outerIndexPtr()), numpy.array(self.innerIndexPtr())
+        else: 
+            indPtr, colInds, positions = self._array.secondaryIndex()
+            return numpy.array(indPtr), numpy.array(colInds)
         
-        result = csarray(self, storagetype="row")
-        rowInds, colInds = result._array.nonzero()
-        indPtr = numpy.cumsum(numpy.bincount(rowInds, minlength=self.shape[0]), dtype=numpy.int32)
-        indPtr = numpy.array(numpy.r_[numpy.array([0]), indPtr], numpy.int32)
-            
-        return indPtr, colInds 
+
+    def norm(self, axis=None, ord=None): 
+        """
+        Return the Frobenius norm of this 2d array, or the norms of the vectors along an 
+        axis, e.g. A.norm(1) gives the Euclidean norms of the rows. 
         
+        :param axis: The axis along which to compute norms, or None for the whole array. 
+        
+        :param ord: The order of the norms along an axis: None or 2 for Euclidean norms, 1 for sums of absolute values and numpy.inf for maximum absolute values. 
+        """
+        if self.ndim == 2: 
+            return self._array.norm(axis, ord)
+        else: 
+            return self._array.norm()
+
+    def outerIndexPtr(self): 
+        """
+        Return the outer index pointer as a read-only numpy view of the underlying storage 
+        (compressing the array first), such that the nonzeros of column i (column major) or 
+        row i (row major) are at positions outerIndexPtr[i]:outerIndexPtr[i+1] of innerIndexPtr 
+        and valuePtr. The view must not be used after the nonzero elements of this array change. 
+        """
+        return self._array.outerIndexPtr()
 
-    def pdot(self, A): 
+    def pdot(self, A, num_threads=None): 
         """
         Compute the dot product between this and either a csarray or numpy array
-        using multithreading.
+        using multithreading. The dtype of the result is chosen as in dot. Work 
+        is divided between threads so that each gets a similar number of nonzeros. 
         
         :param A: The input numpy array or csarray.  
+        
+        :param num_threads: The number of threads to use, by default the number of CPUs. 
+        :type num_threads: `int`
         """
         if isinstance(A, numpy.ndarray):  
             if A.ndim == 2: 
-                result = self._array.pdot2d(A)
+                result = self._array.pdot2d(A, num_threads)
             else: 
-                result = self._array.pdot1d(A)
+                result = self._array.pdot1d(A, num_threads)
         else: 
             raise ValueError("Cannot pdot with A of type " + str(type(A)))
             
@@ -473,6 +1005,9 @@ class csarray(object):
         
         :param n: The exponent of the power. 
         """
+        if self.ndim == 2: 
+            return self.mapValues(numpy.power, (n, ), dtype=self.dtype)
+        
         return self._array.power(n)
 
     def prune(self, double eps=10**-10, double precision=10**-20): 
@@ -483,19 +1018,26 @@ class csarray(object):
         self._array.prune(eps, precision) 
         
         
-    def put(self, data, rowInds, colInds, init=False): 
+    def put(self, data, rowInds, colInds, init=False, mode="overwrite", duplicates="sum"): 
         """
         Put some values into this matrix into the corresponding rowInds and colInds. We have 
         A[rowInds[i], colInds[i]] = data[i]/data. Notice that this is faster if init=True 
-        but this setting is to be used only if the matrix has just been created.
+        but this setting is to be used only if the matrix has just been created. Otherwise 
+        the values are sorted and merged with the existing elements in a single pass. 
         
         :param vals: A scalar or numpy array with the same dimension as rowsInds and colInds 
         
         :param rowInds: A 1d numpy array of row indices. 
         
         :param colInds: A 1d numpy array of column indices. 
+        
+        :param mode: How to combine with existing elements when init=False: "overwrite" sets A[i, j] = v, "accumulate" sets A[i, j] += v and "max" sets A[i, j] = max(A[i, j], v), where elements not yet stored just take v. Repeated indices are applied in order. 
+        :type mode: `str`
+        
+        :param duplicates: How to combine repeated indices when init=True: "sum", "last", "max" or "min". 
+        :type duplicates: `str`
         """
-        self._array.put(data, rowInds, colInds, init)
+        self._array.put(data, rowInds, colInds, init, mode, duplicates)
         
         
     def reserve(self, int n): 
@@ -520,6 +1062,9 @@ class csarray(object):
         """
         Take the sign of the nonzero elements of this array, and return a new array. 
         """
+        if self.ndim == 2: 
+            return self.mapValues(numpy.sign, dtype=self.dtype)
+        
         result = csarray(self.shape, self.dtype)
         result._array = self._array.sign()
         return result         
@@ -528,15 +1073,23 @@ class csarray(object):
         """
         Take the sine of the nonzero elements of this array, and return a new array. 
         """
+        if self.ndim == 2: 
+            return self.mapValues(numpy.sin, dtype=numpy.float64)
+        
         result = csarray(self.shape, self.dtype)
         result._array = self._array.sin()
         return result      
       
-    def std(self): 
+    def std(self, axis=None): 
         """
         Return the standard deviation of the array elements. 
+        
+        :param axis: The axis along which to compute the standard deviations, or None for the whole array. 
         """
-        return self._array.std()
+        if self.ndim == 2: 
+            return self._array.std(axis)
+        else: 
+            return self._array.std()
 
     def submatrix(self, startRow, startCol, blockRows, blockCols):
         """
@@ -564,53 +1117,75 @@ class csarray(object):
         result._array = self._array.submatrix(startRow, startCol, blockRows, blockCols)
         return result
 
-    def sum(self, axis=None): 
+    def sum(self, axis=None, dtype=None): 
         """
         Sum all of the elements in this array. If one specifies an axis 
         then we sum along the axis. 
         
         :param axis: The axis to sum along. 
+        
+        :param dtype: The dtype to sum along an axis in, by default int64 for integer arrays and the dtype of this array otherwise. 
         """
         if self.ndim == 2: 
-            return self._array.sum(axis)
+            return self._array.sum(axis, dtype)
         else: 
             return self._array.sum()
 
-    def toarray(self): 
+    def toarray(self, out=None, rows=None, cols=None, num_threads=None): 
         """
-        Convert this sparse array into a numpy array. 
+        Convert this sparse array into a numpy array. For 2d arrays the result has the 
+        dtype of this array and is written straight from the compressed storage in 
+        parallel, and one can convert just a block of rows and columns, e.g. 
+        A.toarray(rows=slice(i, i+100)) for a minibatch of rows. 
+        
+        :param out: An optional 2d array of the dtype of this array or float64, of the shape of the block and in C or Fortran order, to write the result into. 
+        
+        :param rows: None for all rows or a slice with step 1 of the rows to convert. 
+        
+        :param cols: None for all columns or a slice with step 1 of the columns to convert. 
+        
+        :param num_threads: The number of threads to use, by default the number of CPUs. 
         """
-        return self._array.toarray()
+        if self.ndim == 2: 
+            return self._array.toarray(out, rows, cols, num_threads)
+        else: 
+            return self._array.toarray()
                      
-    def toScipyCsc(self): 
+    def toScipyCsc(self, copy=True): 
         """
-        Convert this matrix to a scipy sparse matrix. Returns a copy of the data in 
-        csc_matrix form.  
+        Convert this matrix to a scipy sparse matrix in csc_matrix form. This is built 
+        directly from the compressed storage of this array. 
+        
+        :param copy: If False and this array is column major, the csc_matrix shares memory 
+            with this array and is only valid as long as the nonzeros of this array are unchanged. 
         """  
         try: 
             import scipy.sparse
         except ImportError: 
             raise 
     
-        rowInds, colInds = self.nonzero()  
-        values = self.values()
-        A = scipy.sparse.csc_matrix((values, (rowInds, colInds)), shape=self.shape)
-        return A 
+        if self.storagetype == "col": 
+            return scipy.sparse.csc_matrix((self.valuePtr(), self.innerIndexPtr(), self.outerIndexPtr()), shape=self.shape, copy=copy)
+        else: 
+            return scipy.sparse.csr_matrix((self.valuePtr(), self.innerIndexPtr(), self.outerIndexPtr()), shape=self.shape, copy=False).tocsc()
         
-    def toScipyCsr(self): 
+    def toScipyCsr(self, copy=True): 
         """
-        Convert this matrix to a scipy sparse matrix. Returns a copy of the data in 
-        csr_matrix form. 
+        Convert this matrix to a scipy sparse matrix in csr_matrix form. This is built 
+        directly from the compressed storage of this array. 
+        
+        :param copy: If False and this array is row major, the csr_matrix shares memory 
+            with this array and is only valid as long as the nonzeros of this array are unchanged. 
         """  
         try: 
             import scipy.sparse
         except ImportError: 
             raise 
     
-        rowInds, colInds = self.nonzero()  
-        values = self.values()
-        A = scipy.sparse.csr_matrix((values, (rowInds, colInds)), shape=self.shape)
-        return A 
+        if self.storagetype == "row": 
+            return scipy.sparse.csr_matrix((self.valuePtr(), self.innerIndexPtr(), self.outerIndexPtr()), shape=self.shape, copy=copy)
+        else: 
+            return scipy.sparse.csc_matrix((self.valuePtr(), self.innerIndexPtr(), self.outerIndexPtr()), shape=self.shape, copy=False).tocsr()
 
     def trace(self): 
         """
@@ -622,12 +1197,35 @@ class csarray(object):
     def transpose(self): 
         """
         Swap the rows and columns of this matrix, i.e. perform a transpose operation. 
+        If the array is mapped onto external storage (e.g. a memory mapped file) then the 
+        result is a mapped array on the same storage with the other storage type, so 
+        that nothing is copied. 
         """
+        if self.ndim == 2 and self._array.isMapped(): 
+            if self.storagetype == "col": 
+                storagetype = "row"
+            else: 
+                storagetype = "col"
+            
+            result = csarray((self.shape[1], self.shape[0]), self.dtype, storagetype)
+            outerIndexPtr, innerIndexPtr, values, owner = self._array.buffers
+            result._array.mapCompressed(outerIndexPtr, innerIndexPtr, values, self._array.copyOnWrite, owner)
+            return result 
+        
         resultArray = self._array.transpose()
         result = csarray(resultArray.shape, self.dtype)
         result._array = resultArray
         return result
 
+    def valuePtr(self): 
+        """
+        Return the values of the nonzero elements in the order of innerIndexPtr as a numpy 
+        view of the underlying storage (compressing the array first). Writing to the view 
+        changes this array. The view must not be used after the nonzero elements of this 
+        array change. 
+        """
+        return self._array.valuePtr()
+
     def values(self): 
         """
         Return the values of this object according to the elements returned 
@@ -635,13 +1233,62 @@ class csarray(object):
         """
         return self._array.values()
     
-    def var(self): 
+    def var(self, axis=None): 
         """
         Return the variance of the elements of this array. 
+        
+        :param axis: The axis along which to compute the variances, or None for the whole array. 
         """
-        return self._array.var()
+        if self.ndim == 2: 
+            return self._array.var(axis)
+        else: 
+            return self._array.var()
     
     dtype = property(__getDType)
     T = property(transpose)
     baseTypes = [csarray_int_colMajor, csarray_double_colMajor, csarray_float_colMajor, csarray_long_colMajor, csarray_short_colMajor, csarray_signed_char_colMajor]
     baseTypes.extend([csarray_int_rowMajor, csarray_double_rowMajor, csarray_float_rowMajor, csarray_long_rowMajor, csarray_short_rowMajor, csarray_signed_char_rowMajor])
+
+def checkCompressed(shape, storagetype, outerIndexPtr, innerIndexPtr, values): 
+    """
+    Check that the int32 arrays outerIndexPtr and innerIndexPtr and the values describe 
+    a valid compressed array of the given shape and storage type (see fromCompressed), 
+    and raise a ValueError otherwise. 
+    """
+    if storagetype == "col": 
+        innerSize = shape[0]
+    else: 
+        innerSize = shape[1]
+    
+    if outerIndexPtr.shape[0] == 0 or outerIndexPtr[0] != 0 or (numpy.diff(outerIndexPtr) < 0).any(): 
+        raise ValueError("outerIndexPtr must start at 0 and be non-decreasing")
+    
+    nnz = outerIndexPtr[outerIndexPtr.shape[0]-1]
+    
+    if innerIndexPtr.shape[0] < nnz or values.shape[0] < nnz: 
+        raise ValueError("innerIndexPtr and values must have at least " + str(nnz) + " elements")
+    
+    inds = innerIndexPtr[0:nnz]
+    
+    if nnz != 0 and (inds.min() < 0 or inds.max() >= innerSize): 
+        raise ValueError("Inner indices out of range")
+    
+    #Inner indices must increase strictly except at the start of each outer vector 
+    decreasing = numpy.diff(inds) <= 0
+    starts = outerIndexPtr[1:outerIndexPtr.shape[0]-1]
+    decreasing[starts[numpy.logical_and(starts > 0, starts < nnz)] - 1] = False
+    if decreasing.any(): 
+        raise ValueError("Inner indices must be sorted and unique within each outer vector")
+
+def unpickleCompressed(shape, dtype, storagetype, outerIndexPtr, innerIndexPtr, values): 
+    """
+    Create a pickled 2d csarray which uses the buffers outerIndexPtr, innerIndexPtr and 
+    values as its storage, copying them only when the array is written to. 
+    """
+    dtype = numpy.dtype(dtype)
+    result = csarray(shape, dtype=dtype, storagetype=storagetype)
+    outerIndexPtr = numpy.frombuffer(outerIndexPtr, numpy.int32)
+    innerIndexPtr = numpy.frombuffer(innerIndexPtr, numpy.int32)
+    values = numpy.frombuffer(values, dtype)
+    result._array.mapCompressed(outerIndexPtr, innerIndexPtr, values, True)
+    return result 
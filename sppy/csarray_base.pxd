@@ -9,9 +9,13 @@ cdef extern from *:
 cdef extern from "include/SparseMatrixExt.h":  
    cdef cppclass SparseMatrixExt[T, S]:  
       double norm()
+      int* innerIndexPtr()
+      int* outerIndexPtr()
       int biCGSTAB(T*, int, T*, int, double) 
       long cols() 
       long nonZeros()
+      long outerSize()
+      long innerSize()
       long rows()
       long size() 
       SparseMatrixExt() 
@@ -26,17 +30,23 @@ cdef extern from "include/SparseMatrixExt.h":
       SparseMatrixExt[T, S] subtract(SparseMatrixExt[T, S]&)
       SparseMatrixExt[T, S] trans()
       T coeff(int, int)
+      T* valuePtr()
       T sum()
       T sumValues()
       vector[int] getIndsCol(int)
       vector[int] getIndsRow(int)
-      void dot1d(double*, double*) nogil 
-      void dot2d(double*, int, double*) nogil 
-      void dotSub1d(double*, int,  int, double*) nogil 
-      void dotSub2d(double*, int,  int, int, double*) nogil 
+      void secondaryIndex(int*, int*, int*)
+      void dot1d[U](U*, U*) nogil 
+      void dot2d[U](U*, int, U*) nogil 
+      void dotSub1d[U](U*, int,  int, U*) nogil 
+      void dotSub2d[U](U*, int,  int, int, U*) nogil 
       void fill(T)
       void insertVal(int, int, T) 
       void makeCompressed()
+      void take(SparseMatrixExt[T, S])
+      void mapCompressed(int, int, int*, int*, T*)
+      void ownStorage()
+      bint isMapped()
       void nonZeroInds(int*, int*)
       void nonZeroVals(T*)
       void printValues()
@@ -45,14 +55,42 @@ cdef extern from "include/SparseMatrixExt.h":
       void putSorted(long*, long*, T*, int, long*)
       void putUsingTriplets2(int*, int*, T, int)
       void putUsingTriplets(int*, int*, T*, int) 
+      void putMerge(int*, int*, T*, int, long, int, bint) 
+      void countOuter(int*, int*, long, int*)
+      void reserveOuter(int*)
+      void allocateCompressed(int)
+      void appendTriplets(int*, int*, T*, int, long)
+      void finishTriplets(int)
       void reserve(int)
       void scalarMultiply(double)
+      void setCompressed(int, int, int*, int*, T*)
       void setZero()
-      void slice(int*, int, int*, int, SparseMatrixExt[T, S]*) 
+      void splitOuter(int, long*)
+      void sumPartials[U](U*, int, long, long, long, U*) nogil 
+      void gatherCount(int*, int, int, int*, int*) nogil 
+      void gatherFill(int*, int, int, int*, int*, bint, int*, int*, T*) nogil 
+      void rangeCount(int*, int, int, int, int, int, int*) nogil 
+      void rangeFill(int*, int, int, int, int, int, int*, int*, T*) nogil 
+      void groupQueries(int*, int, int*, int*) 
+      void lookupGroups(int*, int, int, int*, int*, int*, T*) nogil 
+      void lookupPairs(int*, int*, int, int, T*) nogil 
+      void densify[U](int, int, int, int, int, U*, long, long) nogil 
+      bint containsPattern(SparseMatrixExt[T, S]&, int, int) nogil 
+      void addPattern(SparseMatrixExt[T, S]&, T, int, int) nogil 
+      void mergeScaled(SparseMatrixExt[T, S]&, T) 
+      void scaleLines[U](U*, bint, bint, int, int, U*) nogil 
+      void scatterAdd[U](int, int, U, U*, long, long) nogil 
+      void gatherMultiply[U](int, int, U*, long, long, U*) nogil 
+      void productLines(SparseMatrixExt[T, S]&, int, int, double, int, int*, int*, T*, int, int*, T*, int*) nogil 
+      void reduceOuter[U](int, int, int, U*, U*, int*, int*, int*) nogil 
+      void reduceInner[U](int, U*, U*, int*, int*, int*) nogil 
       void unsafeInsertVal2(int, int, T)
       void unsafeInsertVal(int, int, T)
       
 cdef template[DataType, StorageType] class csarray:
-    cdef SparseMatrixExt[DataType, StorageType] *thisPtr  
+    cdef SparseMatrixExt[DataType, StorageType] *thisPtr
+    cdef readonly object buffers 
+    cdef readonly bint copyOnWrite
+    cdef object secondary  
 
 
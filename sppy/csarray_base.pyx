@@ -8,11 +8,55 @@ from sppy.dtype import dataTypeDict
 from cython.parallel import prange 
 import numpy 
 import multiprocessing 
+from multiprocessing.pool import ThreadPool 
 cimport numpy
 import cython 
 numpy.import_array()
 from libc.math cimport sqrt 
 
+#Ways of combining the values given to put with the existing elements, and of combining 
+#repeated indices when initialising with put 
+putModes = {"overwrite": 0, "accumulate": 1, "max": 2}
+duplicateModes = {"last": 0, "sum": 1, "max": 2, "min": 3}
+
+#The reductions along an axis computed by reduceOuter and reduceInner 
+reduceOps = {"sum": 0, "abssum": 1, "sumsq": 2, "sqdev": 3, "max": 4, "min": 5, "count": 6}
+
+#The smallest number of values given to each thread by mapValues 
+mapBlockSize = 2**16 
+
+#The bytes the accumulators of dotCsarray2d may use in total, unless the operands are larger 
+productWorkspace = 2**28 
+
+cdef numpy.ndarray bufferView(void* data, numpy.npy_intp size, int typeNum, object owner, bint writeable): 
+    """
+    Return a 1d numpy array of size elements which points at data and keeps owner 
+    alive, so that the memory stays valid for the lifetime of the array. 
+    """
+    cdef numpy.ndarray result
+    
+    if size == 0 or data == NULL: 
+        result = numpy.PyArray_SimpleNew(1, &size, typeNum)
+    else: 
+        result = numpy.PyArray_SimpleNewFromData(1, &size, typeNum, data)
+        numpy.set_array_base(result, owner)
+    
+    if not writeable: 
+        result.flags.writeable = False
+    return result 
+
+def balancedSplits(numpy.ndarray outerPtr, int numParts): 
+    """
+    Split the outer vectors of an array with outer index pointer outerPtr into numParts 
+    contiguous ranges splits[i]:splits[i+1] with similar numbers of nonzeros plus outer 
+    vectors, so that they can be written in parallel. 
+    """
+    numOuter = outerPtr.shape[0]-1
+    splits = numpy.array(numpy.searchsorted(outerPtr + numpy.arange(numOuter+1), numpy.linspace(0, outerPtr[numOuter] + numOuter, numParts+1)), numpy.int)
+    splits[0] = 0 
+    splits[numParts] = numOuter 
+    return splits 
+
 cdef template[DataType, StorageType] class csarray:
     def __cinit__(self, shape): 
         """
@@ -24,24 +68,64 @@ cdef template[DataType, StorageType] class csarray:
         """
         Return a matrix whose elements are the absolute values of this array. 
         """
-        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((self.shape[0], self.shape[1]))
-        del result.thisPtr
-        result.thisPtr = new SparseMatrixExt[DataType, StorageType](self.thisPtr.abs())
+        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((0, 0))
+        result.thisPtr.take(self.thisPtr.abs())
         return result 
       
-    def __adArraySlice(self, numpy.ndarray[numpy.int_t, ndim=1, mode="c"] rowInds, numpy.ndarray[numpy.int_t, ndim=1, mode="c"] colInds): 
+    def __adArraySlice(self, rowInds, colInds, numThreads=None): 
         """
         Array slicing where one passes two arrays of the same length and elements are picked 
-        according to self[rowInds[i], colInds[i]). 
-        """
-        cdef int ix 
-        cdef numpy.ndarray[DataType, ndim=1, mode="c"] result = numpy.zeros(rowInds.shape[0], self.dtype())
+        according to self[rowInds[i], colInds[i]]. The pairs can be in any order and negative 
+        indices count from the end. The pairs are grouped by outer vector with a counting sort 
+        and each group is found with one sweep of its outer vector, in parallel using numThreads 
+        threads. When there are few pairs compared to the number of outer vectors, or more 
+        pairs than nonzeros, each is found with a (parallel) binary search instead. 
+        """
+        cdef numpy.ndarray[int, ndim=1, mode="c"] outerQ, innerQ, queryPtr, order, groups 
+        cdef numpy.ndarray[long, ndim=1, mode="c"] splits 
+        cdef int numQueries, i, threads 
+        
+        rowInds = self.__selection(rowInds, self.shape[0])
+        colInds = self.__selection(colInds, self.shape[1])
+        
+        if rowInds.shape[0] != colInds.shape[0]: 
+            raise ValueError("Index arrays must have the same length: " + str(rowInds.shape[0]) + " " + str(colInds.shape[0]))
+        
+        cdef numpy.ndarray result = numpy.zeros(rowInds.shape[0], self.dtype())
+        cdef DataType* resultPtr = <DataType*>numpy.PyArray_DATA(result)
+        numQueries = rowInds.shape[0]
+        
+        if numQueries == 0: 
+            return result 
+        
+        if self.storage == "rowMajor": 
+            outerQ, innerQ = rowInds, colInds 
+        else: 
+            outerQ, innerQ = colInds, rowInds 
+        
+        self.thisPtr.makeCompressed()
+        
+        #Grouping only pays off when the queries are many but the array is too big to stay in cache 
+        if numQueries*8 < self.thisPtr.outerSize() or numQueries >= self.thisPtr.nonZeros(): 
+            threads = min(self.__numThreads(numThreads), numQueries)
+            splits = numpy.array(numpy.linspace(0, numQueries, threads+1), numpy.int)
+            
+            for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+                self.thisPtr.lookupPairs(&outerQ[0], &innerQ[0], splits[i], splits[i+1], resultPtr)
+            
+            return result 
+        
+        queryPtr = numpy.zeros(self.thisPtr.outerSize()+1, numpy.int32)
+        order = numpy.zeros(numQueries, numpy.int32)
+        self.thisPtr.groupQueries(&outerQ[0], numQueries, &queryPtr[0], &order[0])
         
-        if (rowInds >= self.shape[0]).any() or (colInds >= self.shape[1]).any(): 
-            raise ValueError("Indices out of range")
+        groups = numpy.array(numpy.flatnonzero(numpy.diff(queryPtr)), numpy.int32)
+        threads = min(self.__numThreads(numThreads), groups.shape[0])
+        splits = balancedSplits(numpy.r_[queryPtr[groups], numQueries], threads)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            self.thisPtr.lookupGroups(&groups[0], splits[i], splits[i+1], &queryPtr[0], &order[0], &innerQ[0], resultPtr)
         
-        for ix in range(rowInds.shape[0]): 
-                result[ix] = self.thisPtr.coeff(rowInds[ix], colInds[ix])
         return result
   
     def __add__(csarray[DataType, StorageType] self, csarray[DataType, StorageType] A): 
@@ -51,9 +135,8 @@ cdef template[DataType, StorageType] class csarray:
         if self.shape != A.shape: 
             raise ValueError("Cannot add matrices of shapes " + str(self.shape) + " and " + str(A.shape))
         
-        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((self.shape[0], A.shape[1]))
-        del result.thisPtr
-        result.thisPtr = new SparseMatrixExt[DataType, StorageType](self.thisPtr.add(deref(A.thisPtr)))
+        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((0, 0))
+        result.thisPtr.take(self.thisPtr.add(deref(A.thisPtr)))
         return result   
           
     def __dealloc__(self): 
@@ -88,9 +171,11 @@ cdef template[DataType, StorageType] class csarray:
         Get a value or set of values from the array (denoted A). Currently 3 types of parameters 
         are supported. If i,j = inds are integers then the corresponding elements of the array 
         are returned. If i,j are both arrays of ints then we return the corresponding 
-        values of A[i[k], j[k]] (note: i,j must be sorted in ascending order). If one of 
+        values of A[i[k], j[k]] in the order given. If one of 
         i or j is a slice e.g. A[[1,2], :] then we return the submatrix corresponding to 
-        the slice. 
+        the slice. Slices can have steps and negative bounds, and a slice of the inner 
+        indices (e.g. A[1000:2000, :] for column major arrays) only touches the nonzeros 
+        in range. 
         """        
         
         i, j = inds 
@@ -103,59 +188,46 @@ cdef template[DataType, StorageType] class csarray:
         inds = i,j
         
         if type(i) == numpy.ndarray and type(j) == numpy.ndarray: 
-            return self.__adArraySlice(numpy.ascontiguousarray(i, dtype=numpy.int) , numpy.ascontiguousarray(j, dtype=numpy.int) )
+            return self.__adArraySlice(i, j)
         elif (type(i) == numpy.ndarray or isinstance(i, slice)) and (isinstance(j, slice) or type(j) == numpy.ndarray):
-            indList = []            
-            for k, index in enumerate(inds):  
-                if isinstance(index, numpy.ndarray): 
-                    indList.append(index) 
-                elif isinstance(index, slice): 
-                    if index.start == None: 
-                        start = 0
-                    else: 
-                        start = index.start
-                    if index.stop == None: 
-                        stop = self.shape[k]
-                    else:
-                        stop = min(index.stop, self.shape[k])  
-                    indArr = numpy.arange(start, stop)
-                    indList.append(indArr)
-            return self.subArray(indList[0], indList[1])
+            if self.storage == "rowMajor": 
+                outer, inner, outerSize = i, j, self.shape[0]
+            else: 
+                outer, inner, outerSize = j, i, self.shape[1]
+                
+            if isinstance(inner, slice): 
+                if isinstance(outer, slice): 
+                    outer = numpy.arange(*outer.indices(outerSize))
+                return self.__rangeSlice(self.__selection(outer, outerSize), inner)
+            
+            if isinstance(i, slice): 
+                i = numpy.arange(*i.indices(self.shape[0]))
+            if isinstance(j, slice): 
+                j = numpy.arange(*j.indices(self.shape[1]))
+            return self.subArray(i, j)
         elif ((isinstance(i, int) or isinstance(i, numpy.integer))  and isinstance(j, slice)) or (isinstance(i, slice) and (isinstance(j, int) or isinstance(j, numpy.integer))):                
             if isinstance(i, int) or isinstance(i, numpy.integer): 
-                inds = self.rowInds(i)
+                inds, positions = self.__line(i, True)
                 slc = j 
-                if slc.start == None: 
-                    start = 0
-                else: 
-                    start = slc.start 
-                if slc.stop == None: 
-                    stop = self.shape[1]
-                else: 
-                    stop = slc.stop 
-                    
-                result = csarray[DataType, StorageType]((self.shape[1], 1))   
-                
-                for ind in inds: 
-                    if start <= ind < stop: 
-                        result[ind, 0] = self.thisPtr.coeff(i, ind)                 
-            elif isinstance(j, int) or isinstance(j, numpy.integer): 
-                inds = self.colInds(j)
+                size = self.shape[1]
+            else: 
+                inds, positions = self.__line(j, False)
                 slc = i 
-                if slc.start == None: 
-                    start = 0
-                else: 
-                    start = slc.start 
-                if slc.stop == None: 
-                    stop = self.shape[0]
-                else: 
-                    stop = slc.stop 
-                    
-                result = csarray[DataType, StorageType]((self.shape[0], 1))   
+                size = self.shape[0]
                 
-                for ind in inds: 
-                    if start <= ind < stop: 
-                        result[ind, 0] = self.thisPtr.coeff(ind, j)  
+            #Keep the indices in the range of the slice and map them to positions in it 
+            start, stop, step = slc.indices(size)
+            length = len(range(start, stop, step))
+            
+            if step > 0: 
+                mask = numpy.logical_and(inds >= start, inds < stop)
+            else: 
+                mask = numpy.logical_and(inds <= start, inds > stop)
+            mask = numpy.logical_and(mask, (inds - start) % step == 0)
+            
+            inds = numpy.array((inds[mask] - start) // step, numpy.int32)
+            result = csarray[DataType, StorageType]((length, 1))   
+            result.put(self.valuePtr()[positions][mask], inds, numpy.zeros(inds.shape[0], numpy.int32), True)
             return result 
         else:     
             #Deal with negative indices
@@ -182,9 +254,8 @@ cdef template[DataType, StorageType] class csarray:
         """
         Return the negation of this array. 
         """
-        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((self.shape[1], self.shape[0]))
-        del result.thisPtr
-        result.thisPtr = new SparseMatrixExt[DataType, StorageType](self.thisPtr.negate())
+        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((0, 0))
+        result.thisPtr.take(self.thisPtr.negate())
         return result       
 
 
@@ -208,6 +279,7 @@ cdef template[DataType, StorageType] class csarray:
         Set elements of the array. If i,j = inds are integers then the corresponding 
         value in the array is set. 
         """
+        self.__prepareWrite()
         i, j = inds 
         
         if type(i) == numpy.ndarray and type(j) == numpy.ndarray: 
@@ -234,11 +306,115 @@ cdef template[DataType, StorageType] class csarray:
         if self.shape != A.shape: 
             raise ValueError("Cannot subtract matrices of shapes " + str(self.shape) + " and " + str(A.shape))
         
-        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((self.shape[0], A.shape[1]))
-        del result.thisPtr
-        result.thisPtr = new SparseMatrixExt[DataType, StorageType](self.thisPtr.subtract(deref(A.thisPtr)))
+        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((0, 0))
+        result.thisPtr.take(self.thisPtr.subtract(deref(A.thisPtr)))
         return result    
 
+    def addScaled(self, csarray[DataType, StorageType] A, alpha=1, numThreads=None): 
+        """
+        Add alpha*A to this array in place. When the nonzero elements of A are a subset 
+        of those of this array, for example when they have the same structure, the values 
+        are updated in place in parallel over ranges of outer vectors using numThreads 
+        threads. Otherwise the sum is found with a single merge into new storage. 
+        """
+        cdef int i, threads 
+        cdef DataType scale = alpha 
+        
+        if self.shape != A.shape: 
+            raise ValueError("Cannot add matrices of shapes " + str(self.shape) + " and " + str(A.shape))
+        
+        self.__prepareWrite()
+        self.thisPtr.makeCompressed()
+        A.thisPtr.makeCompressed()
+        
+        threads = min(self.__numThreads(numThreads), max(self.thisPtr.outerSize(), 1))
+        cdef numpy.ndarray[long, ndim=1, mode="c"] splits = numpy.zeros(threads+1, numpy.int)
+        cdef numpy.ndarray[int, ndim=1, mode="c"] contained = numpy.zeros(threads, numpy.int32)
+        self.thisPtr.splitOuter(threads, &splits[0])
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            contained[i] = self.thisPtr.containsPattern(deref(A.thisPtr), splits[i], splits[i+1])
+        
+        if numpy.all(contained): 
+            for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+                self.thisPtr.addPattern(deref(A.thisPtr), scale, splits[i], splits[i+1])
+        else: 
+            self.thisPtr.mergeScaled(deref(A.thisPtr), scale)
+
+    def allocateCompressed(self, int nnz): 
+        """
+        Replace the elements of this array with nnz uninitialised ones in compressed 
+        storage, and return writeable views (outerIndexPtr, innerIndexPtr, values) of the 
+        storage so that it can be filled directly, for example from a file. The caller 
+        must write a valid compressed structure, see setCompressed. 
+        """
+        self.__prepareWrite()
+        self.thisPtr.allocateCompressed(nnz)
+        self.buffers = None 
+        
+        outerIndexPtr = bufferView(self.thisPtr.outerIndexPtr(), self.thisPtr.outerSize()+1, numpy.NPY_INT32, self, True)
+        innerIndexPtr = bufferView(self.thisPtr.innerIndexPtr(), nnz, numpy.NPY_INT32, self, True)
+        values = bufferView(self.thisPtr.valuePtr(), nnz, numpy.dtype(self.dtype()).num, self, True)
+        
+        return outerIndexPtr, innerIndexPtr, values 
+
+    def argmax(self, axis=None): 
+        """
+        Return the index of the first maximum element of this array, as an index into 
+        the flattened (row major) array, or of each column (axis=0) or row (axis=1). 
+        """
+        return self.__argExtreme("max", axis)
+    
+    def argmin(self, axis=None): 
+        """
+        Return the index of the first minimum element of this array, as an index into 
+        the flattened (row major) array, or of each column (axis=0) or row (axis=1). 
+        """
+        return self.__argExtreme("min", axis)
+    
+    def __argExtreme(self, op, axis): 
+        """
+        Return the index of the first max or min (op), see argmax. 
+        """
+        if axis != None: 
+            return numpy.array(self.__extreme(op, axis)[1], numpy.intp)
+        elif self.size == 0: 
+            raise ValueError("Cannot find the arg" + op + " of an empty array")
+        
+        result, args = self.__extreme(op, 1)
+        i = numpy.argmax(result) if op == "max" else numpy.argmin(result)
+        return int(i*self.shape[1] + args[i])
+    
+    def __extreme(self, op, axis): 
+        """
+        Return the max or min (op) of each column (axis=0) or row (axis=1) of this 
+        array and the first index at which it occurs, including the elements which 
+        are not stored. 
+        """
+        if axis != 0 and axis != 1: 
+            raise ValueError("Invalid axis: " + str(axis))
+        
+        cdef int n = self.shape[axis] 
+        if n == 0: 
+            raise ValueError("Cannot find the " + op + " along an axis of length 0")
+        
+        result, counts, args, gaps = self.reduceAxis(op, axis)
+        implicit = counts < n 
+        
+        #A line whose stored indices are 0, ..., count-1 has its first zero at count 
+        noGap = implicit & (gaps == -1)
+        gaps[noGap] = counts[noGap]
+        
+        if op == "max": 
+            zeroBetter = result < 0 
+        else: 
+            zeroBetter = result > 0 
+        
+        useGap = implicit & (zeroBetter | ((result == 0) & (gaps < args)) | (counts == 0))
+        result[implicit & zeroBetter] = 0 
+        args[useGap] = gaps[useGap]
+        return result, args
+
     def biCGSTAB(self, numpy.ndarray[DataType, ndim=1, mode="c"] v, int maxIter=1000, double tol=10**-6):         
         cdef int outputCode = 0  
         cdef numpy.ndarray[DataType, ndim=1, mode="c"] result = numpy.zeros(v.shape[0])
@@ -289,15 +465,10 @@ cdef template[DataType, StorageType] class csarray:
         return result 
             
     def colInds(self, int i): 
-        cdef unsigned int j
-        cdef vector[int] vect = self.thisPtr.getIndsCol(i)
-        cdef numpy.ndarray[int, ndim=1, mode="c"] inds = numpy.zeros(vect.size(), numpy.int32)
-        
-        #Must be a better way to do this 
-        for j in range(vect.size()): 
-            inds[j] = vect[j]
-
-        return inds  
+        """
+        Returns the non zero indices for the ith column. 
+        """
+        return numpy.array(self.__line(i, False)[0])
 
     def compress(self): 
         """
@@ -315,6 +486,16 @@ cdef template[DataType, StorageType] class csarray:
         result.thisPtr = new SparseMatrixExt[DataType, StorageType](deref(self.thisPtr))
         return result 
     
+    def countNonzero(self, axis=None): 
+        """
+        Return the number of nonzero elements of this array, not including stored 
+        zeros, or the number in each column (axis=0) or row (axis=1). 
+        """
+        if axis == None: 
+            return int(numpy.count_nonzero(self.valuePtr()))
+        else: 
+            return self.reduceAxis("count", axis, numpy.int64)[0]
+
     def cos(self): 
         """
         Take the cosine of the nonzero elements of this array, and return a new array. 
@@ -328,7 +509,7 @@ cdef template[DataType, StorageType] class csarray:
         values = numpy.cos(self.values()) 
         
         result.put(values, rowInds, colInds, init=True) 
-        return result     
+        return result
     
     def diag(self): 
         """
@@ -345,36 +526,123 @@ cdef template[DataType, StorageType] class csarray:
             
         return result
     
-    def dotCsarray2d(self, csarray[DataType, StorageType] A): 
+    def dotCsarray2d(self, csarray[DataType, StorageType] A, threshold=None, topk=None, numThreads=None): 
+        """
+        Find the product of this array and A with the row-wise (Gustavson) algorithm, 
+        computing each outer vector of the result (a row for row major arrays and a column 
+        for column major ones) in one of the threads. Each thread accumulates in a hash 
+        table sized by the largest number of products in an outer vector, or a dense array 
+        if that is as small, and the number of threads is limited so that the tables fit in 
+        productWorkspace bytes (or the size of the operands if larger). Elements of absolute 
+        value below threshold are dropped and, if topk is not None, only the topk elements 
+        of largest absolute value are kept in each outer vector. A first pass counts the 
+        elements of each outer vector and a second writes them into storage of exactly the 
+        size of the result. 
+        """
         if self.shape[1] != A.shape[0]: 
             raise ValueError("Cannot multiply matrices of shapes " + str(self.shape) + " and " + str(A.shape))
+        if topk is not None and (not (isinstance(topk, int) or isinstance(topk, numpy.integer)) or topk < 0): 
+            raise ValueError("topk must be a nonnegative integer: " + str(topk))
         
         cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((self.shape[0], A.shape[1]))
-        del result.thisPtr
-        result.thisPtr = new SparseMatrixExt[DataType, StorageType](self.thisPtr.dot(deref(A.thisPtr)))
+        cdef csarray[DataType, StorageType] outer = self 
+        cdef csarray[DataType, StorageType] lines = A 
+        cdef int i, threads, tableSize 
+        cdef double cutoff = 0 if threshold is None else threshold 
+        cdef int k = -1 if topk is None else topk 
+        
+        #Outer vector j of the result combines the outer vectors of lines given by outer vector j of outer 
+        if self.storage != "rowMajor": 
+            outer, lines = A, self 
+        
+        outer.thisPtr.makeCompressed()
+        lines.thisPtr.makeCompressed()
+        cdef int outerSize = outer.thisPtr.outerSize()
+        cdef int innerSize = max(lines.thisPtr.innerSize(), 1)
+        
+        #Count the multiplications of each outer vector, to size the tables and balance the threads 
+        outerPtr = outer.outerIndexPtr()
+        lineSizes = numpy.diff(lines.outerIndexPtr())
+        work = numpy.zeros(outer.thisPtr.nonZeros()+1, numpy.int64)
+        numpy.cumsum(lineSizes[outer.innerIndexPtr()], out=work[1:])
+        work = work[outerPtr]
+        
+        maxProducts = numpy.diff(work).max(initial=0)
+        tableSize = 1 << int(2*maxProducts).bit_length()
+        if tableSize >= innerSize: 
+            tableSize = innerSize 
+        
+        itemSize = numpy.dtype(self.dtype()).itemsize 
+        budget = max(productWorkspace, (outer.thisPtr.nonZeros() + lines.thisPtr.nonZeros())*(itemSize + 4))
+        threads = min(self.__numThreads(numThreads), max(outerSize, 1), max(budget // (tableSize*(itemSize + 8)), 1))
+        cdef numpy.ndarray[long, ndim=1, mode="c"] splits = balancedSplits(work, threads)
+        
+        cdef numpy.ndarray[int, ndim=2, mode="c"] keys = numpy.empty((threads, tableSize), numpy.int32)
+        cdef numpy.ndarray[DataType, ndim=2, mode="c"] acc = numpy.zeros((threads, tableSize), self.dtype())
+        cdef numpy.ndarray[int, ndim=2, mode="c"] touched = numpy.zeros((threads, tableSize), numpy.int32)
+        cdef numpy.ndarray[int, ndim=1, mode="c"] counts = numpy.zeros(outerSize+1, numpy.int32)
+        keys.fill(-1)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            outer.thisPtr.productLines(deref(lines.thisPtr), splits[i], splits[i+1], cutoff, k, &counts[1], NULL, NULL, tableSize, &keys[i, 0], &acc[i, 0], &touched[i, 0])
+        
+        nnz = numpy.sum(counts, dtype=numpy.int64)
+        if nnz > numpy.iinfo(numpy.int32).max: 
+            raise ValueError("Product has too many nonzero elements: " + str(nnz))
+        
+        outerIndexPtr, innerIndexPtr, values = result.allocateCompressed(nnz)
+        numpy.cumsum(counts, out=outerIndexPtr)
+        
+        cdef int* resultOuter = <int*>numpy.PyArray_DATA(outerIndexPtr)
+        cdef int* resultInner = <int*>numpy.PyArray_DATA(innerIndexPtr)
+        cdef DataType* resultValues = <DataType*>numpy.PyArray_DATA(values)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            outer.thisPtr.productLines(deref(lines.thisPtr), splits[i], splits[i+1], cutoff, k, resultOuter, resultInner, resultValues, tableSize, &keys[i, 0], &acc[i, 0], &touched[i, 0])
+        
         return result 
 
-    def dotNumpy1d(self, numpy.ndarray[double, ndim=1, mode="c"] v): 
+    def dotNumpy1d(self, numpy.ndarray v not None): 
         """
-        Take this array and multiply it with a numpy array. 
+        Take this array and multiply it with a numpy array. If v has the same dtype 
+        as this array then the product is computed and returned in that dtype, 
+        otherwise v is converted to float64. 
         """
         if self.shape[1] != v.shape[0]: 
             raise ValueError("Cannot multiply matrices of shapes " + str(self.shape) + " and " + str(v.shape[0]))
         
-        cdef numpy.ndarray[double, ndim=1, mode="c"] result = numpy.zeros(self.shape[0])
-        self.thisPtr.dot1d(&v[0], &result[0])
+        cdef numpy.ndarray result 
+        
+        if v.dtype == self.dtype(): 
+            v = numpy.ascontiguousarray(v)
+            result = numpy.zeros(self.shape[0], v.dtype)
+            self.thisPtr.dot1d(<DataType*>numpy.PyArray_DATA(v), <DataType*>numpy.PyArray_DATA(result))
+        else: 
+            v = numpy.ascontiguousarray(v, numpy.float64)
+            result = numpy.zeros(self.shape[0], numpy.float64)
+            self.thisPtr.dot1d(<double*>numpy.PyArray_DATA(v), <double*>numpy.PyArray_DATA(result))
             
         return result    
     
-    def dotNumpy2d(self, numpy.ndarray[double, ndim=2, mode="c"] A): 
+    def dotNumpy2d(self, numpy.ndarray A not None): 
         """
-        Take this array and multiply it with a numpy array. 
+        Take this array and multiply it with a numpy array. If A has the same dtype 
+        as this array then the product is computed and returned in that dtype, 
+        otherwise A is converted to float64. 
         """
         if self.shape[1] != A.shape[0]: 
             raise ValueError("Cannot multiply matrices of shapes " + str(self.shape) + " and " + str((A.shape[0], A.shape[1])))
         
-        cdef numpy.ndarray[double, ndim=2, mode="c"] result = numpy.zeros((self.shape[0], A.shape[1]))
-        self.thisPtr.dot2d(&A[0, 0], A.shape[1], &result[0, 0])
+        cdef numpy.ndarray result 
+        
+        if A.dtype == self.dtype(): 
+            A = numpy.ascontiguousarray(A)
+            result = numpy.zeros((self.shape[0], A.shape[1]), A.dtype)
+            self.thisPtr.dot2d(<DataType*>numpy.PyArray_DATA(A), A.shape[1], <DataType*>numpy.PyArray_DATA(result))
+        else: 
+            A = numpy.ascontiguousarray(A, numpy.float64)
+            result = numpy.zeros((self.shape[0], A.shape[1]), numpy.float64)
+            self.thisPtr.dot2d(<double*>numpy.PyArray_DATA(A), A.shape[1], <double*>numpy.PyArray_DATA(result))
             
         return result     
 
@@ -397,8 +665,81 @@ cdef template[DataType, StorageType] class csarray:
         numpy.floor(self.values(), values) 
         
         result.put(values, rowInds, colInds, init=True) 
-        return result        
+        return result
     
+    def gatherMultiply(self, numpy.ndarray dense not None, numpy.ndarray out=None, numThreads=None): 
+        """
+        Multiply the nonzero values of this array by the elements at the same positions 
+        of the 2d numpy array dense, of the same shape, reading only those elements. The 
+        results are written to out, an array of length nnz with the dtype of dense, or to 
+        the values of this array if out is None, in which case dense must have the dtype 
+        of this array. The dtype of dense must be that of this array, float64 or int64. 
+        Returns out. 
+        """
+        cdef int i, threads, kind 
+        cdef long outerStride, innerStride 
+        
+        if out is None: 
+            self.__prepareWrite()
+        self.thisPtr.makeCompressed()
+        
+        if out is None: 
+            out = bufferView(self.thisPtr.valuePtr(), self.thisPtr.nonZeros(), numpy.dtype(self.dtype()).num, self, True)
+        elif out.ndim != 1 or out.shape[0] != self.thisPtr.nonZeros() or not out.flags.c_contiguous: 
+            raise ValueError("out must be a contiguous 1d array of length " + str(self.thisPtr.nonZeros()))
+        
+        if out.dtype != dense.dtype: 
+            raise ValueError("out and dense must have the same dtype: " + str(out.dtype) + " " + str(dense.dtype))
+        
+        kind = self.__denseKind(dense)
+        outerStride, innerStride = self.__denseStrides(dense)
+        threads = min(self.__numThreads(numThreads), max(self.thisPtr.outerSize(), 1))
+        cdef numpy.ndarray[long, ndim=1, mode="c"] splits = numpy.zeros(threads+1, numpy.int)
+        self.thisPtr.splitOuter(threads, &splits[0])
+        
+        cdef void* denseP = numpy.PyArray_DATA(dense)
+        cdef void* outP = numpy.PyArray_DATA(out)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            if kind == 0: 
+                self.thisPtr.gatherMultiply(splits[i], splits[i+1], <DataType*>denseP, outerStride, innerStride, <DataType*>outP)
+            elif kind == 1: 
+                self.thisPtr.gatherMultiply(splits[i], splits[i+1], <double*>denseP, outerStride, innerStride, <double*>outP)
+            else: 
+                self.thisPtr.gatherMultiply(splits[i], splits[i+1], <long*>denseP, outerStride, innerStride, <long*>outP)
+        
+        return out 
+
+    def __denseKind(self, numpy.ndarray dense): 
+        """
+        Check that dense is a 2d array of the shape of this one and return 0 if its dtype 
+        is that of this array, 1 if it is float64 and 2 if it is int64. 
+        """
+        if dense.ndim != 2 or dense.shape[0] != self.shape[0] or dense.shape[1] != self.shape[1]: 
+            raise ValueError("Expecting a dense array of shape " + str(self.shape) + ", got " + str((<object>dense).shape))
+        
+        if dense.dtype == self.dtype(): 
+            return 0 
+        elif dense.dtype == numpy.float64: 
+            return 1 
+        elif dense.dtype == numpy.int64: 
+            return 2 
+        else: 
+            raise ValueError("Invalid dtype of dense array: " + str(dense.dtype))
+    
+    def __denseStrides(self, numpy.ndarray dense): 
+        """
+        Return the strides, in elements, of the outer and inner indices of this array in 
+        the 2d numpy array dense. 
+        """
+        rowStride = dense.strides[0]//dense.itemsize 
+        colStride = dense.strides[1]//dense.itemsize 
+        
+        if self.storage == "colMajor": 
+            return colStride, rowStride 
+        else: 
+            return rowStride, colStride 
+
     def getnnz(self): 
         """
         Return the number of non-zero elements in the array 
@@ -412,21 +753,23 @@ cdef template[DataType, StorageType] class csarray:
         if self.shape != A.shape: 
             raise ValueError("Cannot elementwise multiply matrices of shapes " + str(self.shape) + " and " + str(A.shape))
         
-        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((self.shape[0], A.shape[1]))
-        del result.thisPtr
-        result.thisPtr = new SparseMatrixExt[DataType, StorageType](self.thisPtr.hadamard(deref(A.thisPtr)))
+        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((0, 0))
+        result.thisPtr.take(self.thisPtr.hadamard(deref(A.thisPtr)))
         return result    
    
-    def max(self): 
+    def max(self, axis=None): 
         """
-        Find the maximum element of this array. 
+        Find the maximum element of this array, or of each column (axis=0) or row 
+        (axis=1). 
         """
         cdef numpy.ndarray[int, ndim=1, mode="c"] rowInds
         cdef numpy.ndarray[int, ndim=1, mode="c"] colInds
         cdef unsigned int i
         cdef DataType maxVal
         
-        if self.size == 0: 
+        if axis != None: 
+            return self.__extreme("max", axis)[0]
+        elif self.size == 0: 
             return float("nan")
         elif self.getnnz() != self.size: 
             maxVal = 0 
@@ -442,32 +785,86 @@ cdef template[DataType, StorageType] class csarray:
             
         return maxVal         
 
-    def mean(self, axis=None): 
+    def innerIndexPtr(self): 
+        """
+        Return the inner indices (row indices for column major arrays and column indices 
+        for row major ones) of the nonzero elements as a read-only numpy view of the 
+        underlying storage. The array is compressed first. The view is invalid once 
+        the nonzero elements of this array are changed. 
+        """
+        self.thisPtr.makeCompressed()
+        return bufferView(self.thisPtr.innerIndexPtr(), self.thisPtr.nonZeros(), numpy.NPY_INT32, self, False)
+        
+    def mapValues(self, ufunc, args=(), numpy.ndarray out=None, casting="same_kind", numThreads=None, int position=0): 
+        """
+        Apply ufunc to the values v of the nonzero elements of this array, as ufunc(v, *args) 
+        or with v at the given position among args, without changing the structure. The 
+        results are written to out, an array of length nnz, or back to the values of this 
+        array if out is None. Large value buffers are split into blocks which are mapped 
+        in parallel by numThreads threads, since numpy releases the GIL in ufunc loops. 
+        Returns out. 
+        """
+        if out is None: 
+            self.__prepareWrite()
+        self.thisPtr.makeCompressed()
+        
+        values = bufferView(self.thisPtr.valuePtr(), self.thisPtr.nonZeros(), numpy.dtype(self.dtype()).num, self, out is None)
+        if out is None: 
+            out = values 
+        elif out.ndim != 1 or out.shape[0] != values.shape[0]: 
+            raise ValueError("out must be a 1d array of length " + str(values.shape[0]))
+        
+        args = tuple(args)
+        numBlocks = min(self.__numThreads(numThreads), values.shape[0]//mapBlockSize + 1)
+        splits = numpy.array(numpy.linspace(0, values.shape[0], numBlocks+1), numpy.int)
+        
+        def mapBlock(i): 
+            ufunc(*(args[0:position] + (values[splits[i]:splits[i+1]], ) + args[position:]), out=out[splits[i]:splits[i+1]], casting=casting)
+        
+        if numBlocks == 1: 
+            mapBlock(0)
+        else: 
+            pool = ThreadPool(numBlocks)
+            try: 
+                pool.map(mapBlock, range(numBlocks))
+            finally: 
+                pool.close()
+        
+        return out 
+    
+    def mean(self, axis=None, dtype=None): 
         """
         Find the mean value of this array. 
         
         :param axis: The axis of the array to compute the mean. 
+        
+        :param dtype: The dtype of the mean along an axis, by default float64 for integer arrays and the dtype of this array otherwise. 
         """
         if self.thisPtr.size() != 0:
             if axis ==None: 
                 return self.sum()/float(self.thisPtr.size())
             elif axis == 0: 
-                return self.sum(0)/float(self.shape[0])
+                return self.sum(0, self.__floatType(dtype))/float(self.shape[0])
             elif axis == 1: 
-                return self.sum(1)/float(self.shape[1])
+                return self.sum(1, self.__floatType(dtype))/float(self.shape[1])
+            else:
+                raise ValueError("Invalid axis: " + str(axis))
         else: 
             return float("nan")
         
-    def min(self): 
+    def min(self, axis=None): 
         """
-        Find the minimum element of this array. 
+        Find the minimum element of this array, or of each column (axis=0) or row 
+        (axis=1). 
         """
         cdef numpy.ndarray[int, ndim=1, mode="c"] rowInds
         cdef numpy.ndarray[int, ndim=1, mode="c"] colInds
         cdef unsigned int i
         cdef DataType minVal 
         
-        if self.size == 0: 
+        if axis != None: 
+            return self.__extreme("min", axis)[0]
+        elif self.size == 0: 
             return float("nan")
         elif self.getnnz() != self.size: 
             minVal = 0 
@@ -495,56 +892,146 @@ cdef template[DataType, StorageType] class csarray:
         
         return (rowInds, colInds)
 
-    def norm(self): 
-        """
-        Return the Frobenius norm of this matrix. 
+    def norm(self, axis=None, ord=None): 
         """
+        Return the Frobenius norm of this matrix, or the norms of its columns (axis=0) 
+        or rows (axis=1). 
         
-        return self.thisPtr.norm()
+        :param ord: The order of the norms along an axis: None or 2 for the Euclidean norm, 1 for the sum of absolute values or numpy.inf for the maximum absolute value. 
+        """
+        if axis == None: 
+            if ord != None and ord != "fro": 
+                raise ValueError("Invalid norm order: " + str(ord))
+            return self.thisPtr.norm()
+        elif ord == None or ord == 2: 
+            return numpy.sqrt(self.reduceAxis("sumsq", axis, self.__floatType(None))[0])
+        elif ord == 1: 
+            return self.reduceAxis("abssum", axis, self.__floatType(None))[0]
+        elif ord == numpy.inf: 
+            return numpy.array(numpy.maximum(numpy.abs(self.max(axis)), numpy.abs(self.min(axis))), self.__floatType(None))
+        else: 
+            raise ValueError("Invalid norm order: " + str(ord))
 
     def ones(self): 
         """
         Fill the array with ones. 
         """
+        self.__prepareWrite()
         self.thisPtr.fill(1)
 
-    def pdot1d(self, numpy.ndarray[double, ndim=1, mode="c"] v not None): 
+    def outerIndexPtr(self): 
         """
-        Take this array and multiply it with a numpy array using multithreading. 
+        Return the outer index pointer, an array of length outerSize+1 such that the 
+        nonzeros of outer vector i are at positions outerIndexPtr[i]:outerIndexPtr[i+1] of 
+        innerIndexPtr and valuePtr. This is a read-only numpy view of the underlying 
+        storage, and the array is compressed first. The view is invalid once the nonzero 
+        elements of this array are changed. 
+        """
+        self.thisPtr.makeCompressed()
+        return bufferView(self.thisPtr.outerIndexPtr(), self.thisPtr.outerSize()+1, numpy.NPY_INT32, self, False)
+
+    def pdot1d(self, numpy.ndarray v not None, numThreads=None): 
+        """
+        Take this array and multiply it with a numpy array using numThreads threads 
+        (by default the number of CPUs). The dtype of the result follows the same 
+        rules as dotNumpy1d. 
         """
         if self.shape[1] != v.shape[0]: 
             raise ValueError("Cannot multiply using shapes " + str(self.shape) + " and " + str(v.shape[0]))
             
-        cdef numpy.ndarray[double, ndim=1, mode="c"] result = numpy.zeros(self.shape[0])  
-        cdef int numCpus = multiprocessing.cpu_count()                          
-        cdef int numJobs = numCpus
-        cdef int i  
-        cdef numpy.ndarray[numpy.int_t, ndim=1] rowInds = numpy.array(numpy.linspace(0, self.shape[0], numJobs+1), numpy.int)
-        
-        for i in prange(numJobs, nogil=True, num_threads=numCpus, schedule="static"):
-            self.thisPtr.dotSub1d(&v[0], rowInds[i], rowInds[i+1], &result[0])
+        if v.dtype == self.dtype(): 
+            v = numpy.ascontiguousarray(v)
+        else: 
+            v = numpy.ascontiguousarray(v, numpy.float64)
+            
+        cdef numpy.ndarray result = numpy.zeros(self.shape[0], v.dtype)  
+        self.__pdot(v, result, self.__numThreads(numThreads))
             
         return result          
 
-    def pdot2d(self, numpy.ndarray[double, ndim=2, mode="c"] A not None): 
+    def pdot2d(self, numpy.ndarray A not None, numThreads=None): 
         """
-        Take this array and multiply it with a numpy array using multithreading. 
+        Take this array and multiply it with a numpy array using numThreads threads 
+        (by default the number of CPUs). The dtype of the result follows the same 
+        rules as dotNumpy2d. 
         """
         if self.shape[1] != A.shape[0]: 
             raise ValueError("Cannot multiply matrices of shapes " + str(self.shape) + " and " + str(A.shape[0], A.shape[1]))
-        if self.storage != "rowMajor": 
-            raise ValueError("Only thread-safe on row major matrices")
             
-        cdef numpy.ndarray[double, ndim=2, mode="c"] result = numpy.zeros((self.shape[0], A.shape[1]))  
-        cdef int numCpus = multiprocessing.cpu_count()                          
-        cdef int numJobs = numCpus
+        if A.dtype == self.dtype(): 
+            A = numpy.ascontiguousarray(A)
+        else: 
+            A = numpy.ascontiguousarray(A, numpy.float64)
+            
+        cdef numpy.ndarray result = numpy.zeros((self.shape[0], A.shape[1]), A.dtype)  
+        self.__pdot(A, result, self.__numThreads(numThreads))
+            
+        return result     
+
+    def __numThreads(self, numThreads): 
+        """
+        Return the number of threads to use given the user supplied value, which 
+        is the number of CPUs if numThreads is None. 
+        """
+        if numThreads is None: 
+            return multiprocessing.cpu_count()
+        elif numThreads < 1: 
+            raise ValueError("Invalid number of threads: " + str(numThreads))
+        else: 
+            return int(numThreads)
+
+    def __pdot(self, numpy.ndarray A, numpy.ndarray result, int numThreads): 
+        """
+        Add self.dot(A) to result using numThreads threads. A and result are C-contiguous 
+        1d or 2d arrays of either DataType or float64. The outer vectors are split into 
+        ranges with equal numbers of nonzeros (plus outer vectors) using splitOuter. Row 
+        major arrays give each thread a range of rows. For column major arrays each thread 
+        takes a range of columns and scatters into its own zeroed copy of result, and these 
+        copies are then summed in parallel over blocks of result, so there are no concurrent 
+        writes. This uses numThreads times the memory of result. 
+        """
+        cdef bint sameType = A.dtype == self.dtype()
+        cdef bint is1d = A.ndim == 1
+        cdef int numCols = 1 
+        cdef long size = result.size 
+        cdef long partialSize = 0 
         cdef int i  
-        cdef numpy.ndarray[numpy.int_t, ndim=1] rowInds = numpy.array(numpy.linspace(0, self.shape[0], numJobs+1), numpy.int)
+        cdef numpy.ndarray partials = result 
+        cdef numpy.ndarray[long, ndim=1, mode="c"] outerInds = numpy.zeros(numThreads+1, numpy.int)
+        cdef numpy.ndarray[numpy.int_t, ndim=1] resultInds = numpy.array(numpy.linspace(0, size, numThreads+1), numpy.int)
         
-        for i in prange(numJobs, nogil=True, num_threads=numCpus, schedule="static"):
-            self.thisPtr.dotSub2d(&A[0, 0], result.shape[1],  rowInds[i], rowInds[i+1], &result[0, 0])
+        if not is1d: 
+            numCols = A.shape[1]
             
-        return result     
+        self.thisPtr.splitOuter(numThreads, &outerInds[0])
+        
+        if self.storage != "rowMajor" and numThreads > 1: 
+            partials = numpy.zeros(numThreads*size, result.dtype)
+            partialSize = size 
+        
+        cdef DataType* AT = <DataType*>numpy.PyArray_DATA(A)
+        cdef DataType* partialsT = <DataType*>numpy.PyArray_DATA(partials)
+        cdef DataType* resultT = <DataType*>numpy.PyArray_DATA(result)
+        cdef double* AD = <double*>numpy.PyArray_DATA(A)
+        cdef double* partialsD = <double*>numpy.PyArray_DATA(partials)
+        cdef double* resultD = <double*>numpy.PyArray_DATA(result)
+        
+        for i in prange(numThreads, nogil=True, num_threads=numThreads, schedule="static"):
+            if sameType and is1d: 
+                self.thisPtr.dotSub1d(AT, outerInds[i], outerInds[i+1], partialsT + i*partialSize)
+            elif sameType: 
+                self.thisPtr.dotSub2d(AT, numCols, outerInds[i], outerInds[i+1], partialsT + i*partialSize)
+            elif is1d: 
+                self.thisPtr.dotSub1d(AD, outerInds[i], outerInds[i+1], partialsD + i*partialSize)
+            else: 
+                self.thisPtr.dotSub2d(AD, numCols, outerInds[i], outerInds[i+1], partialsD + i*partialSize)
+        
+        if partialSize != 0: 
+            for i in prange(numThreads, nogil=True, num_threads=numThreads, schedule="static"):
+                if sameType: 
+                    self.thisPtr.sumPartials(partialsT, numThreads, size, resultInds[i], resultInds[i+1], resultT)
+                else: 
+                    self.thisPtr.sumPartials(partialsD, numThreads, size, resultInds[i], resultInds[i+1], resultD)
 
     def power(self, n): 
         """
@@ -561,59 +1048,433 @@ cdef template[DataType, StorageType] class csarray:
         """
         Suppresses all nonzeros which are much smaller in magnitude than eps under the tolerence precision. 
         """
+        self.__prepareWrite()
         self.thisPtr.prune(eps, precision) 
 
-    def put(self, val, numpy.ndarray[int, ndim=1] rowInds not None, numpy.ndarray[int, ndim=1] colInds not None, init=False): 
+    def put(self, val, numpy.ndarray[int, ndim=1] rowInds not None, numpy.ndarray[int, ndim=1] colInds not None, init=False, mode="overwrite", duplicates="sum"): 
         """
         Put some values into this matrix. Notice, that this is faster if init=True and 
-        the matrix has just been created. 
+        the matrix has just been created, in which case repeated indices are combined 
+        according to duplicates ("sum", "last", "max" or "min"). Otherwise the values are 
+        merged with the existing elements in one pass, and mode is one of "overwrite", 
+        "accumulate" or "max". 
         """  
-        cdef unsigned int ix         
-        
+        self.__prepareWrite()
         if init: 
-            if type(val) == numpy.ndarray: 
+            if duplicates not in duplicateModes: 
+                raise ValueError("Unknown duplicates policy: " + str(duplicates))
+            
+            if duplicates != "sum": 
+                self.thisPtr.setZero()
+                self.__putMerge(val, rowInds, colInds, duplicateModes[duplicates], True)
+            elif type(val) == numpy.ndarray: 
                 self.__putUsingTriplets(val, rowInds, colInds)
             else:
                 self.__putUsingTriplets2(val, rowInds, colInds)
         else: 
-            self.reserve(int(len(rowInds)*1.2))
-            
-            if type(val) == numpy.ndarray:
-                for ix in range(len(rowInds)):
-                    self.thisPtr.insertVal(rowInds[ix], colInds[ix], val[ix])
-                """elif type(val) == csarray[DataType, StorageType]: 
-                    #This is a slice operation 
-                    rowInds2, colInds2 = val.nonzero()
-                    values = val.values()
-                    for i in range(len(rowInds2)): 
-                        self.thisPtr.insertVal(rowInds[rowInds2[i]], colInds[colInds2[i]], values[i])    
-                """            
-            else:
-                for ix in range(len(rowInds)):
-                    self.thisPtr.insertVal(rowInds[ix], colInds[ix], val)   
+            if mode not in putModes: 
+                raise ValueError("Unknown put mode: " + str(mode))
+            
+            self.__putMerge(val, rowInds, colInds, putModes[mode], False)
+
+    def __putMerge(self, val, rowInds, colInds, int mode, bint storeZeros): 
+        """
+        Merge the values into the existing elements, combining them according to the 
+        code mode of SparseMatrixExt.putMerge. 
+        """
+        cdef numpy.ndarray[int, ndim=1, mode="c"] rowIndsC 
+        cdef numpy.ndarray[int, ndim=1, mode="c"] colIndsC 
+        cdef numpy.ndarray[DataType, ndim=1, mode="c"] vals 
+        cdef int valStride 
+        
+        rowIndsC, colIndsC, vals, valStride = self.__triplets(val, rowInds, colInds)
+        
+        if rowIndsC.shape[0] != 0: 
+            self.thisPtr.putMerge(&rowIndsC[0], &colIndsC[0], &vals[0], valStride, rowIndsC.shape[0], mode, storeZeros)
+
+    def putChunks(self, chunks, duplicates="sum"): 
+        """
+        Replace the elements of this array with those given by chunks of (rowInds, colInds, 
+        values), combining repeated indices according to duplicates. The chunks are written 
+        straight into the storage of the array. If chunks is callable it is called to get an 
+        iterator over the chunks, and this happens twice (as does iterating over a list) so 
+        that the room for each outer vector is counted first. Chunks from a one-off iterator 
+        such as a generator are read once and the room grows as needed. 
+        """
+        cdef numpy.ndarray[int, ndim=1, mode="c"] rowIndsC 
+        cdef numpy.ndarray[int, ndim=1, mode="c"] colIndsC 
+        cdef numpy.ndarray[DataType, ndim=1, mode="c"] vals 
+        cdef numpy.ndarray[int, ndim=1, mode="c"] counts 
+        cdef int valStride 
+        
+        self.__prepareWrite()
+        
+        if duplicates not in duplicateModes: 
+            raise ValueError("Unknown duplicates policy: " + str(duplicates))
+        
+        if callable(chunks): 
+            source = chunks 
+        elif iter(chunks) is not chunks: 
+            source = lambda: chunks 
+        else: 
+            source = None 
+        
+        self.thisPtr.setZero()
+        
+        if source != None: 
+            counts = numpy.zeros(self.thisPtr.outerSize(), numpy.int32)
+            
+            for rowInds, colInds, val in source(): 
+                rowIndsC, colIndsC, vals, valStride = self.__triplets(val, rowInds, colInds)
+                if rowIndsC.shape[0] != 0: 
+                    self.thisPtr.countOuter(&rowIndsC[0], &colIndsC[0], rowIndsC.shape[0], &counts[0])
+            
+            if counts.shape[0] != 0: 
+                self.thisPtr.reserveOuter(&counts[0])
+            del counts 
+            chunks = source()
+        
+        for rowInds, colInds, val in chunks: 
+            rowIndsC, colIndsC, vals, valStride = self.__triplets(val, rowInds, colInds)
+            if rowIndsC.shape[0] != 0: 
+                self.thisPtr.appendTriplets(&rowIndsC[0], &colIndsC[0], &vals[0], valStride, rowIndsC.shape[0])
+        
+        self.thisPtr.finishTriplets(duplicateModes[duplicates])
+
+    def __triplets(self, val, rowInds, colInds): 
+        """
+        Check a set of elements to put into this array and return them as contiguous arrays 
+        of row indices, column indices and values of the right dtype, along with the stride 
+        of the values (0 if val is a scalar). 
+        """
+        cdef numpy.ndarray[int, ndim=1, mode="c"] rowIndsC = numpy.ascontiguousarray(rowInds, numpy.int32)
+        cdef numpy.ndarray[int, ndim=1, mode="c"] colIndsC = numpy.ascontiguousarray(colInds, numpy.int32)
+        cdef numpy.ndarray[DataType, ndim=1, mode="c"] vals 
+        cdef int valStride = 1 
+        cdef long n = rowIndsC.shape[0]
+        
+        if colIndsC.shape[0] != n: 
+            raise ValueError("Number of row and column indices must match: " + str(n) + " " + str(colIndsC.shape[0]))
+        
+        if numpy.ndim(val) != 0: 
+            vals = numpy.ascontiguousarray(val, self.dtype())
+            if vals.shape[0] != n: 
+                raise ValueError("Number of values must match number of indices: " + str(vals.shape[0]) + " " + str(n))
+        else: 
+            vals = numpy.array([val], self.dtype())
+            valStride = 0 
+            
+        if n != 0: 
+            if rowIndsC.min() < 0 or rowIndsC.max() >= self.thisPtr.rows(): 
+                raise ValueError("Invalid row index " + str(rowIndsC.min() if rowIndsC.min() < 0 else rowIndsC.max()))
+            if colIndsC.min() < 0 or colIndsC.max() >= self.thisPtr.cols(): 
+                raise ValueError("Invalid col index " + str(colIndsC.min() if colIndsC.min() < 0 else colIndsC.max()))
+        
+        return rowIndsC, colIndsC, vals, valStride 
+
+    def reduceAxis(self, op, axis, dtype=None, center=None, numThreads=None): 
+        """
+        Reduce the stored elements of each column (axis=0) or row (axis=1) of this array 
+        with op, one of the keys of reduceOps, reading the values once. When the lines 
+        are the outer vectors they are split into ranges reduced in parallel with 
+        numThreads threads, otherwise the values are scattered into the result in a 
+        single pass. The accumulator has the dtype of this array, or float64 or int64 if 
+        dtype is another floating point or integer type, and the result is cast to dtype. 
+        Returns the result, the number of stored elements of each line, the index of the 
+        max/min of each line and the first index of each line which is not stored (or -1). 
+        
+        :param center: For "sqdev", the values to subtract from the elements of each line. 
+        """
+        cdef int opCode, kind, i, threads 
+        cdef int numLines 
+        cdef bint isOuter 
+        
+        if op not in reduceOps: 
+            raise ValueError("Invalid reduction: " + str(op))
+        if axis != 0 and axis != 1: 
+            raise ValueError("Invalid axis: " + str(axis))
+        
+        opCode = reduceOps[op]
+        numLines = self.shape[1-axis]
+        isOuter = (axis == 0) == (self.storage == "colMajor")
+        dtype = numpy.dtype(self.dtype() if dtype is None else dtype)
+        
+        if dtype == numpy.dtype(self.dtype()): 
+            kind = 0 
+            accType = dtype 
+        elif dtype.kind == "f": 
+            kind = 1 
+            accType = numpy.float64 
+        else: 
+            kind = 2 
+            accType = numpy.int64 
+        
+        result = numpy.zeros(numLines, accType)
+        counts = numpy.zeros(numLines, numpy.int32)
+        args = numpy.zeros(numLines, numpy.int32)
+        gaps = -numpy.ones(numLines, numpy.int32)
+        
+        if center is None: 
+            center = numpy.zeros(numLines, accType)
+        else: 
+            center = numpy.ascontiguousarray(center, accType)
+            if center.shape != (numLines, ): 
+                raise ValueError("center must have length " + str(numLines))
+        
+        if isOuter: 
+            threads = min(self.__numThreads(numThreads), max(numLines, 1))
+        else: 
+            threads = 1 
+        
+        cdef numpy.ndarray[long, ndim=1, mode="c"] splits = numpy.zeros(threads+1, numpy.int)
+        self.thisPtr.makeCompressed()
+        self.thisPtr.splitOuter(threads, &splits[0])
+        
+        cdef void* centerP = numpy.PyArray_DATA(center)
+        cdef void* resultP = numpy.PyArray_DATA(result)
+        cdef int* countsP = <int*>numpy.PyArray_DATA(counts)
+        cdef int* argsP = <int*>numpy.PyArray_DATA(args)
+        cdef int* gapsP = <int*>numpy.PyArray_DATA(gaps)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            if kind == 0 and isOuter: 
+                self.thisPtr.reduceOuter(opCode, splits[i], splits[i+1], <DataType*>centerP, <DataType*>resultP, countsP, argsP, gapsP)
+            elif kind == 0: 
+                self.thisPtr.reduceInner(opCode, <DataType*>centerP, <DataType*>resultP, countsP, argsP, gapsP)
+            elif kind == 1 and isOuter: 
+                self.thisPtr.reduceOuter(opCode, splits[i], splits[i+1], <double*>centerP, <double*>resultP, countsP, argsP, gapsP)
+            elif kind == 1: 
+                self.thisPtr.reduceInner(opCode, <double*>centerP, <double*>resultP, countsP, argsP, gapsP)
+            elif isOuter: 
+                self.thisPtr.reduceOuter(opCode, splits[i], splits[i+1], <long*>centerP, <long*>resultP, countsP, argsP, gapsP)
+            else: 
+                self.thisPtr.reduceInner(opCode, <long*>centerP, <long*>resultP, countsP, argsP, gapsP)
+        
+        if result.dtype != dtype: 
+            result = numpy.array(result, dtype)
+        
+        return result, counts, args, gaps 
 
     def reserve(self, int n): 
         """
         Reserve n nonzero entries and turns the matrix into uncompressed mode. 
         """
+        self.__prepareWrite()
         self.thisPtr.reserve(n)
 
-    @cython.boundscheck(False)
     def rowInds(self, int i):
         """
         Returns the non zero indices for the ith row. 
         """
-        cdef unsigned int j
-        cdef vector[int] vect = self.thisPtr.getIndsRow(i)
-        cdef numpy.ndarray[int, ndim=1, mode="c"] inds = numpy.zeros(vect.size(), numpy.int32)
+        return numpy.array(self.__line(i, True)[0])
+
+    def scaleLines(self, factors, bint rows, bint divide=False, numpy.ndarray out=None, numThreads=None): 
+        """
+        Multiply (or divide if divide is True) each row of this array by the corresponding 
+        element of factors if rows is True, and otherwise each column, in one pass over 
+        the values in parallel over ranges of outer vectors. The results are written to 
+        out, an array of length nnz of the dtype of this array, float64 or int64, or to 
+        the values of this array if out is None. Returns out. 
+        """
+        cdef int i, threads 
+        cdef int kind = 0 
+        cdef bint byOuter = rows == (self.storage == "rowMajor")
+        
+        if out is None: 
+            self.__prepareWrite()
+        self.thisPtr.makeCompressed()
+        
+        if out is None: 
+            out = bufferView(self.thisPtr.valuePtr(), self.thisPtr.nonZeros(), numpy.dtype(self.dtype()).num, self, True)
+        elif out.ndim != 1 or out.shape[0] != self.thisPtr.nonZeros() or not out.flags.c_contiguous: 
+            raise ValueError("out must be a contiguous 1d array of length " + str(self.thisPtr.nonZeros()))
+        
+        if out.dtype == self.dtype(): 
+            kind = 0 
+        elif out.dtype == numpy.float64: 
+            kind = 1 
+        elif out.dtype == numpy.int64: 
+            kind = 2 
+        else: 
+            raise ValueError("Invalid dtype of out: " + str(out.dtype))
+        
+        if divide and out.dtype.kind != "f": 
+            raise TypeError("Can only divide into a floating point array: " + str(out.dtype))
+        
+        factors = numpy.ascontiguousarray(factors, out.dtype)
+        if factors.shape != (self.shape[0 if rows else 1], ): 
+            raise ValueError("Expecting " + str(self.shape[0 if rows else 1]) + " factors, got shape " + str(factors.shape))
+        
+        threads = min(self.__numThreads(numThreads), max(self.thisPtr.outerSize(), 1))
+        cdef numpy.ndarray[long, ndim=1, mode="c"] splits = numpy.zeros(threads+1, numpy.int)
+        self.thisPtr.splitOuter(threads, &splits[0])
+        
+        cdef void* factorsP = numpy.PyArray_DATA(factors)
+        cdef void* outP = numpy.PyArray_DATA(out)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            if kind == 0: 
+                self.thisPtr.scaleLines(<DataType*>factorsP, byOuter, divide, splits[i], splits[i+1], <DataType*>outP)
+            elif kind == 1: 
+                self.thisPtr.scaleLines(<double*>factorsP, byOuter, divide, splits[i], splits[i+1], <double*>outP)
+            else: 
+                self.thisPtr.scaleLines(<long*>factorsP, byOuter, divide, splits[i], splits[i+1], <long*>outP)
+        
+        return out 
+
+    def scatterAdd(self, numpy.ndarray dense not None, alpha=1, numThreads=None): 
+        """
+        Add alpha times this array to the 2d numpy array dense, of the same shape and in 
+        any memory order, in place. Only the nonzero elements of this array are read and 
+        the outer vectors are split into ranges added in parallel. The dtype of dense must 
+        be that of this array, float64 or int64. Returns dense. 
+        """
+        cdef int i, threads 
+        cdef long outerStride, innerStride 
+        cdef int kind = self.__denseKind(dense)
+        cdef DataType alphaT = alpha 
+        cdef double alphaD = alpha 
+        cdef long alphaL = alpha 
+        
+        if not dense.flags.writeable: 
+            raise ValueError("dense must be writeable")
+        
+        self.thisPtr.makeCompressed()
+        outerStride, innerStride = self.__denseStrides(dense)
+        threads = min(self.__numThreads(numThreads), max(self.thisPtr.outerSize(), 1))
+        cdef numpy.ndarray[long, ndim=1, mode="c"] splits = numpy.zeros(threads+1, numpy.int)
+        self.thisPtr.splitOuter(threads, &splits[0])
+        
+        cdef void* denseP = numpy.PyArray_DATA(dense)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            if kind == 0: 
+                self.thisPtr.scatterAdd(splits[i], splits[i+1], alphaT, <DataType*>denseP, outerStride, innerStride)
+            elif kind == 1: 
+                self.thisPtr.scatterAdd(splits[i], splits[i+1], alphaD, <double*>denseP, outerStride, innerStride)
+            else: 
+                self.thisPtr.scatterAdd(splits[i], splits[i+1], alphaL, <long*>denseP, outerStride, innerStride)
+        
+        return dense 
+
+    def secondaryIndex(self): 
+        """
+        Return read-only arrays (indPtr, outerInds, positions) giving the nonzeros of this 
+        array in the other storage order, i.e. by row for column major arrays and by column 
+        for row major ones. The nonzeros of inner vector i have outer indices 
+        outerInds[indPtr[i]:indPtr[i+1]], in increasing order, and values 
+        valuePtr()[positions[indPtr[i]:indPtr[i+1]]]. The index is built in O(nnz) when 
+        first needed and kept until the array is changed. 
+        """
+        cdef numpy.ndarray indPtr, outerInds, positions 
+        
+        if self.secondary is None: 
+            self.thisPtr.makeCompressed()
+            indPtr = numpy.zeros(self.thisPtr.innerSize()+1, numpy.int32)
+            outerInds = numpy.zeros(self.thisPtr.nonZeros(), numpy.int32)
+            positions = numpy.zeros(self.thisPtr.nonZeros(), numpy.int32)
+            self.thisPtr.secondaryIndex(<int*>numpy.PyArray_DATA(indPtr), <int*>numpy.PyArray_DATA(outerInds), <int*>numpy.PyArray_DATA(positions))
+            
+            for array in [indPtr, outerInds, positions]: 
+                array.flags.writeable = False
+                
+            self.secondary = (indPtr, outerInds, positions)
+            
+        return self.secondary 
+        
+    def __line(self, int i, bint isRow): 
+        """
+        Return the (read-only) inner indices of the nonzeros of row i, or column i if isRow 
+        is False, and their positions in valuePtr. Outer vectors are read straight from the 
+        storage and the others from the secondary index, so this is O(nonzeros in the line). 
+        """
+        cdef int size 
+        
+        if isRow: 
+            size = self.shape[0]
+        else: 
+            size = self.shape[1]
+            
+        if i < 0: 
+            i += size 
+        if i < 0 or i >= size: 
+            raise ValueError("Invalid index " + str(i))
+        
+        if isRow == (self.storage == "rowMajor"): 
+            indPtr = self.outerIndexPtr()
+            return self.innerIndexPtr()[indPtr[i]:indPtr[i+1]], slice(indPtr[i], indPtr[i+1])
+        else: 
+            indPtr, outerInds, positions = self.secondaryIndex()
+            return outerInds[indPtr[i]:indPtr[i+1]], positions[indPtr[i]:indPtr[i+1]]
+
+    def setCompressed(self, numpy.ndarray[int, ndim=1, mode="c"] outerIndexPtr not None, numpy.ndarray[int, ndim=1, mode="c"] innerIndexPtr not None, numpy.ndarray[DataType, ndim=1, mode="c"] values not None): 
+        """
+        Copy the compressed arrays outerIndexPtr, innerIndexPtr and values into the 
+        storage of this array, keeping the current shape. The inner indices of each 
+        outer vector must be sorted and unique. 
+        """
+        if outerIndexPtr.shape[0] != self.thisPtr.outerSize()+1: 
+            raise ValueError("outerIndexPtr must have length " + str(self.thisPtr.outerSize()+1))
+        
+        cdef int nnz = outerIndexPtr[self.thisPtr.outerSize()] 
+        
+        if innerIndexPtr.shape[0] < nnz or values.shape[0] < nnz: 
+            raise ValueError("innerIndexPtr and values must have at least " + str(nnz) + " elements")
+        
+        self.thisPtr.setCompressed(self.shape[0], self.shape[1], &outerIndexPtr[0], <int*>numpy.PyArray_DATA(innerIndexPtr), <DataType*>numpy.PyArray_DATA(values))
+        self.secondary = None 
+        self.buffers = None 
+
+    def mapCompressed(self, numpy.ndarray outerIndexPtr not None, numpy.ndarray innerIndexPtr not None, numpy.ndarray values not None, bint copyOnWrite=False, owner=None): 
+        """
+        Use the compressed arrays outerIndexPtr, innerIndexPtr and values as the storage 
+        of this array without copying them, keeping the current shape (see setCompressed). 
+        The arrays, and the optional object owner which holds their memory, are kept alive 
+        by this array and are never written to. If copyOnWrite is False the array is 
+        read-only and changing it raises a ValueError, otherwise the storage is copied 
+        before the first change. 
+        """
+        cdef numpy.ndarray array 
+        
+        for array, dtype in [(outerIndexPtr, numpy.int32), (innerIndexPtr, numpy.int32), (values, self.dtype())]: 
+            if array.dtype != numpy.dtype(dtype) or array.ndim != 1 or not array.flags.c_contiguous: 
+                raise ValueError("Expected a contiguous 1d array of dtype " + str(numpy.dtype(dtype)) + " but got " + str(array.dtype))
+        
+        if outerIndexPtr.shape[0] != self.thisPtr.outerSize()+1: 
+            raise ValueError("outerIndexPtr must have length " + str(self.thisPtr.outerSize()+1))
+        
+        cdef int nnz = (<int*>numpy.PyArray_DATA(outerIndexPtr))[self.thisPtr.outerSize()]
+        
+        if innerIndexPtr.shape[0] < nnz or values.shape[0] < nnz: 
+            raise ValueError("innerIndexPtr and values must have at least " + str(nnz) + " elements")
         
-        #Must be a better way to do this 
-        for j in range(vect.size()): 
-            inds[j] = vect[j]
+        self.thisPtr.mapCompressed(self.shape[0], self.shape[1], <int*>numpy.PyArray_DATA(outerIndexPtr), <int*>numpy.PyArray_DATA(innerIndexPtr), <DataType*>numpy.PyArray_DATA(values))
+        self.buffers = (outerIndexPtr, innerIndexPtr, values, owner)
+        self.secondary = None 
+        self.copyOnWrite = copyOnWrite 
 
-        return inds  
+    def isMapped(self): 
+        """
+        Return True if this array uses external storage given to mapCompressed. 
+        """
+        return self.thisPtr.isMapped()
+
+    def __prepareWrite(self): 
+        """
+        Called before changing this array: raises a ValueError if the array is read-only 
+        and otherwise copies any external storage. The secondary index is discarded. 
+        """
+        self.secondary = None 
+        
+        if self.thisPtr.isMapped(): 
+            if not self.copyOnWrite: 
+                raise ValueError("Array is read-only as it is mapped onto external storage")
+            
+            self.thisPtr.ownStorage()
+            self.buffers = None 
 
     def setZero(self):
+        self.__prepareWrite()
         self.thisPtr.setZero()
 
     def sign(self): 
@@ -646,87 +1507,265 @@ cdef template[DataType, StorageType] class csarray:
         result.put(values, rowInds, colInds, init=True) 
         return result 
 
-    def subArray(self, numpy.ndarray[numpy.int_t, ndim=1, mode="c"] rowInds, numpy.ndarray[numpy.int_t, ndim=1, mode="c"] colInds): 
+    def subArray(self, rowInds, colInds, numThreads=None): 
         """
         Explicitly perform an array slice to return a submatrix with the given
-        indices. Only works with ascending ordered indices. This is similar 
-        to using numpy.ix_. 
-        """
-        cdef numpy.ndarray[int, ndim=1, mode="c"] rowIndsC 
-        cdef numpy.ndarray[int, ndim=1, mode="c"] colIndsC 
+        indices, similar to using numpy.ix_. The indices can be in any order and 
+        repeated, and negative indices count from the end. The outer vectors of 
+        the result are computed in parallel using numThreads threads (by default the 
+        number of CPUs), in time proportional to the selected nonzeros plus the inner 
+        size of this array. 
+        """
+        cdef numpy.ndarray[int, ndim=1, mode="c"] outerSel, innerSel, mapPtr, mapInds, outerOut 
+        cdef numpy.ndarray[long, ndim=1, mode="c"] splits 
+        cdef int numOuter, i, threads 
+        cdef bint sortInner 
         
+        rowInds = self.__selection(rowInds, self.shape[0])
+        colInds = self.__selection(colInds, self.shape[1])
         cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((rowInds.shape[0], colInds.shape[0]))     
         
-        rowIndsC = numpy.ascontiguousarray(rowInds, dtype=numpy.int32) 
-        colIndsC = numpy.ascontiguousarray(colInds, dtype=numpy.int32) 
-                
-        if rowInds.shape[0] != 0 and colInds.shape[0] != 0: 
-            self.thisPtr.slice(&rowIndsC[0], rowIndsC.shape[0], &colIndsC[0], colIndsC.shape[0], result.thisPtr) 
+        if self.storage == "rowMajor": 
+            outerSel, innerSel = rowInds, colInds 
+        else: 
+            outerSel, innerSel = colInds, rowInds 
+        
+        numOuter = outerSel.shape[0]
+        if numOuter == 0 or innerSel.shape[0] == 0: 
+            return result 
+            
+        threads = min(self.__numThreads(numThreads), numOuter)
+        self.thisPtr.makeCompressed()
+        
+        #Map each inner index of this array to its positions in the selection 
+        mapPtr = numpy.zeros(self.thisPtr.innerSize()+1, numpy.int32)
+        mapPtr[1:] = numpy.cumsum(numpy.bincount(innerSel, minlength=self.thisPtr.innerSize()))
+        mapInds = numpy.array(numpy.argsort(innerSel, kind="mergesort"), numpy.int32)
+        sortInner = innerSel.shape[0] > 1 and (numpy.diff(innerSel) <= 0).any()
+        
+        outerOut = numpy.zeros(numOuter+1, numpy.int32)
+        splits = numpy.array(numpy.linspace(0, numOuter, threads+1), numpy.int)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            self.thisPtr.gatherCount(&outerSel[0], splits[i], splits[i+1], &mapPtr[0], &outerOut[1])
+        
+        outerOut = numpy.array(numpy.cumsum(outerOut), numpy.int32)
+        outerPtr, innerOut, values = result.allocateCompressed(outerOut[numOuter])
+        outerPtr[:] = outerOut 
+        cdef int* innerOutPtr = <int*>numpy.PyArray_DATA(innerOut)
+        cdef DataType* valuesPtr = <DataType*>numpy.PyArray_DATA(values)
+        
+        splits = balancedSplits(outerOut, threads)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            self.thisPtr.gatherFill(&outerSel[0], splits[i], splits[i+1], &mapPtr[0], &mapInds[0], sortInner, &outerOut[0], innerOutPtr, valuesPtr)
+
+        return result 
+        
+    def __rangeSlice(self, outerSel, innerSlice, numThreads=None): 
+        """
+        Return the array made of the outer vectors outerSel (an int32 array) of this array 
+        restricted to the inner indices of the slice innerSlice, which can have a step and 
+        negative bounds. The range of each outer vector is found with a binary search and 
+        the work is split over outer vectors, so the time is proportional to the number of 
+        nonzeros extracted plus the log of the nonzeros of each outer vector. 
+        """
+        cdef numpy.ndarray[int, ndim=1, mode="c"] outerSelC = outerSel 
+        cdef numpy.ndarray[int, ndim=1, mode="c"] outerOut 
+        cdef numpy.ndarray[long, ndim=1, mode="c"] splits 
+        cdef int innerStart, innerStop, innerStep, numOuter, innerLength, i, threads 
+        
+        innerStart, innerStop, innerStep = innerSlice.indices(self.thisPtr.innerSize())
+        innerLength = len(range(innerStart, innerStop, innerStep))
+        numOuter = outerSelC.shape[0]
+        
+        if self.storage == "rowMajor": 
+            shape = (numOuter, innerLength)
+        else: 
+            shape = (innerLength, numOuter)
+            
+        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType](shape)     
+        
+        if numOuter == 0 or innerLength == 0: 
+            return result 
+            
+        threads = min(self.__numThreads(numThreads), numOuter)
+        self.thisPtr.makeCompressed()
+        outerOut = numpy.zeros(numOuter+1, numpy.int32)
+        splits = numpy.array(numpy.linspace(0, numOuter, threads+1), numpy.int)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            self.thisPtr.rangeCount(&outerSelC[0], splits[i], splits[i+1], innerStart, innerStop, innerStep, &outerOut[1])
+        
+        outerOut = numpy.array(numpy.cumsum(outerOut), numpy.int32)
+        outerPtr, innerOut, values = result.allocateCompressed(outerOut[numOuter])
+        outerPtr[:] = outerOut 
+        cdef int* innerOutPtr = <int*>numpy.PyArray_DATA(innerOut)
+        cdef DataType* valuesPtr = <DataType*>numpy.PyArray_DATA(values)
+        splits = balancedSplits(outerOut, threads)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            self.thisPtr.rangeFill(&outerSelC[0], splits[i], splits[i+1], innerStart, innerStop, innerStep, &outerOut[0], innerOutPtr, valuesPtr)
 
         return result 
 
+    def __selection(self, inds, int size): 
+        """
+        Return the indices inds as a contiguous 1d int32 array, with negative indices 
+        counted from the end, raising a ValueError if any are out of range. 
+        """
+        cdef numpy.ndarray[long, ndim=1, mode="c"] indsC 
+        cdef numpy.ndarray[int, ndim=1, mode="c"] result 
+        cdef long k, ind 
+        cdef bint valid = True 
+        
+        inds = numpy.asarray(inds)
+        
+        if inds.ndim != 1: 
+            raise ValueError("Indices must be 1d")
+        
+        indsC = numpy.ascontiguousarray(inds, numpy.int64)
+        result = numpy.zeros(indsC.shape[0], numpy.int32)
+        
+        for k in range(indsC.shape[0]): 
+            ind = indsC[k]
+            if ind < 0: 
+                ind += size 
+            if ind < 0 or ind >= size: 
+                valid = False 
+            result[k] = ind 
+        
+        if not valid: 
+            raise ValueError("Index out of range for size " + str(size))
+            
+        return result 
+
     def submatrix(self, unsigned int startRow, unsigned int startCol, unsigned int blockRows, unsigned int blockCols): 
         """
         Return a submatrix of the matrix given by A[startRow:startRows+blockRows, startCol:startCol+blockCols]
         in an efficient manner. 
         """
-        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType](self.shape)
-        del result.thisPtr
-        result.thisPtr = new SparseMatrixExt[DataType, StorageType](self.thisPtr.submatrix(startRow, startCol, blockRows, blockCols))
-        return result 
+        return self[startRow:startRow+blockRows, startCol:startCol+blockCols]
 
-    def std(self): 
+    def std(self, axis=None): 
         """
-        Return the standard deviation of the array elements. 
+        Return the standard deviation of the array elements, or of each column 
+        (axis=0) or row (axis=1). 
         """
-        return numpy.sqrt(self.var())
+        return numpy.sqrt(self.var(axis))
 
-    def sum(self, axis=None): 
+    def sum(self, axis=None, dtype=None): 
         """
         Sum all of the elements in this array. If one specifies an axis 
         then we sum along the axis. 
-        """
-        cdef numpy.ndarray[double, ndim=1, mode="c"] result    
-        cdef numpy.ndarray[int, ndim=1, mode="c"] rowInds
-        cdef numpy.ndarray[int, ndim=1, mode="c"] colInds
-        cdef unsigned int i
         
+        :param dtype: The dtype to sum along an axis in, by default int64 for integer arrays and the dtype of this array otherwise. 
+        """
         if axis==None: 
             return self.thisPtr.sumValues()
             #There seems to be a very temporamental problem with thisPtr.sum()
             #return self.thisPtr.sum()
-        elif axis==0: 
-            result = numpy.zeros(self.shape[1], dtype=numpy.float) 
-            (rowInds, colInds) = self.nonzero()
-            
-            for i in range(rowInds.shape[0]): 
-                result[colInds[i]] += self.thisPtr.coeff(rowInds[i], colInds[i])   
-        elif axis==1: 
-            result = numpy.zeros(self.shape[0], dtype=numpy.float) 
-            (rowInds, colInds) = self.nonzero()
-            
-            for i in range(rowInds.shape[0]): 
-                result[rowInds[i]] += self.thisPtr.coeff(rowInds[i], colInds[i])  
+        elif axis==0 or axis==1: 
+            return self.reduceAxis("sum", axis, self.__sumType(dtype))[0]
         else:
             raise ValueError("Invalid axis: " + str(axis))
-            
-        return result 
+    
+    def __sumType(self, dtype): 
+        """
+        Return the dtype of sums along an axis: dtype if given, otherwise int64 for 
+        integer arrays and the dtype of this array for floating point ones. 
+        """
+        if dtype != None: 
+            return numpy.dtype(dtype)
+        elif numpy.dtype(self.dtype()).kind == "f": 
+            return numpy.dtype(self.dtype())
+        else: 
+            return numpy.dtype(numpy.int64)
+    
+    def __floatType(self, dtype): 
+        """
+        Return the dtype of means and norms along an axis: dtype if given, otherwise 
+        float64 for integer arrays and the dtype of this array for floating point ones. 
+        """
+        if dtype != None: 
+            return numpy.dtype(dtype)
+        elif numpy.dtype(self.dtype()).kind == "f": 
+            return numpy.dtype(self.dtype())
+        else: 
+            return numpy.dtype(numpy.float64)
   
-    def toarray(self): 
+    def toarray(self, out=None, rows=None, cols=None, numThreads=None): 
         """
-        Convert this sparse matrix into a numpy array. 
+        Convert this sparse matrix, or the block given by the row and column ranges, 
+        into a numpy array of the same dtype. The elements are written straight from 
+        the compressed storage, with the outer vectors split into ranges which are 
+        written in parallel. 
+        
+        :param out: An optional 2d array of the same dtype or float64 with the shape of the block, in any memory order, to write the result into. 
+        
+        :param rows: None for all rows, or a slice with step 1 of the rows to convert. 
+        
+        :param cols: None for all columns, or a slice with step 1 of the columns to convert. 
         """
-        cdef numpy.ndarray[double, ndim=2, mode="c"] result = numpy.zeros(self.shape, numpy.float)
-        cdef numpy.ndarray[int, ndim=1, mode="c"] rowInds
-        cdef numpy.ndarray[int, ndim=1, mode="c"] colInds
-        cdef unsigned int i
+        cdef int rowStart, rowStop, colStart, colStop, outerStart, outerStop, innerStart, innerStop 
+        cdef int i, threads
+        cdef long outerStride, innerStride 
+        cdef bint sameType 
         
-        (rowInds, colInds) = self.nonzero()
-            
-        for i in range(rowInds.shape[0]): 
-            result[rowInds[i], colInds[i]] += self.thisPtr.coeff(rowInds[i], colInds[i])   
+        rowStart, rowStop = self.__blockRange(rows, self.shape[0])
+        colStart, colStop = self.__blockRange(cols, self.shape[1])
+        shape = (rowStop - rowStart, colStop - colStart)
+        
+        if out is None: 
+            out = numpy.empty(shape, self.dtype())
+        elif not isinstance(out, numpy.ndarray) or out.shape != shape: 
+            raise ValueError("out must be a numpy array of shape " + str(shape))
+        elif not out.flags.writeable: 
+            raise ValueError("out must be writeable")
+        elif out.dtype != self.dtype() and out.dtype != numpy.float64: 
+            raise ValueError("out must have dtype " + str(numpy.dtype(self.dtype())) + " or float64: " + str(out.dtype))
+        
+        sameType = out.dtype == self.dtype()
+        
+        if self.storage == "colMajor": 
+            outerStart, outerStop, innerStart, innerStop = colStart, colStop, rowStart, rowStop
+            outerStride, innerStride = out.strides[1]//out.itemsize, out.strides[0]//out.itemsize
+        else: 
+            outerStart, outerStop, innerStart, innerStop = rowStart, rowStop, colStart, colStop
+            outerStride, innerStride = out.strides[0]//out.itemsize, out.strides[1]//out.itemsize
+        
+        self.thisPtr.makeCompressed()
+        outerPtr = bufferView(self.thisPtr.outerIndexPtr(), self.thisPtr.outerSize()+1, numpy.NPY_INT32, self, False)
+        outerPtr = outerPtr[outerStart:outerStop+1]
+        threads = min(self.__numThreads(numThreads), max(outerStop - outerStart, 1))
+        cdef numpy.ndarray[numpy.int_t, ndim=1] splits = balancedSplits(outerPtr - outerPtr[0], threads) + outerStart
+        
+        cdef DataType* outT = <DataType*>numpy.PyArray_DATA(out)
+        cdef double* outD = <double*>numpy.PyArray_DATA(out)
+        
+        for i in prange(threads, nogil=True, num_threads=threads, schedule="static"): 
+            if sameType: 
+                self.thisPtr.densify(splits[i], splits[i+1], outerStart, innerStart, innerStop, outT, outerStride, innerStride)
+            else: 
+                self.thisPtr.densify(splits[i], splits[i+1], outerStart, innerStart, innerStop, outD, outerStride, innerStride)
             
-        return result 
+        return out 
+    
+    def __blockRange(self, sel, int size): 
+        """
+        Return the start and stop of a range of rows or columns given as None (the whole 
+        axis of length size) or a slice with step 1. 
+        """
+        if sel is None: 
+            return 0, size 
+        elif not isinstance(sel, slice): 
+            raise ValueError("Expecting None or a slice: " + str(sel))
+        
+        start, stop, step = sel.indices(size)
+        if step != 1: 
+            raise ValueError("Only ranges with step 1 can be converted: " + str(sel))
+        
+        return start, max(start, stop)
               
     def trace(self): 
         """
@@ -739,11 +1778,21 @@ cdef template[DataType, StorageType] class csarray:
         """
         Find the transpose of this matrix. 
         """
-        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((self.shape[1], self.shape[0]))
-        del result.thisPtr
-        result.thisPtr = new SparseMatrixExt[DataType, StorageType](self.thisPtr.trans())
+        cdef csarray[DataType, StorageType] result = csarray[DataType, StorageType]((0, 0))
+        result.thisPtr.take(self.thisPtr.trans())
         return result 
          
+    def valuePtr(self): 
+        """
+        Return the values of the nonzero elements, in the order of innerIndexPtr, as a 
+        numpy view of the underlying storage. Writing to the view changes this array, 
+        unless it is mapped onto external storage in which case the view is read-only. 
+        The array is compressed first and the view is invalid once the nonzero elements 
+        of this array are changed. 
+        """
+        self.thisPtr.makeCompressed()
+        return bufferView(self.thisPtr.valuePtr(), self.thisPtr.nonZeros(), numpy.dtype(self.dtype()).num, self, not self.thisPtr.isMapped())
+
     def values(self): 
         """
         Return the values of this object according to the elements returned 
@@ -757,11 +1806,12 @@ cdef template[DataType, StorageType] class csarray:
         
         return vals           
          
-    def var(self): 
+    def var(self, axis=None): 
         """
-        Return the variance of the elements of this array. 
+        Return the variance of the elements of this array, or of each column (axis=0) 
+        or row (axis=1). 
         """
-        cdef double mean = self.mean() 
+        cdef double mean 
         cdef numpy.ndarray[int, ndim=1, mode="c"] rowInds
         cdef numpy.ndarray[int, ndim=1, mode="c"] colInds
         cdef unsigned int i
@@ -769,6 +1819,12 @@ cdef template[DataType, StorageType] class csarray:
         
         if self.size == 0: 
             return float("nan")
+        elif axis != None: 
+            means = self.mean(axis) 
+            sqDevs, counts = self.reduceAxis("sqdev", axis, means.dtype, means)[0:2]
+            return (sqDevs + (self.shape[axis] - counts)*means**2)/float(self.shape[axis])
+        
+        mean = self.mean()
         
         (rowInds, colInds) = self.nonzero()
             
@@ -6,29 +6,148 @@
 #include <eigen3/Eigen/Dense>
 #include <eigen3/Eigen/IterativeLinearSolvers>
 #include <vector> 
+#include <algorithm> 
 #include <math.h> 
 
 using namespace Eigen; 
 
 
 
+template <class T>
+class ExternalStorage:public Eigen::internal::CompressedStorage<T, int> {
+  /* Compressed storage which points at inner indices and values owned by someone else */
+  public:
+    ExternalStorage(): 
+        Eigen::internal::CompressedStorage<T, int>() { 
+        }
+
+    ExternalStorage(T* values, int* indices, size_t size) { 
+        this->m_values = values; 
+        this->m_indices = indices; 
+        this->m_size = size; 
+        this->m_allocatedSize = size; 
+        }
+
+    void release() { 
+        /* Forget the pointers so that they are not freed */
+        this->m_values = 0; 
+        this->m_indices = 0; 
+        this->m_size = 0; 
+        this->m_allocatedSize = 0; 
+        }
+}; 
+
+template <class T>
+class LargerMagnitude { 
+  /* Orders slots by decreasing absolute value of values[slot], then by increasing keys[slot] */
+  public:
+    const T* values; 
+    const int* keys; 
+
+    LargerMagnitude(const T* values, const int* keys): values(values), keys(keys) { } 
+
+    bool operator()(int i, int j) const { 
+        double x = fabs((double)values[i]); 
+        double y = fabs((double)values[j]); 
+        return x > y || (x == y && keys[i] < keys[j]); 
+        }
+}; 
+
+template <class T>
+class AtLeastMagnitude { 
+  /* Tests whether the absolute value of values[slot] is at least threshold */
+  public:
+    const T* values; 
+    double threshold; 
+
+    AtLeastMagnitude(const T* values, double threshold): values(values), threshold(threshold) { } 
+
+    bool operator()(int i) const { 
+        return fabs((double)values[i]) >= threshold; 
+        }
+}; 
+
+class SmallerKey { 
+  /* Orders slots by increasing keys[slot] */
+  public:
+    const int* keys; 
+
+    SmallerKey(const int* keys): keys(keys) { } 
+
+    bool operator()(int i, int j) const { 
+        return keys[i] < keys[j]; 
+        }
+}; 
+
 template <class T, int S=Eigen::ColMajor>
 class SparseMatrixExt:public SparseMatrix<T, S> {
   public:
 	SparseMatrixExt<T, S>(): 
-		SparseMatrix<T, S>(){
+		SparseMatrix<T, S>(), mapped(false){
         /* Create a new SparseMatrixExt object */  
 		} 
 
 	SparseMatrixExt<T, S>(int rows, int cols): 
-		SparseMatrix<T, S>(rows, cols){ 
+		SparseMatrix<T, S>(rows, cols), mapped(false){ 
 		}
 
 
 	SparseMatrixExt<T, S>(const SparseMatrix<T, S> other): 
-		SparseMatrix<T, S>(other){ 
+		SparseMatrix<T, S>(other), mapped(false){ 
 		}
 
+	SparseMatrixExt<T, S>(const SparseMatrixExt<T, S>& other): 
+		SparseMatrix<T, S>(other), mapped(false){ 
+        /* Copies always own their storage */
+		}
+
+    ~SparseMatrixExt<T, S>() { 
+        unmap(); 
+        }
+
+    void mapCompressed(int rows, int cols, int* outerPtr, int* innerInds, T* vals) { 
+        /*
+        Make this matrix use the given compressed arrays as its storage without copying, 
+        see setCompressed. The arrays must outlive the mapping and are never freed or 
+        resized here, so nothing which changes the nonzero structure may be called until 
+        unmap or ownStorage. 
+        */
+        unmap(); 
+        this->resize(rows, cols); 
+        this->makeCompressed(); 
+        std::free(this->m_outerIndex); 
+        this->m_outerIndex = outerPtr; 
+        
+        ExternalStorage<T> storage(vals, innerInds, outerPtr[this->outerSize()]); 
+        this->m_data.swap(storage); 
+        mapped = true; 
+        }
+
+    void unmap() { 
+        /* Stop using external storage, leaving an empty matrix of the same shape */
+        if (mapped) { 
+            ExternalStorage<T> storage; 
+            this->m_data.swap(storage); 
+            storage.release(); 
+            
+            this->m_outerIndex = static_cast<int*>(std::calloc(this->outerSize()+1, sizeof(int))); 
+            mapped = false; 
+            }
+        }
+
+    void ownStorage() { 
+        /* Copy external storage into storage owned by this matrix */
+        if (mapped) { 
+            SparseMatrix<T, S> copy(*this); 
+            unmap(); 
+            this->swap(copy); 
+            }
+        }
+
+    bool isMapped() { 
+        return mapped; 
+        }
+
 
     SparseMatrixExt<T, S> abs() { 
         SparseMatrix<T, S> A = this-> cwiseAbs();
@@ -40,6 +159,11 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
         return (SparseMatrixExt<T, S>)((*this) + other); 
         } 
         
+    void take(SparseMatrixExt<T, S> other) { 
+        /* Swap in the storage of other, which is passed by value so that a returned matrix is not copied */
+        this->swap(other); 
+        }
+
     SparseMatrixExt<T, S> submatrix(const unsigned int startRow, const unsigned int startCol, const unsigned int blockRows, const unsigned int blockCols) { 
         return (SparseMatrixExt<T, S>)(this->block(startRow, startCol, blockRows, blockCols)); 
         } 
@@ -91,90 +215,129 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
         return outputCode; 
         }
 
-    void dot1d(double* v, double* result) { 
+    template <class U> 
+    void dot1d(U* v, U* result) { 
         /* 
          * Compute the dot product with this matrix and the 1d vector v.
-         * result is the output.  
+         * result is the output. The dense type U is either T or double.  
          */
-        unsigned int row; 
-        unsigned int col; 
-        T val; 
-    
-        for (int i=0; i<this->outerSize(); ++i) {
-          for (typename SparseMatrixExt<T, S>::InnerIterator it(*this, i); it; ++it) { 
-            row = it.row();
-            col = it.col();
-            val = this->coeff(row, col);
-            result[row] += val*v[col]; 
-            }
-        }
+        this->dotSub1d(v, 0, this->outerSize(), result);
     }
 
-    void dot2d(double* A, int numCols, double* result) { 
+    template <class U> 
+    void dot2d(U* A, int numCols, U* result) { 
         /* Compute the dot product with this matrix and the 2d matrix A.
          * numCols is the number of columns in A, and result is the output.  
          * 
          */
-        unsigned int row; 
-        unsigned int col; 
-        unsigned int p, q;
-        int j; 
-        T val; 
-    
-        for (int i=0; i<this->outerSize(); ++i) {
-          for (typename SparseMatrixExt<T, S>::InnerIterator it(*this, i); it; ++it) { 
-            row = it.row();
-            col = it.col();
-            p = row*numCols; 
-            q = col*numCols; 
-            val = this->coeff(row, col);
-            for(j=0;j<numCols;j++)
-                //The array is C-contiguous so that A[i, j] -> A[i*numCols + j]
-                result[p + j] += val*A[q + j]; 
-                }  
-            }
+        this->dotSub2d(A, numCols, 0, this->outerSize(), result);
         }    
 
-    void dotSub1d(double* v, int startRow, int endRow, double* result) { 
+    template <class U> 
+    void dotSub1d(U* v, int startRow, int endRow, U* result) { 
         /*
-        Perform a dot product on a subset of the rows of X, i.e. find X[startRow:endRow, :].dot(v). 
+        Perform a dot product on a subset of the outer vectors of X, i.e. find X[startRow:endRow, :].dot(v) 
+        for row major matrices and X[:, startRow:endRow].dot(v[startRow:endRow]) for column major ones. 
         */
-        unsigned int row; 
-        unsigned int col;  
-        T val; 
-    
-        for (int i=startRow; i<endRow; ++i) {
-          for (typename SparseMatrixExt<T, S>::InnerIterator it(*this, i); it; ++it) { 
-            row = it.row();
-            col = it.col();
-            val = this->coeff(row, col);
-            result[row] += val*v[col]; 
-            }  
-        }
+        if (S == Eigen::RowMajor) 
+            this->dotRowMajor1d(v, startRow, endRow, result);
+        else 
+            this->dotColMajor1d(v, startRow, endRow, result);
     }       
 
-    void dotSub2d(double* A, int numCols, int startRow, int endRow, double* result) { 
+    template <class U> 
+    void dotSub2d(U* A, int numCols, int startRow, int endRow, U* result) { 
         /*
-        Perform a dot product on a subset of the rows of X, i.e. find X[startRow:endRow, :].dot(A). 
-        numCols is the number of columns in A. Only works on row major matrices. 
+        Perform a dot product on a subset of the outer vectors of X, i.e. find X[startRow:endRow, :].dot(A) 
+        for row major matrices. numCols is the number of columns in A. For column major matrices the 
+        product uses columns startRow:endRow of X and scatters into all rows of result. 
         */
-        unsigned int row; 
-        unsigned int col; 
-        unsigned int p, q;
-        int j; 
-        T val; 
-    
-        for (int i=startRow; i<endRow; ++i) {
-          for (typename SparseMatrixExt<T, S>::InnerIterator it(*this, i); it; ++it) { 
-            row = it.row();
-            col = it.col();
-            p = row*numCols; 
-            q = col*numCols; 
-            val = this->coeff(row, col);
-            for(j=0;j<numCols;j++)
-                //The array is C-contiguous so that A[i, j] -> A[i*numCols + j]
-                result[p + j] += val*A[q + j]; 
-                }  
+        if (S == Eigen::RowMajor) 
+            this->dotRowMajor2d(A, numCols, startRow, endRow, result);
+        else 
+            this->dotColMajor2d(A, numCols, startRow, endRow, result);
+        }    
+
+    template <class U> 
+    void dotRowMajor1d(U* v, int startOuter, int endOuter, U* result) { 
+        /*
+        Row major kernel: each row is a dot product of the stored values with a gather from v. 
+        Reads the compressed buffers directly rather than calling coeff(). 
+        */
+        const int* innerPtr = this->innerIndexPtr(); 
+        const T* valPtr = this->valuePtr(); 
+        U sum; 
+        int k, end; 
+
+        for (int i=startOuter; i<endOuter; ++i) {
+            sum = 0; 
+            for (k=this->outerStart(i), end=this->outerEnd(i); k<end; ++k) 
+                sum += valPtr[k]*v[innerPtr[k]]; 
+            result[i] += sum; 
+        }
+    }
+
+    template <class U> 
+    void dotColMajor1d(U* v, int startOuter, int endOuter, U* result) { 
+        /*
+        Column major kernel: each column j is scaled by v[j] and scattered into result. 
+        */
+        const int* innerPtr = this->innerIndexPtr(); 
+        const T* valPtr = this->valuePtr(); 
+        U vj; 
+        int k, end; 
+
+        for (int j=startOuter; j<endOuter; ++j) {
+            vj = v[j]; 
+            for (k=this->outerStart(j), end=this->outerEnd(j); k<end; ++k) 
+                result[innerPtr[k]] += valPtr[k]*vj; 
+        }
+    }
+
+    template <class U> 
+    void dotRowMajor2d(U* A, int numCols, int startOuter, int endOuter, U* result) { 
+        /*
+        Row major kernel for the product with the C-contiguous matrix A, so that A[i, j] -> A[i*numCols + j]. 
+        */
+        const int* innerPtr = this->innerIndexPtr(); 
+        const T* valPtr = this->valuePtr(); 
+        U* resultRow; 
+        U* rowA; 
+        U val; 
+        int j, k, end; 
+
+        for (int i=startOuter; i<endOuter; ++i) {
+            resultRow = result + (long)i*numCols; 
+            for (k=this->outerStart(i), end=this->outerEnd(i); k<end; ++k) { 
+                val = valPtr[k]; 
+                rowA = A + (long)innerPtr[k]*numCols; 
+                for(j=0;j<numCols;j++)
+                    resultRow[j] += val*rowA[j]; 
+                }
+            }
+        }
+
+    template <class U> 
+    void dotColMajor2d(U* A, int numCols, int startOuter, int endOuter, U* result) { 
+        /*
+        Column major kernel for the product with the C-contiguous matrix A: row j of A is scaled 
+        and scattered into the rows of result given by the nonzeros of column j. 
+        */
+        const int* innerPtr = this->innerIndexPtr(); 
+        const T* valPtr = this->valuePtr(); 
+        U* resultRow; 
+        U* rowA; 
+        U val; 
+        int i, k, end; 
+
+        for (int j=startOuter; j<endOuter; ++j) {
+            rowA = A + (long)j*numCols; 
+            for (k=this->outerStart(j), end=this->outerEnd(j); k<end; ++k) { 
+                val = valPtr[k]; 
+                resultRow = result + (long)innerPtr[k]*numCols; 
+                for(i=0;i<numCols;i++)
+                    resultRow[i] += val*rowA[i]; 
+                }
             }
         }    
     
@@ -226,6 +389,34 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
 		}
 
     
+    void secondaryIndex(int* indPtr, int* outerInds, int* positions) { 
+        /*
+         * Write the pattern of this compressed matrix in the other storage order using a 
+         * counting sort: the nonzeros of inner vector i are at indPtr[i]:indPtr[i+1] of 
+         * outerInds (their outer indices, in increasing order) and of positions (their 
+         * positions in the storage). 
+         */
+        int innerSize = this->innerSize(); 
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        
+        std::fill(indPtr, indPtr + innerSize + 1, 0); 
+        for (int k=0; k<this->nonZeros(); k++) 
+            indPtr[innerIndex[k] + 1]++; 
+        for (int i=0; i<innerSize; i++) 
+            indPtr[i+1] += indPtr[i]; 
+        
+        std::vector<int> next(indPtr, indPtr + innerSize); 
+        
+        for (int j=0; j<this->outerSize(); j++) { 
+            for (int k=outerIndex[j]; k<outerIndex[j+1]; k++) { 
+                int p = next[innerIndex[k]]++; 
+                outerInds[p] = j; 
+                positions[p] = k; 
+                }
+            }
+        }
+    
     void insertVal(int row, int col, T val) { 
         if (this->coeff(row, col) != val)
             this->coeffRef(row, col) = val;
@@ -241,6 +432,21 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
         return (SparseMatrixExt<T, S>)A; 
         }
 
+    int outerEnd(int i) { 
+        /* One past the position of the last nonzero of outer vector i in the value/index buffers. 
+         * Handles both compressed and uncompressed mode. 
+         */
+        if (this->isCompressed()) 
+            return this->outerIndexPtr()[i+1]; 
+        else 
+            return this->outerIndexPtr()[i] + this->innerNonZeroPtr()[i]; 
+        }
+
+    int outerStart(int i) { 
+        /* The position of the first nonzero of outer vector i in the value/index buffers */
+        return this->outerIndexPtr()[i]; 
+        }
+
     double norm() { 
         int i = 0; 
         double result = 0;
@@ -282,6 +488,7 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
     }
 
     SparseMatrixExt& operator=(const SparseMatrixExt& other)  { 
+        unmap(); 
         SparseMatrix<T, S>::operator=(other); 
         return *this;
         }
@@ -336,7 +543,7 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
 
     void putUsingTriplets(int* rowInds, int* colInds, T* vals, int numVals) { 
         int i; 
-        typedef Eigen::Triplet<double> R;
+        typedef Eigen::Triplet<T, int> R;
         std::vector<R> tripletList;
         tripletList.reserve(numVals);
         for(i=0;i<numVals;i++) {    
@@ -348,7 +555,7 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
 
     void putUsingTriplets2(int* rowInds, int* colInds, T val, int numVals) { 
         int i; 
-        typedef Eigen::Triplet<double> R;
+        typedef Eigen::Triplet<T, int> R;
         std::vector<R> tripletList;
         tripletList.reserve(numVals);
         for(i=0;i<numVals;i++) {    
@@ -359,46 +566,803 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
         }
 
 
-    void slice(int* array1, int size1, int* array2, int size2, SparseMatrixExt<T, S> *mat) { 
-        //Array indices must be sorted 
-        int size1Ind = 0; 
-        int size2Ind = 0; 
-        typedef Eigen::Triplet<double> R;
-        std::vector<R> tripletList;
+    void putMerge(int* rowInds, int* colInds, T* vals, int valStride, long numVals, int mode, bool storeZeros) { 
+        /*
+        Merge the elements (rowInds[i], colInds[i], vals[i*valStride]) into this matrix in a 
+        single pass over the existing storage, which ends up compressed. The incoming elements 
+        are ordered with two stable counting sorts (inner then outer index) so repeated indices 
+        are combined in their original order. mode 0 overwrites existing elements, 1 adds to 
+        them, 2 takes the maximum and 3 the minimum, where elements which are not stored are 
+        zero. New elements are only stored if the result is nonzero, unless storeZeros is set, 
+        in which case they start from their first value instead of zero. 
+        */
+        this->makeCompressed(); 
+        
+        int* outerInds = S == Eigen::RowMajor ? rowInds : colInds; 
+        int* innerInds = S == Eigen::RowMajor ? colInds : rowInds; 
+        int outerSize = this->outerSize(); 
+        int innerSize = this->innerSize(); 
+        long i, j, p, pEnd, q, qEnd; 
+        
+        //Sort by inner index and then by outer index 
+        std::vector<long> counts(innerSize+1, 0); 
+        std::vector<long> perm(numVals); 
+        std::vector<long> perm2(numVals); 
+        
+        for (i=0;i<numVals;i++) 
+            counts[innerInds[i]+1]++; 
+        for (j=0;j<innerSize;j++) 
+            counts[j+1] += counts[j]; 
+        for (i=0;i<numVals;i++) 
+            perm2[counts[innerInds[i]]++] = i; 
+        
+        std::vector<long> outerStarts(outerSize+1, 0); 
+        for (i=0;i<numVals;i++) 
+            outerStarts[outerInds[i]+1]++; 
+        for (j=0;j<outerSize;j++) 
+            outerStarts[j+1] += outerStarts[j]; 
+        
+        counts.assign(outerStarts.begin(), outerStarts.end()); 
+        for (i=0;i<numVals;i++) 
+            perm[counts[outerInds[perm2[i]]]++] = perm2[i]; 
+        std::vector<long>().swap(perm2); 
+        
+        //Now merge each outer vector with the existing one 
+        int* oldOuter = this->outerIndexPtr(); 
+        int* oldInner = this->innerIndexPtr(); 
+        T* oldVals = this->valuePtr(); 
+        
+        std::vector<int> newOuter(outerSize+1, 0); 
+        std::vector<int> newInner; 
+        std::vector<T> newVals; 
+        newInner.reserve(this->nonZeros() + numVals); 
+        newVals.reserve(this->nonZeros() + numVals); 
+        
+        for (j=0;j<outerSize;j++) { 
+            p = oldOuter[j]; 
+            pEnd = oldOuter[j+1]; 
+            q = outerStarts[j]; 
+            qEnd = outerStarts[j+1]; 
+            
+            while (p < pEnd || q < qEnd) { 
+                if (q == qEnd || (p < pEnd && oldInner[p] < innerInds[perm[q]])) { 
+                    newInner.push_back(oldInner[p]); 
+                    newVals.push_back(oldVals[p]); 
+                    p++; 
+                    } 
+                else { 
+                    int ind = innerInds[perm[q]]; 
+                    bool exists = p < pEnd && oldInner[p] == ind; 
+                    T value = exists ? oldVals[p] : T(0); 
+                    
+                    //When storing zeros (building a new array) the first value initialises a new element 
+                    if (!exists && storeZeros) 
+                        value = vals[perm[q++]*valStride]; 
+                    
+                    for (;q < qEnd && innerInds[perm[q]] == ind;q++) { 
+                        T newValue = vals[perm[q]*valStride]; 
+                        
+                        if (mode == 0) 
+                            value = newValue; 
+                        else if (mode == 1) 
+                            value += newValue; 
+                        else if (mode == 2) 
+                            value = std::max(value, newValue); 
+                        else 
+                            value = std::min(value, newValue); 
+                        } 
+                    
+                    if (exists || storeZeros || value != T(0)) { 
+                        newInner.push_back(ind); 
+                        newVals.push_back(value); 
+                        } 
+                    if (exists) 
+                        p++; 
+                    } 
+                } 
+            
+            newOuter[j+1] = newInner.size(); 
+            } 
+        
+        this->resizeNonZeros(newInner.size()); 
+        std::copy(newOuter.begin(), newOuter.end(), this->outerIndexPtr()); 
+        std::copy(newInner.begin(), newInner.end(), this->innerIndexPtr()); 
+        std::copy(newVals.begin(), newVals.end(), this->valuePtr()); 
+        }
+
+    void countOuter(int* rowInds, int* colInds, long numVals, int* counts) { 
+        /* Add the number of elements in each outer vector to counts */
+        int* outerInds = S == Eigen::RowMajor ? rowInds : colInds; 
+        
+        for (long i=0;i<numVals;i++) 
+            counts[outerInds[i]]++; 
+        }
 
-        if (S == Eigen::ColMajor) { 
-            //Assume column major class - j is col index 
-            for (int j=0; j<size2; ++j) { 
-                size1Ind = 0; 
-                //For each col go through non-zero vals and copy to new array if indexed in array1
-                for (typename SparseMatrixExt<T, S>::InnerIterator it(*this, array2[j]); it; ++it) {
-                    while (size1Ind < size1 && array1[size1Ind] < it.row()) { 
-                        size1Ind++; 
+    void reserveOuter(int* sizes) { 
+        /* Reserve room for sizes[j] more elements in outer vector j, in uncompressed mode */
+        std::vector<int> reserveSizes(sizes, sizes + this->outerSize()); 
+        this->reserve(reserveSizes); 
+        }
+
+    void appendTriplets(int* rowInds, int* colInds, T* vals, int valStride, long numVals) { 
+        /*
+        Append the elements (rowInds[i], colInds[i], vals[i*valStride]) to the ends of the outer 
+        vectors without sorting, in uncompressed mode. If a vector runs out of reserved room, 
+        each full vector gets room for the rest of the elements and at least doubles its room, 
+        so elements are moved O(log nnz) times. Call finishTriplets after the last elements. 
+        */
+        int* outerInds = S == Eigen::RowMajor ? rowInds : colInds; 
+        int* innerInds = S == Eigen::RowMajor ? colInds : rowInds; 
+        
+        if (this->isCompressed()) { 
+            std::vector<int> reserveSizes(this->outerSize(), 0); 
+            this->reserve(reserveSizes); 
+            }
+        
+        int* outerPtr = this->outerIndexPtr(); 
+        int* innerNonZeros = this->innerNonZeroPtr(); 
+        int* innerPtr = this->innerIndexPtr(); 
+        T* valuePtr = this->valuePtr(); 
+        
+        for (long i=0;i<numVals;i++) { 
+            int j = outerInds[i]; 
+            int pos = outerPtr[j] + innerNonZeros[j]; 
+            
+            if (pos == outerPtr[j+1]) { 
+                std::vector<int> reserveSizes(this->outerSize(), 0); 
+                for (long k=i;k<numVals;k++) 
+                    reserveSizes[outerInds[k]]++; 
+                
+                for (int m=0;m<this->outerSize();m++) { 
+                    int room = outerPtr[m+1] - outerPtr[m] - innerNonZeros[m]; 
+                    if (reserveSizes[m] > room) 
+                        reserveSizes[m] = std::max(reserveSizes[m], innerNonZeros[m]); 
+                    else 
+                        reserveSizes[m] = 0; 
+                    }
+                
+                this->reserve(reserveSizes); 
+                outerPtr = this->outerIndexPtr(); 
+                innerNonZeros = this->innerNonZeroPtr(); 
+                innerPtr = this->innerIndexPtr(); 
+                valuePtr = this->valuePtr(); 
+                pos = outerPtr[j] + innerNonZeros[j]; 
+                }
+            
+            innerPtr[pos] = innerInds[i]; 
+            valuePtr[pos] = vals[i*valStride]; 
+            innerNonZeros[j]++; 
+            }
+        }
+
+    static bool innerLess(const std::pair<int, T>& a, const std::pair<int, T>& b) { 
+        return a.first < b.first; 
+        }
+
+    void finishTriplets(int mode) { 
+        /*
+        Sort each outer vector filled by appendTriplets by inner index, combine repeated inner 
+        indices in the order they were appended (mode 0 keeps the last, 1 sums, 2 takes the 
+        maximum and 3 the minimum) and compress. This is done in place, unlike makeCompressed 
+        which copies the storage to trim it. 
+        */
+        if (this->isCompressed()) 
+            return; 
+        
+        int* outerPtr = this->outerIndexPtr(); 
+        int* innerNonZeros = this->innerNonZeroPtr(); 
+        int* innerPtr = this->innerIndexPtr(); 
+        T* valuePtr = this->valuePtr(); 
+        std::vector<std::pair<int, T> > entries; 
+        int nnz = 0; 
+        
+        for (int j=0;j<this->outerSize();j++) { 
+            int start = outerPtr[j]; 
+            int end = start + innerNonZeros[j]; 
+            int k, m; 
+            
+            for (k=start+1;k<end && innerPtr[k-1] < innerPtr[k];k++); 
+            
+            //Only sort vectors which are not already strictly increasing 
+            if (k < end) { 
+                entries.clear(); 
+                for (k=start;k<end;k++) 
+                    entries.push_back(std::make_pair(innerPtr[k], valuePtr[k])); 
+                std::stable_sort(entries.begin(), entries.end(), innerLess); 
+                
+                k = start; 
+                for (m=0;m<(int)entries.size();m++) { 
+                    if (k != start && innerPtr[k-1] == entries[m].first) { 
+                        if (mode == 0) 
+                            valuePtr[k-1] = entries[m].second; 
+                        else if (mode == 1) 
+                            valuePtr[k-1] += entries[m].second; 
+                        else if (mode == 2) 
+                            valuePtr[k-1] = std::max(valuePtr[k-1], entries[m].second); 
+                        else 
+                            valuePtr[k-1] = std::min(valuePtr[k-1], entries[m].second); 
                         }
-    
-                    if(size1Ind != size1  && it.row() == array1[size1Ind]) { 
-                        tripletList.push_back(R(size1Ind, j, it.value()));                  
+                    else { 
+                        innerPtr[k] = entries[m].first; 
+                        valuePtr[k] = entries[m].second; 
+                        k++; 
                         }
                     }
+                end = k; 
                 }
-            } 
-        else {
-            for (int j=0; j<size1; ++j) { 
-                size2Ind = 0; 
-                //For each row go through non-zero vals and copy to new array if indexed in array1
-                for (typename SparseMatrixExt<T, S>::InnerIterator it(*this, array1[j]); it; ++it) {
-                    while (size2Ind < size2 && array2[size2Ind] < it.col()) { 
-                        size2Ind++; 
+            
+            //Move the vector down to close the gaps 
+            if (start != nnz) { 
+                std::copy(innerPtr + start, innerPtr + end, innerPtr + nnz); 
+                std::copy(valuePtr + start, valuePtr + end, valuePtr + nnz); 
+                }
+            outerPtr[j] = nnz; 
+            nnz += end - start; 
+            }
+        
+        outerPtr[this->outerSize()] = nnz; 
+        std::free(this->m_innerNonZeros); 
+        this->m_innerNonZeros = 0; 
+        this->m_data.resize(nnz); 
+        }
+
+    void allocateCompressed(int nnz) { 
+        /* Make this matrix compressed with room for exactly nnz uninitialised elements */
+        unmap(); 
+        this->resize(this->rows(), this->cols()); 
+        this->resizeNonZeros(nnz); 
+        }
+
+    void setCompressed(int rows, int cols, const int* outerPtr, const int* innerInds, const T* vals) { 
+        /*
+        Replace this matrix with one of size rows x cols given by the compressed arrays 
+        outerPtr (outerSize+1 elements starting at 0), innerInds and vals (outerPtr[outerSize] 
+        elements each). The inner indices of each outer vector must be sorted and unique. 
+        The arrays are copied straight into the storage so there is no sorting. 
+        */
+        unmap(); 
+        this->resize(rows, cols); 
+        int nnz = outerPtr[this->outerSize()]; 
+        this->resizeNonZeros(nnz); 
+
+        std::copy(outerPtr, outerPtr + this->outerSize() + 1, this->outerIndexPtr()); 
+        std::copy(innerInds, innerInds + nnz, this->innerIndexPtr()); 
+        std::copy(vals, vals + nnz, this->valuePtr()); 
+        }
+
+    void gatherCount(const int* outerSel, int start, int end, const int* mapPtr, int* counts) { 
+        /*
+        Set counts[k] to the number of nonzeros of output outer vector k of a gather (see 
+        gatherFill), for k in start:end. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+
+        for (int k=start; k<end; k++) { 
+            int count = 0; 
+            for (int p=outerIndex[outerSel[k]]; p<outerIndex[outerSel[k]+1]; p++) 
+                count += mapPtr[innerIndex[p]+1] - mapPtr[innerIndex[p]]; 
+            counts[k] = count; 
+            }
+        }
+
+    void gatherFill(const int* outerSel, int start, int end, const int* mapPtr, const int* mapInds, bool sortInner, const int* outerOut, int* innerOut, T* valuesOut) { 
+        /*
+        Write output outer vectors start:end of a gather from this compressed matrix. Output 
+        outer vector k is outer vector outerSel[k] restricted to the selected inner indices, 
+        where inner index i goes to the output inner indices mapInds[mapPtr[i]:mapPtr[i+1]]. 
+        Vector k is written at outerOut[k] of innerOut and valuesOut, and its indices are 
+        sorted if sortInner is true (which is needed unless the selection is increasing). 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+        std::vector<std::pair<int, T> > pairs; 
+
+        for (int k=start; k<end; k++) { 
+            int q = outerOut[k]; 
+
+            for (int p=outerIndex[outerSel[k]]; p<outerIndex[outerSel[k]+1]; p++) { 
+                for (int m=mapPtr[innerIndex[p]]; m<mapPtr[innerIndex[p]+1]; m++) { 
+                    innerOut[q] = mapInds[m]; 
+                    valuesOut[q] = values[p]; 
+                    q++; 
+                    }
+                }
+
+            if (sortInner && q - outerOut[k] > 1) { 
+                pairs.clear(); 
+                for (int r=outerOut[k]; r<q; r++) 
+                    pairs.push_back(std::make_pair(innerOut[r], valuesOut[r])); 
+                std::sort(pairs.begin(), pairs.end()); 
+                for (int r=outerOut[k]; r<q; r++) { 
+                    innerOut[r] = pairs[r - outerOut[k]].first; 
+                    valuesOut[r] = pairs[r - outerOut[k]].second; 
+                    }
+                }
+            }
+        }
+
+    void innerRange(int outer, int innerStart, int innerStop, int innerStep, int& first, int& last) { 
+        /*
+        Find the positions first:last in the storage of the nonzeros of outer vector outer 
+        whose inner indices lie in the range of the slice innerStart:innerStop:innerStep, 
+        where the slice is normalised as by Python's slice.indices. 
+        */
+        int lo = innerStart; 
+        int hi = innerStop; 
+        const int* innerIndex = this->innerIndexPtr(); 
+
+        if (innerStep < 0) { 
+            lo = innerStop + 1; 
+            hi = innerStart + 1; 
+            }
+
+        first = this->outerIndexPtr()[outer]; 
+        last = this->outerIndexPtr()[outer+1]; 
+
+        if (hi <= lo) { 
+            last = first; 
+            return; 
+            }
+
+        first = std::lower_bound(innerIndex + first, innerIndex + last, lo) - innerIndex; 
+        last = std::lower_bound(innerIndex + first, innerIndex + last, hi) - innerIndex; 
+        }
+
+    void rangeCount(const int* outerSel, int start, int end, int innerStart, int innerStop, int innerStep, int* counts) { 
+        /*
+        Set counts[k] to the number of nonzeros of output outer vector k of a range slice 
+        (see rangeFill), for k in start:end. 
+        */
+        const int* innerIndex = this->innerIndexPtr(); 
+        int absStep = std::abs(innerStep); 
+        int first, last; 
+
+        for (int k=start; k<end; k++) { 
+            this->innerRange(outerSel[k], innerStart, innerStop, innerStep, first, last); 
+
+            if (absStep == 1) 
+                counts[k] = last - first; 
+            else { 
+                counts[k] = 0; 
+                for (int p=first; p<last; p++) 
+                    counts[k] += (std::abs(innerIndex[p] - innerStart) % absStep == 0); 
+                }
+            }
+        }
+
+    void rangeFill(const int* outerSel, int start, int end, int innerStart, int innerStop, int innerStep, const int* outerOut, int* innerOut, T* valuesOut) { 
+        /*
+        Write output outer vectors start:end of a slice of this compressed matrix. Output outer 
+        vector k is outer vector outerSel[k] restricted to the inner indices of the slice 
+        innerStart:innerStop:innerStep (normalised as by slice.indices), and is written at 
+        outerOut[k] of innerOut and valuesOut. The nonzeros in range are found with a binary 
+        search and copied as a block when the step is 1. 
+        */
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+        int absStep = std::abs(innerStep); 
+        int first, last, q, d; 
+
+        for (int k=start; k<end; k++) { 
+            this->innerRange(outerSel[k], innerStart, innerStop, innerStep, first, last); 
+            q = outerOut[k]; 
+
+            if (innerStep == 1) { 
+                std::copy(values + first, values + last, valuesOut + q); 
+                for (int p=first; p<last; p++) 
+                    innerOut[q++] = innerIndex[p] - innerStart; 
+                }
+            else if (innerStep > 0) { 
+                for (int p=first; p<last; p++) { 
+                    d = innerIndex[p] - innerStart; 
+                    if (d % absStep == 0) { 
+                        innerOut[q] = d/absStep; 
+                        valuesOut[q++] = values[p]; 
                         }
-    
-                    if(size2Ind != size2 && it.col() == array2[size2Ind]) { 
-                        tripletList.push_back(R(j, size2Ind, it.value()));                  
+                    }
+                }
+            else { 
+                for (int p=last-1; p>=first; p--) { 
+                    d = innerStart - innerIndex[p]; 
+                    if (d % absStep == 0) { 
+                        innerOut[q] = d/absStep; 
+                        valuesOut[q++] = values[p]; 
                         }
                     }
                 }
             }
+        }
+
+    struct InnerOrder { 
+        const int* inds; 
+        bool operator()(int a, int b) const { return inds[a] < inds[b]; } 
+        }; 
+
+    void groupQueries(const int* outerQ, int numQueries, int* queryPtr, int* order) { 
+        /*
+        Group the queries by outer index with a counting sort: the queries of outer vector j 
+        are order[queryPtr[j]:queryPtr[j+1]]. queryPtr has outerSize+1 elements. 
+        */
+        int outerSize = this->outerSize(); 
+
+        std::fill(queryPtr, queryPtr + outerSize + 1, 0); 
+        for (int k=0; k<numQueries; k++) 
+            queryPtr[outerQ[k]+1]++; 
+        for (int j=0; j<outerSize; j++) 
+            queryPtr[j+1] += queryPtr[j]; 
+
+        std::vector<int> next(queryPtr, queryPtr + outerSize); 
+        for (int k=0; k<numQueries; k++) 
+            order[next[outerQ[k]]++] = k; 
+        }
+
+    void lookupGroups(const int* groups, int start, int end, const int* queryPtr, int* order, const int* innerQ, T* result) { 
+        /*
+        For the queries of outer vectors groups[start:end] (see groupQueries) write the element 
+        of this compressed matrix at inner index innerQ[k] of the outer vector to result[k], 
+        leaving result[k] alone if it is zero. The queries of a vector are sorted by inner index 
+        so the vector is swept once, with a galloping search from the last position. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+        InnerOrder less; 
+        less.inds = innerQ; 
+
+        for (int g=start; g<end; g++) { 
+            int j = groups[g]; 
+            int p = outerIndex[j]; 
+            int pEnd = outerIndex[j+1]; 
+            std::sort(order + queryPtr[j], order + queryPtr[j+1], less); 
+
+            for (int q=queryPtr[j]; q<queryPtr[j+1]; q++) { 
+                int target = innerQ[order[q]]; 
+                int step = 1; 
+
+                while (p + step < pEnd && innerIndex[p + step] < target) 
+                    step *= 2; 
+
+                p = std::lower_bound(innerIndex + p + step/2, innerIndex + std::min(p + step + 1, pEnd), target) - innerIndex; 
+
+                if (p < pEnd && innerIndex[p] == target) 
+                    result[order[q]] = values[p]; 
+                }
+            }
+        }
 
-        mat->setFromTriplets(tripletList.begin(), tripletList.end());
+    void lookupPairs(const int* outerQ, const int* innerQ, int start, int end, T* result) { 
+        /*
+        Write the elements of this compressed matrix at outer indices outerQ[k] and inner 
+        indices innerQ[k] to result[k] for k in start:end, using a binary search for each. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const int* p; 
+
+        for (int k=start; k<end; k++) { 
+            p = std::lower_bound(innerIndex + outerIndex[outerQ[k]], innerIndex + outerIndex[outerQ[k]+1], innerQ[k]); 
+            if (p != innerIndex + outerIndex[outerQ[k]+1] && *p == innerQ[k]) 
+                result[k] = this->valuePtr()[p - innerIndex]; 
+            }
+        }
+
+    template <class U> 
+    static inline void reduceStep(int op, U value, int index, U center, U& acc, int& count, int& arg, int& gap) { 
+        /*
+        Fold the element value at position index of a line into its accumulator acc. The 
+        elements of a line must be visited in increasing order of index, so that arg is the 
+        first position of the max/min and gap the first position which is not stored. 
+        */
+        if (gap == -1 && index != count) 
+            gap = count; 
+
+        switch (op) { 
+            case 0: 
+                acc += value; 
+                break; 
+            case 1: 
+                acc += value < 0 ? -value : value; 
+                break; 
+            case 2: 
+                acc += value*value; 
+                break; 
+            case 3: 
+                acc += (value - center)*(value - center); 
+                break; 
+            case 4: 
+                if (count == 0 || value > acc) { 
+                    acc = value; 
+                    arg = index; 
+                    }
+                break; 
+            case 5: 
+                if (count == 0 || value < acc) { 
+                    acc = value; 
+                    arg = index; 
+                    }
+                break; 
+            case 6: 
+                acc += value != 0; 
+                break; 
+            }
+
+        count++; 
+        }
+
+    template <class U> 
+    void reduceOuter(int op, int start, int end, const U* center, U* result, int* counts, int* args, int* gaps) { 
+        /*
+        Reduce each outer vector start:end of this compressed matrix with op into result, 
+        writing the number of stored elements to counts, the inner index of the max/min to 
+        args and the first inner index which is not stored (or -1) to gaps. The op codes are 
+        0: sum, 1: sum of absolute values, 2: sum of squares, 3: sum of squared differences 
+        from center, 4: max, 5: min and 6: number of nonzeros. Each outer vector is written 
+        only by its own call so that ranges can be reduced in parallel. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+
+        for (int j=start; j<end; j++) 
+            for (int p=outerIndex[j]; p<outerIndex[j+1]; p++) 
+                reduceStep<U>(op, (U)values[p], innerIndex[p], center[j], result[j], counts[j], args[j], gaps[j]); 
+        }
+
+    template <class U> 
+    void reduceInner(int op, const U* center, U* result, int* counts, int* args, int* gaps) { 
+        /*
+        As reduceOuter but reducing across the outer vectors, so that there is one result 
+        for each inner index. The values are streamed once in storage order and scattered 
+        into result, and args and gaps are outer indices. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+        int i; 
+
+        for (int j=0; j<this->outerSize(); j++) 
+            for (int p=outerIndex[j]; p<outerIndex[j+1]; p++) { 
+                i = innerIndex[p]; 
+                reduceStep<U>(op, (U)values[p], j, center[i], result[i], counts[i], args[i], gaps[i]); 
+                }
+        }
+
+    template <class U> 
+    void densify(int start, int end, int outerOffset, int innerStart, int innerStop, U* result, long outerStride, long innerStride) { 
+        /*
+        Write the outer vectors start:end of this compressed matrix, restricted to the inner 
+        indices innerStart:innerStop, to the dense array result, whose element for outer 
+        index j and inner index i is result[(j-outerOffset)*outerStride + (i-innerStart)*innerStride]. 
+        Each line is zeroed first, so result need not be initialised, and each call writes 
+        only its own lines so that ranges can be densified in parallel. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+        const int* p; 
+        const int* pEnd; 
+        U* line; 
+
+        for (int j=start; j<end; j++) { 
+            line = result + (long)(j - outerOffset)*outerStride; 
+            for (long i=0; i<innerStop-innerStart; i++) 
+                line[i*innerStride] = 0; 
+
+            p = innerIndex + outerIndex[j]; 
+            pEnd = innerIndex + outerIndex[j+1]; 
+            if (innerStart != 0) 
+                p = std::lower_bound(p, pEnd, innerStart); 
+
+            for (; p<pEnd && *p<innerStop; p++) 
+                line[(long)(*p - innerStart)*innerStride] = (U)values[p - innerIndex]; 
+            }
+        }
+
+    bool containsPattern(const SparseMatrixExt& other, int start, int end) { 
+        /*
+        Return true if every nonzero of the compressed matrix other in the outer vectors 
+        start:end is also stored in this compressed matrix. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const int* otherOuter = other.outerIndexPtr(); 
+        const int* otherInner = other.innerIndexPtr(); 
+        int p, pEnd; 
+
+        for (int j=start; j<end; j++) { 
+            if (otherOuter[j+1] - otherOuter[j] > outerIndex[j+1] - outerIndex[j]) 
+                return false; 
+
+            p = outerIndex[j]; 
+            pEnd = outerIndex[j+1]; 
+            for (int q=otherOuter[j]; q<otherOuter[j+1]; q++) { 
+                while (p < pEnd && innerIndex[p] < otherInner[q]) 
+                    p++; 
+                if (p == pEnd || innerIndex[p] != otherInner[q]) 
+                    return false; 
+                }
+            }
+
+        return true; 
+        }
+
+    void addPattern(const SparseMatrixExt& other, T alpha, int start, int end) { 
+        /*
+        Add alpha times other to this matrix in place in the outer vectors start:end, 
+        where the nonzeros of other are a subset of those of this one (see containsPattern). 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const int* otherOuter = other.outerIndexPtr(); 
+        const int* otherInner = other.innerIndexPtr(); 
+        const T* otherValues = other.valuePtr(); 
+        T* values = this->valuePtr(); 
+        int p; 
+
+        for (int j=start; j<end; j++) { 
+            p = outerIndex[j]; 
+            for (int q=otherOuter[j]; q<otherOuter[j+1]; q++) { 
+                while (innerIndex[p] < otherInner[q]) 
+                    p++; 
+                values[p] += alpha*otherValues[q]; 
+                }
+            }
+        }
+
+    void mergeScaled(const SparseMatrixExt& other, T alpha) { 
+        /*
+        Replace this matrix with this + alpha*other, merging the nonzeros into new storage. 
+        */
+        SparseMatrix<T, S> result = (*this) + alpha*other; 
+        this->swap(result); 
+        }
+
+    template <class U> 
+    void scaleLines(const U* factors, bool byOuter, bool divide, int start, int end, U* result) { 
+        /*
+        For the nonzeros of the outer vectors start:end of this compressed matrix, write 
+        the value times (or divided by) the factor of its outer vector (if byOuter) or of its 
+        inner index to result, which has the positions of the values and can be valuePtr(). 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+        U factor = 0; 
+
+        for (int j=start; j<end; j++) { 
+            if (byOuter) 
+                factor = factors[j]; 
+            for (int p=outerIndex[j]; p<outerIndex[j+1]; p++) { 
+                if (!byOuter) 
+                    factor = factors[innerIndex[p]]; 
+                if (divide) 
+                    result[p] = (U)values[p] / factor; 
+                else 
+                    result[p] = (U)values[p] * factor; 
+                }
+            }
+        }
+
+    template <class U> 
+    void scatterAdd(int start, int end, U alpha, U* result, long outerStride, long innerStride) { 
+        /*
+        Add alpha times the nonzeros of the outer vectors start:end of this compressed 
+        matrix to the dense array result, whose element for outer index j and inner index 
+        i is result[j*outerStride + i*innerStride]. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+        U* line; 
+
+        for (int j=start; j<end; j++) { 
+            line = result + (long)j*outerStride; 
+            for (int p=outerIndex[j]; p<outerIndex[j+1]; p++) 
+                line[(long)innerIndex[p]*innerStride] += alpha*(U)values[p]; 
+            }
+        }
+
+    template <class U> 
+    void gatherMultiply(int start, int end, const U* dense, long outerStride, long innerStride, U* result) { 
+        /*
+        For the nonzeros of the outer vectors start:end of this compressed matrix, write 
+        the value times the element at the same position of the dense array (laid out as 
+        in scatterAdd) to result, which has the positions of the values. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+        const U* line; 
+
+        for (int j=start; j<end; j++) { 
+            line = dense + (long)j*outerStride; 
+            for (int p=outerIndex[j]; p<outerIndex[j+1]; p++) 
+                result[p] = (U)values[p] * line[(long)innerIndex[p]*innerStride]; 
+            }
+        }
+
+    void productLines(const SparseMatrixExt& lines, int start, int end, double threshold, int topk, int* counts, int* resultInner, T* resultValues, int tableSize, int* keys, T* acc, int* touched) { 
+        /*
+        Row-wise (Gustavson) sparse product for the outer vectors start:end of the result: 
+        outer vector j is the sum over the nonzeros (k, x) of outer vector j of this matrix 
+        of x times outer vector k of lines. The sums are accumulated in a table of tableSize 
+        slots, where keys holds the inner index of each slot (-1 if empty) and acc the sum, 
+        and touched lists the slots used by the current outer vector. If tableSize is at 
+        least lines.innerSize() inner index i uses slot i, otherwise the table is an open 
+        addressing hash table (tableSize a power of 2, at least twice the number of products 
+        in any outer vector). Elements of absolute value below threshold are dropped and if 
+        topk >= 0 only the topk of largest absolute value are kept (the smallest indices on 
+        ties). If resultInner is NULL the number of elements of outer vector j is written to 
+        counts[j], and otherwise they are written in order to resultInner and resultValues 
+        starting at counts[j]. keys starts with all slots empty and is left that way. 
+        */
+        const int* outerIndex = this->outerIndexPtr(); 
+        const int* innerIndex = this->innerIndexPtr(); 
+        const T* values = this->valuePtr(); 
+        const int* lineOuter = lines.outerIndexPtr(); 
+        const int* lineInner = lines.innerIndexPtr(); 
+        const T* lineValues = lines.valuePtr(); 
+        bool numeric = resultInner != NULL || threshold > 0; 
+        bool hashed = tableSize < lines.innerSize(); 
+        unsigned int mask = tableSize - 1; 
+        int size, used, i, k, slot; 
+        T x; 
+
+        for (int j=start; j<end; j++) { 
+            used = 0; 
+            
+            for (int p=outerIndex[j]; p<outerIndex[j+1]; p++) { 
+                k = innerIndex[p]; 
+                x = values[p]; 
+                
+                for (int q=lineOuter[k]; q<lineOuter[k+1]; q++) { 
+                    i = lineInner[q]; 
+                    
+                    if (hashed) { 
+                        slot = ((unsigned int)i * 2654435761u) & mask; 
+                        while (keys[slot] != -1 && keys[slot] != i) 
+                            slot = (slot + 1) & mask; 
+                        }
+                    else 
+                        slot = i; 
+                    
+                    if (keys[slot] == -1) { 
+                        keys[slot] = i; 
+                        touched[used++] = slot; 
+                        if (numeric) 
+                            acc[slot] = x*lineValues[q]; 
+                        }
+                    else if (numeric)
+                        acc[slot] += x*lineValues[q]; 
+                    }
+                }
+            
+            //Dropped slots are moved after the kept ones so that they are still emptied 
+            size = used; 
+            if (threshold > 0) 
+                size = std::partition(touched, touched + used, AtLeastMagnitude<T>(acc, threshold)) - touched; 
+            
+            if (topk >= 0 && size > topk) { 
+                if (numeric) 
+                    std::nth_element(touched, touched + topk, touched + size, LargerMagnitude<T>(acc, keys)); 
+                size = topk; 
+                }
+            
+            if (resultInner == NULL) 
+                counts[j] = size; 
+            else { 
+                std::sort(touched, touched + size, SmallerKey(keys)); 
+                for (int r=0; r<size; r++) { 
+                    resultInner[counts[j] + r] = keys[touched[r]]; 
+                    resultValues[counts[j] + r] = acc[touched[r]]; 
+                    }
+                }
+            
+            for (int r=0; r<used; r++) 
+                keys[touched[r]] = -1; 
+            }
         }
 
     void scalarMultiply(double d) { 
@@ -409,6 +1373,67 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
         return ((SparseMatrixExt<T, S>)((*this) - other)); 
         }
 
+    template <class U> 
+    void sumPartials(U* partials, int numPartials, long size, long start, long end, U* result) { 
+        /*
+        Reduce numPartials consecutive arrays of length size, stored in partials, into result 
+        for the elements start:end. Used to sum per-thread accumulators from parallel products. 
+        */
+        U* partial; 
+
+        for (int i=0; i<numPartials; i++) { 
+            partial = partials + i*size; 
+            for (long j=start; j<end; j++) 
+                result[j] += partial[j]; 
+            }
+        }
+
+    void splitOuter(int numParts, long* splits) { 
+        /*
+        Split the outer vectors into numParts contiguous ranges splits[i]:splits[i+1] of 
+        roughly equal work, where the work of a range is its number of nonzeros plus its 
+        number of outer vectors. splits must have numParts+1 elements. This balances 
+        parallel products on matrices with very uneven numbers of nonzeros per row/col. 
+        */
+        int outerSize = this->outerSize(); 
+        double totalWork; 
+        double target; 
+        long work = 0; 
+        int i = 0; 
+        int lower, upper, middle; 
+        const int* outerPtr = this->outerIndexPtr(); 
+
+        totalWork = this->nonZeros() + outerSize; 
+        splits[0] = 0; 
+
+        for (int p=1; p<numParts; p++) { 
+            target = totalWork*p/numParts; 
+
+            if (this->isCompressed()) { 
+                //Binary search for the first i with outerPtr[i] + i >= target 
+                lower = splits[p-1]; 
+                upper = outerSize; 
+                while (lower < upper) { 
+                    middle = lower + (upper - lower)/2; 
+                    if (outerPtr[middle] + middle < target) 
+                        lower = middle + 1; 
+                    else 
+                        upper = middle; 
+                    }
+                splits[p] = lower; 
+                }
+            else { 
+                while (i < outerSize && work < target) { 
+                    work += this->outerEnd(i) - this->outerStart(i) + 1; 
+                    i++; 
+                    }
+                splits[p] = i; 
+                }
+            }
+
+        splits[numParts] = outerSize; 
+        }
+
     T sumValues() { 
         T result = 0; 
         for (int k=0; k<this->outerSize(); ++k) {
@@ -432,7 +1457,10 @@ class SparseMatrixExt:public SparseMatrix<T, S> {
     void unsafeInsertVal2(int row, int col, T val) { 
         this->insert(row, col) = val;
         }
-  };
+
+  private: 
+    bool mapped; 
+};
 
 #endif
 
@@ -1,2 +1,3 @@
 #
-from sppy.io.matrix_market import mmwrite, mmread
\ No newline at end of file
+from sppy.io.matrix_market import mmwrite, mmread
+from sppy.io.binary import save, load, toSharedMemory, fromSharedMemory
\ No newline at end of file
@@ -0,0 +1,297 @@
+import json
+import os
+import struct
+import sys
+import numpy
+from sppy import csarray
+from sppy.csarray import checkCompressed
+"""
+Functions to save and load csarray objects in a binary format which stores the
+compressed arrays directly. The file is an 8 byte magic string, a 4 byte little
+endian header length and a JSON header, padded so that the data is 64 byte aligned.
+Then come the outer index pointers, inner indices and values. Without compression
+each array is written as is and padded to 64 bytes so that it can be memory mapped,
+otherwise each block of the array is written as an 8 byte length and the output of
+the compressor. The same layout is used for blocks of shared memory, which other
+processes can attach to without copying.
+"""
+
+MAGIC = b"SPPYCSA\x00"
+ALIGNMENT = 64
+VERSION = 1
+
+
+def save(filename, A, compressor=None, block_size=2**24):
+    """
+    Save a csarray object in a binary file using its compressed storage.
+
+    :param filename: The name of the file.
+
+    :param A: The csarray object to write
+
+    :param compressor: None, or the name of a module with compress and decompress functions ("zlib", "bz2" or "lzma") which is used on each block of each array.
+
+    :param block_size: The number of bytes in each compressed block.
+    """
+    if A.ndim != 2:
+        raise ValueError("Can only save 2d arrays")
+    if compressor != None:
+        compressModule = getCompressor(compressor)
+
+    arrays = [A.outerIndexPtr(), A.innerIndexPtr(), A.valuePtr()]
+    header = makeHeader(A, compressor, block_size)
+
+    fileObj = open(filename, "wb")
+
+    try:
+        fileObj.write(encodeHeader(header))
+
+        for array in arrays:
+            array = array.view(numpy.uint8)
+
+            if compressor == None:
+                fileObj.write(array)
+                fileObj.write(b"\x00" * (-array.shape[0] % ALIGNMENT))
+            else:
+                for i in range(0, array.shape[0], block_size):
+                    block = compressModule.compress(array[i:i+block_size])
+                    fileObj.write(struct.pack("<Q", len(block)))
+                    fileObj.write(block)
+    finally:
+        fileObj.close()
+
+def load(filename, mmap_mode=None):
+    """
+    Load a csarray object saved with save. The arrays are read straight into the storage
+    of the output. With mmap_mode="r" the file is instead memory mapped and the output is
+    a read-only csarray which reads its elements from the file as they are needed, so that
+    even very large files open at once. This is only possible for uncompressed files. The
+    transpose of a mapped array is also mapped onto the file, so that products such as
+    A.T.dot(V) (and hence sppy.linalg.rsvd) work without loading the file into memory.
+    The size of a mapped file and its outer index pointers are checked, but not the
+    inner indices since that would read the whole file, so mapped files must be trusted
+    (written by save).
+
+    :param filename: The name of the file.
+
+    :param mmap_mode: Either None or "r" to memory map the file.
+    """
+    if mmap_mode not in [None, "r"]:
+        raise ValueError("Invalid mmap_mode: " + str(mmap_mode))
+
+    fileObj = open(filename, "rb")
+
+    try:
+        prefix = fileObj.read(len(MAGIC) + 4)
+        if len(prefix) == len(MAGIC) + 4 and prefix[0:len(MAGIC)] == MAGIC:
+            prefix += fileObj.read(struct.unpack("<I", prefix[len(MAGIC):])[0])
+        header, offset = decodeHeader(prefix)
+
+        shape = tuple(header["shape"])
+        nnz = header["nnz"]
+
+        if mmap_mode == "r":
+            if header["compressor"] != None:
+                raise ValueError("Cannot memory map a compressed file")
+
+            layout, fileSize = arrayLayout(header, offset)
+            if os.path.getsize(filename) < fileSize:
+                raise ValueError("File is truncated")
+
+            arrays = []
+
+            for arrayDtype, size, offset in layout:
+                if size == 0:
+                    arrays.append(numpy.zeros(0, arrayDtype))
+                else:
+                    arrays.append(numpy.memmap(filename, arrayDtype, "r", offset, (size, )))
+
+            checkOuterIndexPtr(arrays[0], nnz)
+            return csarray.fromCompressed(shape, arrays[0], arrays[1], arrays[2], storagetype=header["storagetype"], check=False, copy=False)
+
+        A = csarray(shape, numpy.dtype(header["dtype"]), header["storagetype"])
+        arrays = A._array.allocateCompressed(nnz)
+
+        if header["compressor"] != None:
+            compressModule = getCompressor(header["compressor"])
+
+        for array in arrays:
+            array = array.view(numpy.uint8)
+
+            if header["compressor"] == None:
+                if fileObj.readinto(array) != array.shape[0]:
+                    raise ValueError("File is truncated")
+                fileObj.read(-array.shape[0] % ALIGNMENT)
+            else:
+                i = 0
+                while i < array.shape[0]:
+                    lengthStr = fileObj.read(8)
+                    if len(lengthStr) != 8:
+                        raise ValueError("File is truncated")
+                    blockLength = struct.unpack("<Q", lengthStr)[0]
+                    block = fileObj.read(blockLength)
+                    if len(block) != blockLength:
+                        raise ValueError("File is truncated")
+                    block = compressModule.decompress(block)
+                    if len(block) == 0 or i + len(block) > array.shape[0]:
+                        raise ValueError("Block sizes do not match the header")
+                    array[i:i+len(block)] = numpy.frombuffer(block, numpy.uint8)
+                    i += len(block)
+    finally:
+        fileObj.close()
+
+    #The arrays are in memory now, so check them fully before the kernels use them
+    checkOuterIndexPtr(arrays[0], nnz)
+    checkCompressed(shape, header["storagetype"], arrays[0], arrays[1], arrays[2])
+    return A
+
+def toSharedMemory(A, name=None):
+    """
+    Copy a csarray object into a new block of shared memory (see
+    multiprocessing.shared_memory) in the same layout as an uncompressed file written
+    with save. Other processes can then use fromSharedMemory with the name of the block
+    to get a read-only csarray on the same memory without copying. Returns the
+    SharedMemory object: its name attribute is the name of the block. Only the creator
+    unlinks the block, by calling unlink once it is no longer needed.
+
+    :param A: The csarray object to copy
+
+    :param name: The name of the block, or None to choose a unique one.
+    """
+    from multiprocessing import shared_memory
+
+    if A.ndim != 2:
+        raise ValueError("Can only share 2d arrays")
+
+    arrays = [A.outerIndexPtr(), A.innerIndexPtr(), A.valuePtr()]
+    header = makeHeader(A)
+    headerStr = encodeHeader(header)
+    layout, size = arrayLayout(header, len(headerStr))
+
+    sharedMemory = shared_memory.SharedMemory(name=name, create=True, size=size)
+    sharedMemory.buf[0:len(headerStr)] = headerStr
+
+    for array, (arrayDtype, size, offset) in zip(arrays, layout):
+        sharedMemory.buf[offset:offset + array.nbytes] = array.view(numpy.uint8)
+
+    return sharedMemory
+
+def fromSharedMemory(name):
+    """
+    Attach to a block of shared memory created with toSharedMemory and return a read-only
+    csarray object which uses it as storage without copying. The block stays attached as
+    long as the array (or any array made from it without copying, such as its transpose)
+    exists. The block is not tracked by this process, so it is not unlinked when the
+    process exits: only the creator unlinks it.
+
+    :param name: The name of the block of shared memory.
+    """
+    from multiprocessing import shared_memory
+
+    #Attach without registering with the resource tracker, which would otherwise unlink
+    #the block of the creator when this process exits
+    if sys.version_info >= (3, 13):
+        sharedMemory = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        sharedMemory = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(sharedMemory._name, "shared_memory")
+
+    header, offset = decodeHeader(sharedMemory.buf)
+    arrays = []
+
+    for arrayDtype, size, offset in arrayLayout(header, offset)[0]:
+        arrays.append(numpy.frombuffer(sharedMemory.buf, arrayDtype, size, offset))
+
+    A = csarray(tuple(header["shape"]), numpy.dtype(header["dtype"]), header["storagetype"])
+    A._array.mapCompressed(arrays[0], arrays[1], arrays[2], False, sharedMemory)
+    return A
+
+def makeHeader(A, compressor=None, blockSize=2**24):
+    """
+    Return the header describing csarray A as a dict.
+    """
+    header = {"version": VERSION, "shape": list(A.shape), "storagetype": A.storagetype, "nnz": A.nnz}
+    header["indexdtype"] = numpy.dtype(numpy.int32).str
+    header["dtype"] = numpy.dtype(A.dtype).str
+    header["compressor"] = compressor
+    header["block_size"] = blockSize
+    return header
+
+def encodeHeader(header):
+    """
+    Return the magic string, header length and JSON header as bytes, padded so that
+    the length is a multiple of ALIGNMENT.
+    """
+    headerStr = json.dumps(header).encode("ascii")
+    headerStr += b" " * (-(len(MAGIC) + 4 + len(headerStr)) % ALIGNMENT)
+    return MAGIC + struct.pack("<I", len(headerStr)) + headerStr
+
+def decodeHeader(buffer):
+    """
+    Read the header at the start of a bytes-like object, and return it as a dict along
+    with the offset of the first array.
+    """
+    start = len(MAGIC) + 4
+
+    if len(buffer) < start or bytes(buffer[0:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a csarray file")
+
+    headerLength = struct.unpack_from("<I", buffer, len(MAGIC))[0]
+    if len(buffer) < start + headerLength:
+        raise ValueError("File is truncated")
+
+    header = json.loads(bytes(buffer[start:start + headerLength]).decode("ascii"))
+
+    if header["version"] > VERSION:
+        raise ValueError("Unsupported file version: " + str(header["version"]))
+
+    if not numpy.dtype(header["indexdtype"]).isnative or not numpy.dtype(header["dtype"]).isnative:
+        raise ValueError("File has non-native byte order")
+
+    return header, start + headerLength
+
+def arrayLayout(header, offset):
+    """
+    Return a list of the dtype, length and offset of the outer index pointers, inner
+    indices and values of an uncompressed file with the given header, whose first array
+    starts at offset, and the total size in bytes.
+    """
+    indexDtype = numpy.dtype(header["indexdtype"])
+    dtype = numpy.dtype(header["dtype"])
+    nnz = header["nnz"]
+    layout = []
+
+    for arrayDtype, size in zip([indexDtype, indexDtype, dtype], [outerSize(header["shape"], header["storagetype"])+1, nnz, nnz]):
+        layout.append((arrayDtype, size, offset))
+        nbytes = size*arrayDtype.itemsize
+        offset += nbytes + (-nbytes % ALIGNMENT)
+
+    return layout, offset
+
+def outerSize(shape, storagetype):
+    """
+    Return the number of outer vectors of an array of the given shape and storage type.
+    """
+    if storagetype == "col":
+        return shape[1]
+    else:
+        return shape[0]
+
+def checkOuterIndexPtr(outerIndexPtr, nnz):
+    """
+    Check that outer index pointers read from a file start at 0, do not decrease and end
+    at nnz, so that the nonzero elements of each outer vector are within the storage.
+    """
+    if outerIndexPtr[0] != 0 or outerIndexPtr[outerIndexPtr.shape[0]-1] != nnz or (numpy.diff(outerIndexPtr) < 0).any():
+        raise ValueError("Inconsistent outer index pointers")
+
+def getCompressor(compressor):
+    """
+    Import and return the compression module of the given name.
+    """
+    if compressor not in ["zlib", "bz2", "lzma"]:
+        raise ValueError("Unknown compressor: " + str(compressor))
+
+    return __import__(compressor)
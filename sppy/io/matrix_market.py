@@ -1,15 +1,20 @@
 
+import gzip 
+import itertools 
+import multiprocessing 
 import numpy 
-import string
 from sppy import csarray
+from sppy.io.mmparse import parseElements 
 """
 Some functions to read and write matrix market files. 
 """
 
 
-def mmwrite(filename, A, comment='', field=None, precision=None): 
+def mmwrite(filename, A, comment='', field=None, precision=None, symmetry="general", block_size=2**20): 
     """
-    Write a csarray object in matrix market format. 
+    Write a csarray object in matrix market format. The elements are read in blocks 
+    straight from the compressed storage of A and each block is formatted in one go. If 
+    the filename ends with .gz the file is gzipped. 
     
     :param filename: The filename of the matrix market file. 
     
@@ -17,9 +22,13 @@ def mmwrite(filename, A, comment='', field=None, precision=None):
     
     :param comment: A comment to add to the header of the file. 
     
-    :param field: The type of values to write out either "integer" or "real". If None the type is inferred from A. 
+    :param field: The type of values to write out either "integer", "real" or "pattern". If None the type is inferred from A. 
     
     :param precision: If A stores real numbers, this is the precision to use when writing to file. 
+    
+    :param symmetry: Either "general" or "symmetric", in which case A is assumed to be symmetric and only its lower triangle is written. 
+    
+    :param block_size: The approximate number of elements to format at once. 
     """
     
     if field == None: 
@@ -30,77 +39,201 @@ def mmwrite(filename, A, comment='', field=None, precision=None):
     
     if field == "real": 
         if precision != None: 
-            fmtStr = "%." + str(precision) + "f"
+            fmtStr = "%d %d %." + str(precision) + "f\n"
         else: 
-            fmtStr = "%f"
+            fmtStr = "%d %d %f\n"
+    elif field == "integer": 
+        fmtStr = "%d %d %d\n"
+    elif field == "pattern": 
+        fmtStr = "%d %d\n"
     else: 
-        fmtStr = "%d"
-    
-    fileObj = open(filename, "w")
-    
-    fileObj.write("%%MatrixMarket matrix coordinate " + field + " general\n")
-    fileObj.write("%%" + comment + "\n")
-    fileObj.write("%%\n")
-    
-    fileObj.write(str(A.shape[0]) + " " + str(A.shape[1]) + " " + str(A.nnz) + "\n")
-    
-    rowInds, colInds = A.nonzero()
-    vals = A.values()
+        raise ValueError("Invalid field: " + str(field))
+        
+    if symmetry not in ["general", "symmetric"]: 
+        raise ValueError("Invalid symmetry: " + str(symmetry))
+    if symmetry == "symmetric" and A.shape[0] != A.shape[1]: 
+        raise ValueError("Symmetric matrices must be square: " + str(A.shape))
     
-    for i, val in enumerate(vals):
-        valStr = fmtStr % val
-        fileObj.write(str(rowInds[i]+1) + " " + str(colInds[i]+1) + " " + valStr + "\n")
+    if symmetry == "symmetric": 
+        nnz = sum(rowInds.shape[0] for rowInds, colInds, vals in mmBlocks(A, block_size, True))
+    else: 
+        nnz = A.nnz 
     
-    fileObj.close()
+    if filename.endswith(".gz"): 
+        fileObj = gzip.open(filename, "wb")
+    else: 
+        fileObj = open(filename, "wb")
+    
+    try: 
+        header = "%%MatrixMarket matrix coordinate " + field + " " + symmetry + "\n"
+        header += "%%" + comment + "\n"
+        header += "%%\n"
+        header += str(A.shape[0]) + " " + str(A.shape[1]) + " " + str(nnz) + "\n"
+        fileObj.write(header.encode("ascii"))
         
-def mmread(filename, storagetype="col"): 
+        for rowInds, colInds, vals in mmBlocks(A, block_size, symmetry == "symmetric"): 
+            if field == "pattern": 
+                elements = zip((rowInds+1).tolist(), (colInds+1).tolist())
+            else: 
+                elements = zip((rowInds+1).tolist(), (colInds+1).tolist(), vals.tolist())
+            
+            fileObj.write(((fmtStr*rowInds.shape[0]) % tuple(itertools.chain.from_iterable(elements))).encode("ascii"))
+    finally: 
+        fileObj.close()
+
+def mmBlocks(A, blockSize, lower=False): 
     """
-    Read from a matrix market file. Note that we do not allow comments (%) in the 
-    body of the elements, only in the header lines. 
+    Iterate over the elements of A as blocks of (rowInds, colInds, values) of about 
+    blockSize elements, taken from whole outer vectors of the compressed storage. If 
+    lower is True only the elements on or below the diagonal are returned. 
+    """
+    outerIndexPtr = A.outerIndexPtr()
+    innerIndexPtr = A.innerIndexPtr()
+    values = A.valuePtr()
+    outerSize = outerIndexPtr.shape[0]-1
+    i = 0 
+    
+    while i < outerSize: 
+        j = numpy.searchsorted(outerIndexPtr, outerIndexPtr[i] + blockSize, side="right") - 1 
+        j = min(max(j, i+1), outerSize)
+        
+        start, end = outerIndexPtr[i], outerIndexPtr[j]
+        outerInds = numpy.repeat(numpy.arange(i, j, dtype=numpy.int32), numpy.diff(outerIndexPtr[i:j+1]))
+        innerInds = innerIndexPtr[start:end]
+        vals = values[start:end]
+        
+        if A.storagetype == "col": 
+            rowInds, colInds = innerInds, outerInds 
+        else: 
+            rowInds, colInds = outerInds, innerInds 
+        
+        if lower: 
+            inds = rowInds >= colInds
+            rowInds, colInds, vals = rowInds[inds], colInds[inds], vals[inds]
+        
+        if rowInds.shape[0] != 0: 
+            yield rowInds, colInds, vals 
+        i = j 
+        
+def mmread(filename, storagetype="col", num_threads=None, chunk_size=2**26): 
+    """
+    Read from a coordinate matrix market file, which can be gzipped. The fields real, 
+    integer and pattern, and symmetries general, symmetric, skew-symmetric and hermitian 
+    (for real matrices) are supported. The file is read in chunks which are parsed in 
+    parallel straight into arrays of indices and values. 
     
     :param filename: The filename of the matrix market file. 
     
     :param storagetype: The desired storage type ("row" or "col") of the output matrix. 
-    """
-    fileObj = open(filename, "r")
-    
-    line = fileObj.readline()
-    line.strip().strip("#")
     
-    vals = line.split()
+    :param num_threads: The number of threads used to parse, by default the number of CPUs. 
     
-    if vals[3] == "integer": 
-        dtype = numpy.int 
-    elif vals[3] == "real": 
-        dtype = numpy.float 
-    else:
-        raise ValueError("Invalid data type: " + vals[3])
-    
-    line = fileObj.readline()
-    while string.find(line, "%") == 0: 
-        line = fileObj.readline()    
-    
-    vals = line.split()
-    m = int(vals[0])
-    n = int(vals[1])
-    nnz = int(vals[2])
+    :param chunk_size: The number of bytes of the file to parse at once. 
+    """
+    if num_threads == None: 
+        num_threads = multiprocessing.cpu_count()
     
-    rowInds = numpy.zeros(nnz, numpy.int32)
-    colInds = numpy.zeros(nnz, numpy.int32)
-    values = numpy.zeros(nnz, dtype)
+    fileObj = openMatrixMarket(filename)
     
-    #This reads the rest of the file reasonably quickly 
-    Z = numpy.fromfile(fileObj, sep=" ")
-    Z = Z.reshape((nnz, 3))
+    try: 
+        line = fileObj.readline()
+        vals = line.decode("ascii").lower().split()
+        
+        if len(vals) != 5 or vals[0] != "%%matrixmarket" or vals[1] != "matrix": 
+            raise ValueError("Invalid header: " + line.decode("ascii", "replace").strip())
+        if vals[2] != "coordinate": 
+            raise ValueError("Only coordinate matrices are supported: " + vals[2])
+        
+        field, symmetry = vals[3], vals[4]
+        
+        if field == "integer": 
+            dtype = numpy.int 
+        elif field == "real" or field == "double" or field == "pattern": 
+            dtype = numpy.float 
+        else:
+            raise ValueError("Invalid data type: " + field)
+        
+        if symmetry not in ["general", "symmetric", "skew-symmetric", "hermitian"]: 
+            raise ValueError("Invalid symmetry: " + symmetry)
+        
+        line = fileObj.readline()
+        while line.lstrip().startswith(b"%") or line.strip() == b"": 
+            if line == b"": 
+                raise ValueError("No size line found")
+            line = fileObj.readline()    
+        
+        vals = line.split()
+        m = int(vals[0])
+        n = int(vals[1])
+        nnz = int(vals[2])
+        
+        #Symmetric matrices store the lower triangle, which is mirrored 
+        size = nnz if symmetry == "general" else 2*nnz 
+        rowInds = numpy.zeros(size, numpy.int32)
+        colInds = numpy.zeros(size, numpy.int32)
+        
+        if field == "pattern": 
+            values = None 
+        elif field == "integer": 
+            values = numpy.zeros(size, numpy.int64)
+        else: 
+            values = numpy.zeros(size, numpy.float64)
+        
+        numParsed = 0 
+        remainder = b""
+        
+        while True: 
+            data = fileObj.read(chunk_size)
+            
+            if data == b"": 
+                data = remainder 
+                remainder = b""
+            else: 
+                data = remainder + data 
+                end = data.rfind(b"\n") + 1 
+                data, remainder = data[0:end], data[end:]
+            
+            if data == b"": 
+                if remainder == b"": 
+                    break 
+                continue 
+            
+            numParsed += parseElements(data, rowInds, colInds, values, numParsed, num_threads)
+    finally: 
+        fileObj.close()
 
-    rowInds = numpy.array(Z[:, 0], numpy.int32)-1 
-    colInds = numpy.array(Z[:, 1], numpy.int32)-1 
-    values = numpy.ascontiguousarray(Z[:, 2], dtype=dtype)
+    if numParsed != nnz: 
+        raise ValueError("Expected " + str(nnz) + " elements but found " + str(numParsed))
 
-    fileObj.close()
+    if symmetry != "general": 
+        offDiag = rowInds[0:nnz] != colInds[0:nnz]
+        k = numpy.count_nonzero(offDiag)
+        rowInds[nnz:nnz+k] = colInds[0:nnz][offDiag]
+        colInds[nnz:nnz+k] = rowInds[0:nnz][offDiag]
+        
+        if values is not None: 
+            values[nnz:nnz+k] = values[0:nnz][offDiag]
+            if symmetry == "skew-symmetric": 
+                numpy.negative(values[nnz:nnz+k], values[nnz:nnz+k])
+            values = values[0:nnz+k]
+            
+        rowInds = rowInds[0:nnz+k]
+        colInds = colInds[0:nnz+k]
+    
+    if values is None: 
+        values = 1 
 
-    A = csarray((m, n), dtype=dtype, storagetype=storagetype)
-    A.reserve(nnz)
-    A.put(values, rowInds, colInds, init=True)
+    return csarray.fromChunks((m, n), [(rowInds, colInds, values)], dtype=dtype, storagetype=storagetype)
+
+def openMatrixMarket(filename): 
+    """
+    Open a matrix market file for reading in binary mode, decompressing it if it is gzipped. 
+    """
+    fileObj = open(filename, "rb")
+    magic = fileObj.read(2)
+    fileObj.close()
     
-    return A     
\ No newline at end of file
+    if magic == b"\x1f\x8b": 
+        return gzip.open(filename, "rb")
+    else: 
+        return open(filename, "rb")
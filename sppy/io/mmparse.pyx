@@ -0,0 +1,153 @@
+#cython: boundscheck=False
+#cython: wraparound=False
+#cython: nonecheck=False
+"""
+A parser for the element lines of coordinate Matrix Market files. The text is split
+into blocks at line ends, the elements of each block are counted and then parsed in
+parallel straight into typed arrays.
+"""
+from cython.parallel import prange
+from libc.stdlib cimport strtol, strtod, strtoll
+from libc.string cimport memchr
+import numpy
+cimport numpy
+numpy.import_array()
+
+
+cdef inline const char* skipSpace(const char* p, const char* end) nogil:
+    while p < end and (p[0] == b' ' or p[0] == b'\t' or p[0] == b'\r'):
+        p += 1
+    return p
+
+cdef inline const char* nextLine(const char* p, const char* end) nogil:
+    cdef const char* q = <const char*>memchr(p, b'\n', end - p)
+    if q == NULL:
+        return end
+    return q + 1
+
+cdef inline bint crossesLine(const char* p, const char* q) nogil:
+    return memchr(p, b'\n', q - p) != NULL
+
+cdef long countBlock(const char* p, const char* end) nogil:
+    """
+    Count the element lines in the block, i.e. those which are not blank or comments.
+    """
+    cdef long count = 0
+
+    while p < end:
+        p = skipSpace(p, end)
+        if p < end and p[0] != b'\n' and p[0] != b'%':
+            count += 1
+        p = nextLine(p, end)
+
+    return count
+
+cdef long parseBlock(const char* p, const char* end, int* rowInds, int* colInds, double* realVals, long* intVals) nogil:
+    """
+    Parse the element lines of the block, writing 0-based indices to rowInds and colInds,
+    and the values to realVals or intVals unless both are NULL (a pattern file). Each field
+    must be on the line of the element, which may only be followed by a comment. Returns
+    the number of elements parsed, or -1 - (number of elements parsed before a bad line).
+    """
+    cdef long count = 0
+    cdef char* q
+
+    while p < end:
+        p = skipSpace(p, end)
+        if p == end:
+            break
+        if p[0] == b'\n' or p[0] == b'%':
+            p = nextLine(p, end)
+            continue
+
+        #strtol and strtod skip new lines, so a missing field would be read from the next line
+        rowInds[count] = strtol(p, &q, 10) - 1
+        if q == p or crossesLine(p, q):
+            return -1 - count
+        p = q
+        colInds[count] = strtol(p, &q, 10) - 1
+        if q == p or crossesLine(p, q):
+            return -1 - count
+        p = q
+
+        if realVals != NULL:
+            realVals[count] = strtod(p, &q)
+            if q == p or crossesLine(p, q):
+                return -1 - count
+            p = q
+        elif intVals != NULL:
+            intVals[count] = strtoll(p, &q, 10)
+            if q == p or crossesLine(p, q):
+                return -1 - count
+            p = q
+
+        p = skipSpace(p, end)
+        if p < end and p[0] != b'\n' and p[0] != b'%':
+            return -1 - count
+
+        count += 1
+        p = nextLine(p, end)
+
+    return count
+
+def parseElements(bytes data, numpy.ndarray[int, ndim=1, mode="c"] rowInds not None, numpy.ndarray[int, ndim=1, mode="c"] colInds not None, numpy.ndarray values, long offset, int numThreads):
+    """
+    Parse the complete element lines in data and write them to rowInds, colInds and
+    values (None for a pattern file, otherwise a float64 or int64 array) starting at
+    offset. Blank and comment lines are skipped. Returns the number of elements parsed.
+
+    :param data: The text of a whole number of lines of the file.
+
+    :param numThreads: The number of threads to parse with.
+    """
+    cdef const char* text = data
+    cdef long size = len(data)
+    cdef long capacity = rowInds.shape[0] - offset
+    cdef int i
+    cdef long start
+    cdef double* realVals = NULL
+    cdef long* intVals = NULL
+    cdef numpy.ndarray[long, ndim=1, mode="c"] starts = numpy.zeros(numThreads+1, long)
+    cdef numpy.ndarray[long, ndim=1, mode="c"] counts = numpy.zeros(numThreads+1, long)
+    cdef numpy.ndarray[long, ndim=1, mode="c"] parsed = numpy.zeros(numThreads, long)
+
+    if numThreads < 1:
+        raise ValueError("Number of threads must be at least 1: " + str(numThreads))
+
+    if values is not None:
+        if values.shape[0] != rowInds.shape[0] or not values.flags.c_contiguous:
+            raise ValueError("values must be contiguous with the same length as rowInds")
+        if values.dtype == numpy.float64:
+            realVals = <double*>numpy.PyArray_DATA(values)
+        elif values.dtype == numpy.int64:
+            intVals = <long*>numpy.PyArray_DATA(values)
+        else:
+            raise ValueError("Unsupported dtype: " + str(values.dtype))
+
+    #Split into blocks which start at the beginning of a line
+    starts[numThreads] = size
+    for i in range(1, numThreads):
+        start = max(size*i/numThreads, starts[i-1])
+        if start != 0:
+            start = nextLine(text + start - 1, text + size) - text
+        starts[i] = start
+
+    for i in prange(numThreads, nogil=True, num_threads=numThreads, schedule="static"):
+        counts[i+1] = countBlock(text + starts[i], text + starts[i+1])
+
+    counts = numpy.cumsum(counts)
+    if counts[numThreads] > capacity:
+        raise ValueError("More elements than given in the header: " + str(offset + counts[numThreads]))
+
+    counts += offset
+
+    for i in prange(numThreads, nogil=True, num_threads=numThreads, schedule="static"):
+        parsed[i] = parseBlock(text + starts[i], text + starts[i+1], &rowInds[counts[i]], &colInds[counts[i]], realVals + counts[i] if realVals != NULL else NULL, intVals + counts[i] if intVals != NULL else NULL)
+
+    for i in range(numThreads):
+        if parsed[i] < 0:
+            raise ValueError("Could not parse element " + str(counts[i] - parsed[i]))
+        elif parsed[i] != counts[i+1] - counts[i]:
+            raise ValueError("Could not parse element " + str(counts[i] + parsed[i] + 1))
+
+    return counts[numThreads] - offset
@@ -1,8 +1,10 @@
 import logging
 import sys
+import time
+import cProfile
+import pstats
+import tempfile
 import numpy
-import scipy.sparse
-from apgl.util import *
 from sppy.io import mmread
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -12,11 +14,43 @@ numpy.random.seed(21)
 class ioProfile():
     def __init__(self):
         numpy.random.seed(21)
-        
-    def profileMmread(self): 
-        matrixFileName = PathDefaults.getDataDir() + "reference/authorDocumentMatrix.mtx"
-            
-        ProfileUtils.profile('mmread(matrixFileName)', globals(), locals())
-        
-profiler = ioProfile() 
-profiler.profileMmread()
\ No newline at end of file
+
+        #Write a random matrix market file with nnz elements
+        m = 10**6
+        n = 10**5
+        nnz = 10**7
+        self.matrixFileName = tempfile.gettempdir() + "/ioProfile.mtx"
+
+        rowInds = numpy.random.randint(1, m+1, nnz)
+        colInds = numpy.random.randint(1, n+1, nnz)
+        values = numpy.random.rand(nnz)
+
+        fileObj = open(self.matrixFileName, "w")
+        fileObj.write("%%MatrixMarket matrix coordinate real general\n")
+        fileObj.write(str(m) + " " + str(n) + " " + str(nnz) + "\n")
+        numpy.savetxt(fileObj, numpy.c_[rowInds, colInds, values], fmt="%d %d %.8f")
+        fileObj.close()
+        logging.info("Wrote " + self.matrixFileName)
+
+    def profileMmread(self):
+        matrixFileName = self.matrixFileName
+        cProfile.runctx('mmread(matrixFileName)', globals(), locals(), "ioProfile.stats")
+        pstats.Stats("ioProfile.stats").strip_dirs().sort_stats("cumulative").print_stats(20)
+
+    def timeMmread(self):
+        for numThreads in [1, 2, 4, 8]:
+            startTime = time.time()
+            A = mmread(self.matrixFileName, num_threads=numThreads)
+            logging.info("mmread with " + str(numThreads) + " threads: " + str(time.time() - startTime) + "s")
+
+        try:
+            import scipy.io
+            startTime = time.time()
+            scipy.io.mmread(self.matrixFileName)
+            logging.info("scipy.io.mmread: " + str(time.time() - startTime) + "s")
+        except ImportError:
+            pass
+
+profiler = ioProfile()
+profiler.profileMmread()
+profiler.timeMmread()
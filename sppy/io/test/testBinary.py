@@ -0,0 +1,240 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile 
+import unittest
+import multiprocessing
+import numpy
+import numpy.testing as nptst 
+import sppy
+import sppy.io
+from sppy.linalg.GeneralLinearOperator import GeneralLinearOperator
+from sppy.linalg.core import rsvd
+
+def sharedProducts(args): 
+    name, v = args 
+    A = sppy.io.fromSharedMemory(name)
+    return A.isMapped(), A.dot(v), A.T.dot(A.dot(v)), A.sum()
+
+class binaryTest(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+        numpy.random.seed(21)
+        self.fileName = tempfile.gettempdir() + "/test.spy"
+
+    def testSaveLoad(self): 
+        for storagetype in ["col", "row"]: 
+            for dtype in [numpy.float64, numpy.float32, numpy.int32, numpy.int8]: 
+                A = sppy.rand((30, 20), 0.2, storagetype=storagetype)
+                A = sppy.csarray(numpy.array(A.toarray()*10, dtype), dtype=dtype, storagetype=storagetype)
+                
+                for compressor in [None, "zlib", "bz2"]: 
+                    sppy.io.save(self.fileName, A, compressor=compressor, block_size=16)
+                    B = sppy.io.load(self.fileName)
+                    
+                    self.assertEquals(B.dtype, A.dtype)
+                    self.assertEquals(B.storagetype, storagetype)
+                    self.assertEquals(B.nnz, A.nnz)
+                    self.assertFalse(B.isMapped())
+                    nptst.assert_array_equal(B.toarray(), A.toarray())
+                    
+                    B[0, 0] = 1 
+                    self.assertEquals(B[0, 0], 1)
+                    
+        #Empty arrays 
+        for shape in [(5, 4), (0, 3), (3, 0)]: 
+            A = sppy.csarray(shape)
+            sppy.io.save(self.fileName, A)
+            
+            for mmapMode in [None, "r"]: 
+                B = sppy.io.load(self.fileName, mmap_mode=mmapMode)
+                self.assertEquals(B.shape, shape)
+                self.assertEquals(B.nnz, 0)
+
+    def testMmapOperations(self): 
+        for storagetype in ["col", "row"]: 
+            A = sppy.rand((40, 25), 0.2, storagetype=storagetype)
+            sppy.io.save(self.fileName, A)
+            B = sppy.io.load(self.fileName, mmap_mode="r")
+            
+            v = numpy.random.rand(25)
+            u = numpy.random.rand(40)
+            V = numpy.random.rand(25, 3)
+            U = numpy.random.rand(40, 3)
+            
+            nptst.assert_array_almost_equal(B.dot(V), A.dot(V))
+            nptst.assert_array_almost_equal(B.pdot(v), A.dot(v))
+            nptst.assert_array_almost_equal(B.pdot(V, num_threads=2), A.dot(V))
+            
+            #The transpose is a view on the same file 
+            BT = B.T
+            self.assertTrue(BT.isMapped())
+            self.assertEquals(BT.shape, (25, 40))
+            self.assertNotEquals(BT.storagetype, B.storagetype)
+            self.assertTrue(numpy.shares_memory(BT.valuePtr(), B.valuePtr()))
+            nptst.assert_array_equal(BT.toarray(), A.toarray().T)
+            nptst.assert_array_almost_equal(BT.dot(u), A.T.dot(u))
+            nptst.assert_array_almost_equal(BT.pdot(U), A.T.dot(U))
+            nptst.assert_array_equal(BT.T.toarray(), A.toarray())
+            self.assertRaises(ValueError, BT.__setitem__, (0, 0), 1.0)
+            
+            self.assertAlmostEquals(B.sum(), A.sum())
+            nptst.assert_array_almost_equal(B.sum(0), A.sum(0))
+            nptst.assert_array_almost_equal(B.sum(1), A.sum(1))
+            self.assertAlmostEquals(B.norm(), A.norm())
+            
+            nptst.assert_array_equal(B[3:10, :].toarray(), A.toarray()[3:10, :])
+            nptst.assert_array_equal(B[5, :].toarray(), A[5, :].toarray())
+            
+            #Randomised SVD over the mapped array 
+            for parallel in [False, True]: 
+                L = GeneralLinearOperator.asLinearOperator(B, parallel)
+                nptst.assert_array_almost_equal(L.rmatmat(U), A.T.dot(U))
+                
+                numpy.random.seed(21)
+                U2, s2, V2 = rsvd(L, 5, q=3)
+                numpy.random.seed(21)
+                U3, s3, V3 = rsvd(A, 5, q=3)
+                nptst.assert_array_almost_equal(s2, s3)
+
+    def testSharedMemory(self): 
+        try: 
+            from multiprocessing import shared_memory
+        except ImportError: 
+            return 
+            
+        for storagetype in ["col", "row"]: 
+            for dtype in [numpy.float64, numpy.int16]: 
+                A = sppy.rand((30, 20), 0.2, storagetype=storagetype)
+                A = sppy.csarray(numpy.array(A.toarray()*10, dtype), dtype=dtype, storagetype=storagetype)
+                sharedMemory = sppy.io.toSharedMemory(A)
+                
+                B = sppy.io.fromSharedMemory(sharedMemory.name)
+                self.assertTrue(B.isMapped())
+                self.assertEquals(B.dtype, A.dtype)
+                self.assertEquals(B.storagetype, storagetype)
+                nptst.assert_array_equal(B.toarray(), A.toarray())
+                
+                rowInds, colInds = B.nonzero()
+                nptst.assert_array_equal(rowInds, A.nonzero()[0])
+                nptst.assert_array_equal(colInds, A.nonzero()[1])
+                self.assertEquals(B.sum(), A.sum())
+                nptst.assert_array_equal(B[2:10, :].toarray(), A.toarray()[2:10, :])
+                self.assertRaises(ValueError, B.__setitem__, (0, 0), 1)
+                
+                #Changes to the block are seen by all attached arrays 
+                B2 = sppy.io.fromSharedMemory(sharedMemory.name)
+                C = B2.T
+                del B2 
+                layout = sppy.io.binary.arrayLayout(*sppy.io.binary.decodeHeader(sharedMemory.buf))[0]
+                values = numpy.frombuffer(sharedMemory.buf, A.dtype, A.nnz, layout[2][2])
+                values[0] += 1 
+                self.assertEquals(B.values()[0], A.values()[0] + 1)
+                self.assertEquals(C.values().sum(), A.values().sum() + 1)
+                del values, B, C, rowInds, colInds
+                
+                sharedMemory.close()
+                sharedMemory.unlink()
+        
+        #Attach from other processes 
+        A = sppy.rand((50, 40), 0.1)
+        sharedMemory = sppy.io.toSharedMemory(A)
+        vs = [numpy.random.rand(40) for i in range(4)]
+        
+        pool = multiprocessing.Pool(2)
+        results = pool.map(sharedProducts, [(sharedMemory.name, v) for v in vs])
+        pool.terminate()
+        
+        for v, (mapped, u, w, total) in zip(vs, results): 
+            self.assertTrue(mapped)
+            nptst.assert_array_almost_equal(u, A.dot(v))
+            nptst.assert_array_almost_equal(w, A.T.dot(A.dot(v)))
+            self.assertAlmostEquals(total, A.sum())
+        
+        #A separate process which attaches and exits does not unlink the block 
+        path = os.path.dirname(os.path.dirname(os.path.abspath(sppy.__file__)))
+        env = dict(os.environ, PYTHONPATH=path + os.pathsep + os.environ.get("PYTHONPATH", ""))
+        code = "import sys, sppy.io; print(sppy.io.fromSharedMemory(sys.argv[1]).nnz)"
+        output = subprocess.check_output([sys.executable, "-c", code, sharedMemory.name], env=env)
+        self.assertEquals(int(output), A.nnz)
+        nptst.assert_array_equal(sppy.io.fromSharedMemory(sharedMemory.name).toarray(), A.toarray())
+            
+        sharedMemory.close()
+        sharedMemory.unlink()
+        
+        self.assertRaises(FileNotFoundError, sppy.io.fromSharedMemory, sharedMemory.name)
+
+    def testLoadMmap(self): 
+        for storagetype in ["col", "row"]: 
+            A = sppy.rand((30, 20), 0.2, storagetype=storagetype)
+            sppy.io.save(self.fileName, A)
+            
+            B = sppy.io.load(self.fileName, mmap_mode="r")
+            self.assertTrue(B.isMapped())
+            nptst.assert_array_equal(B.toarray(), A.toarray())
+            
+            v = numpy.random.rand(20)
+            nptst.assert_array_almost_equal(B.dot(v), A.dot(v))
+            self.assertAlmostEquals(B.sum(), A.sum())
+            
+            #The array is read-only but copies are not 
+            self.assertRaises(ValueError, B.__setitem__, (0, 0), 1.0)
+            self.assertRaises(ValueError, B.prune)
+            self.assertRaises(ValueError, B.valuePtr().__setitem__, 0, 1.0)
+            
+            C = B.copy()
+            self.assertFalse(C.isMapped())
+            C[0, 0] = 1 
+            self.assertEquals(C[0, 0], 1)
+            self.assertEquals(B[0, 0], A[0, 0])
+            
+        #Truncated files and inconsistent outer index pointers are not mapped 
+        sppy.io.save(self.fileName, A)
+        fileObj = open(self.fileName, "r+b")
+        fileObj.truncate(os.path.getsize(self.fileName) - 64)
+        fileObj.close()
+        self.assertRaises(ValueError, sppy.io.load, self.fileName, mmap_mode="r")
+        
+        sppy.io.save(self.fileName, A)
+        header, offset = sppy.io.binary.decodeHeader(open(self.fileName, "rb").read())
+        fileObj = open(self.fileName, "r+b")
+        fileObj.seek(offset + 4*A.shape[0])
+        fileObj.write(numpy.array([A.nnz + 5], numpy.int32).tobytes())
+        fileObj.close()
+        self.assertRaises(ValueError, sppy.io.load, self.fileName, mmap_mode="r")
+        self.assertRaises(ValueError, sppy.io.load, self.fileName)
+        
+        #Inner indices out of range are found when the arrays are read 
+        sppy.io.save(self.fileName, A)
+        header, offset = sppy.io.binary.decodeHeader(open(self.fileName, "rb").read())
+        fileObj = open(self.fileName, "r+b")
+        fileObj.seek(sppy.io.binary.arrayLayout(header, offset)[0][1][2])
+        fileObj.write(numpy.array([100000000], numpy.int32).tobytes())
+        fileObj.close()
+        self.assertRaises(ValueError, sppy.io.load, self.fileName)
+        
+        #Truncated compressed files 
+        sppy.io.save(self.fileName, A, compressor="zlib")
+        size = os.path.getsize(self.fileName)
+        for length in [size - 20, size - 3]: 
+            sppy.io.save(self.fileName, A, compressor="zlib")
+            fileObj = open(self.fileName, "r+b")
+            fileObj.truncate(length)
+            fileObj.close()
+            self.assertRaises(ValueError, sppy.io.load, self.fileName)
+        
+        sppy.io.save(self.fileName, A, compressor="zlib")
+        self.assertRaises(ValueError, sppy.io.load, self.fileName, mmap_mode="r")
+        self.assertRaises(ValueError, sppy.io.load, self.fileName, mmap_mode="r+")
+        
+        fileObj = open(self.fileName, "wb")
+        fileObj.write(b"%%MatrixMarket")
+        fileObj.close()
+        self.assertRaises(ValueError, sppy.io.load, self.fileName)
+        
+        self.assertRaises(ValueError, sppy.io.save, self.fileName, A, compressor="rar")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import logging
 import sys
 import tempfile 
+import gzip 
 import unittest
 import numpy
 import numpy.testing as nptst 
@@ -24,6 +25,54 @@ class utilTest(unittest.TestCase):
         #print("File written as " + tempfile.tempdir + "/test.mtx")
    
 
+    def testWriteFormats(self): 
+        numpy.random.seed(21)
+        fileName = tempfile.gettempdir() + "/test.mtx"
+        
+        for storagetype in ["col", "row"]: 
+            A = sppy.rand((20, 15), 0.3, storagetype=storagetype)
+            
+            #Small blocks and gzip 
+            for name in [fileName, fileName + ".gz"]: 
+                sppy.io.mmwrite(name, A, precision=10, block_size=7)
+                B = sppy.io.mmread(name)
+                nptst.assert_array_almost_equal(A.toarray(), B.toarray(), 10)
+                self.assertEquals(A.nnz, B.nnz)
+            
+            fileObj = gzip.open(fileName + ".gz", "rb")
+            self.assertEquals(fileObj.readline(), b"%%MatrixMarket matrix coordinate real general\n")
+            fileObj.close()
+            
+            #Pattern 
+            sppy.io.mmwrite(fileName, A, field="pattern")
+            B = sppy.io.mmread(fileName)
+            nptst.assert_array_equal(B.toarray(), A.toarray() != 0)
+            
+            #Symmetric matrices only store the lower triangle 
+            X = A[0:15, :].toarray()
+            X = X + X.T 
+            A = sppy.csarray(X, storagetype=storagetype)
+            sppy.io.mmwrite(fileName, A, symmetry="symmetric", precision=10, block_size=5)
+            
+            fileObj = open(fileName)
+            lines = [line for line in fileObj.readlines() if not line.startswith("%")]
+            fileObj.close()
+            self.assertEquals(int(lines[0].split()[2]), numpy.count_nonzero(numpy.tril(X)))
+            self.assertEquals(len(lines)-1, numpy.count_nonzero(numpy.tril(X)))
+            
+            B = sppy.io.mmread(fileName)
+            nptst.assert_array_almost_equal(B.toarray(), X, 10)
+        
+        #An empty matrix 
+        A = sppy.csarray((4, 3), dtype=numpy.int)
+        sppy.io.mmwrite(fileName, A)
+        B = sppy.io.mmread(fileName)
+        self.assertEquals(B.shape, (4, 3))
+        self.assertEquals(B.nnz, 0)
+        
+        self.assertRaises(ValueError, sppy.io.mmwrite, fileName, A, symmetry="symmetric")
+        self.assertRaises(ValueError, sppy.io.mmwrite, fileName, A, field="complex")
+
     def testRead(self): 
         m = 10 
         n = 5 
@@ -50,5 +99,62 @@ class utilTest(unittest.TestCase):
         self.assertEquals(A.dtype, B.dtype)
    
 
+    def testReadFormats(self): 
+        fileName = tempfile.gettempdir() + "/test.mtx"
+        
+        #Comments and blank lines in the body, a symmetric real matrix 
+        text = "%%MatrixMarket matrix coordinate real symmetric\n% a comment\n\n4 4 4\n1 1 1.5\n% another\n3 1 -2\n\n4 2 3e2\n  4 4 0.25 \n"
+        fileObj = open(fileName, "w")
+        fileObj.write(text)
+        fileObj.close()
+        
+        X = numpy.zeros((4, 4))
+        X[0, 0] = 1.5 
+        X[2, 0] = X[0, 2] = -2 
+        X[3, 1] = X[1, 3] = 300 
+        X[3, 3] = 0.25 
+        
+        for storagetype in ["col", "row"]: 
+            for numThreads in [1, 2, 5]: 
+                for chunkSize in [7, 1000]: 
+                    B = sppy.io.mmread(fileName, storagetype=storagetype, num_threads=numThreads, chunk_size=chunkSize)
+                    nptst.assert_array_equal(B.toarray(), X)
+                    self.assertEquals(B.storagetype, storagetype)
+        
+        #Skew-symmetric integer matrix without a final new line, gzipped 
+        text = "%%MatrixMarket matrix coordinate integer skew-symmetric\n3 3 2\n2 1 5\n3 2 -1"
+        fileObj = gzip.open(fileName + ".gz", "wb")
+        fileObj.write(text.encode("ascii"))
+        fileObj.close()
+        
+        B = sppy.io.mmread(fileName + ".gz", num_threads=2)
+        X = numpy.array([[0, -5, 0], [5, 0, 1], [0, -1, 0]])
+        nptst.assert_array_equal(B.toarray(), X)
+        self.assertEquals(B.dtype, numpy.int)
+        
+        #Pattern matrix 
+        text = "%%MatrixMarket matrix coordinate pattern general\n2 3 3\n1 3\n2 1\n2 2\n"
+        fileObj = open(fileName, "w")
+        fileObj.write(text)
+        fileObj.close()
+        
+        B = sppy.io.mmread(fileName)
+        X = numpy.array([[0, 0, 1], [1, 1, 0]])
+        nptst.assert_array_equal(B.toarray(), X)
+        
+        #Bad files 
+        for text in ["%%MatrixMarket matrix coordinate real general\n2 3 3\n1 3 1\n2 1 2\n", 
+                     "%%MatrixMarket matrix coordinate real general\n2 3 1\n1 3 1\n2 1 2\n", 
+                     "%%MatrixMarket matrix coordinate real general\n2 3 1\n1 x 1\n", 
+                     "%%MatrixMarket matrix coordinate real general\n3 3 3\n1 1 1\n2 2\n3 3 3\n", 
+                     "%%MatrixMarket matrix coordinate real general\n3 3 2\n1 1 1\n2 2 2 7\n", 
+                     "%%MatrixMarket matrix coordinate pattern general\n3 3 2\n1 1\n2 2 2\n", 
+                     "%%MatrixMarket matrix coordinate complex general\n2 3 1\n1 1 1 1\n", 
+                     "%%MatrixMarket matrix array real general\n2 1\n1\n2\n"]: 
+            fileObj = open(fileName, "w")
+            fileObj.write(text)
+            fileObj.close()
+            self.assertRaises(ValueError, sppy.io.mmread, fileName)
+   
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
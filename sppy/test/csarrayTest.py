@@ -604,6 +604,390 @@ class csarrayTest(unittest.TestCase):
                     nptst.assert_array_equal(C.toarray(), D[:, colInds])
     
 
+    def testSubArrayUnsorted(self): 
+        for storagetype in ["row", "col"]: 
+            for dtype in [numpy.float64, numpy.int32]: 
+                A = sppy.rand((40, 30), 0.2, storagetype=storagetype)
+                A = sppy.csarray(numpy.array(A.toarray()*10, dtype), dtype=dtype, storagetype=storagetype)
+                D = A.toarray()
+                
+                rowInds = numpy.random.randint(0, 40, 25)
+                colInds = numpy.random.randint(0, 30, 50)
+                
+                for numThreads in [1, 3]: 
+                    B = A.subArray(rowInds, colInds, numThreads)
+                    self.assertEquals(B.shape, (25, 50))
+                    nptst.assert_array_equal(B.toarray(), D[numpy.ix_(rowInds, colInds)])
+                    
+                    #The output is a valid compressed array 
+                    outerIndexPtr, innerIndexPtr = B.outerIndexPtr(), B.innerIndexPtr()
+                    for i in range(outerIndexPtr.shape[0]-1): 
+                        self.assertTrue((numpy.diff(innerIndexPtr[outerIndexPtr[i]:outerIndexPtr[i+1]]) > 0).all())
+                
+                nptst.assert_array_equal(A[rowInds, :].toarray(), D[rowInds, :])
+                nptst.assert_array_equal(A[:, colInds].toarray(), D[:, colInds])
+                nptst.assert_array_equal(A[[3, -1, 3], :].toarray(), D[[3, -1, 3], :])
+                nptst.assert_array_equal(A.subArray(numpy.arange(40), numpy.arange(30)).toarray(), D)
+                
+        self.assertRaises(ValueError, self.B.subArray, numpy.array([0, 5]), numpy.array([0]))
+        self.assertRaises(ValueError, self.B.subArray, numpy.array([0]), numpy.array([-8]))
+
+    def testRangeSlice(self): 
+        slices = [slice(None), slice(3, 11), slice(-7, None), slice(2, -3), slice(None, None, 2), slice(1, 17, 3)]
+        slices.extend([slice(None, None, -1), slice(12, 2, -2), slice(-2, None, -3), slice(30, 40), slice(5, 5), slice(8, 3)])
+        
+        for storagetype in ["row", "col"]: 
+            for dtype in [numpy.float64, numpy.int16]: 
+                A = sppy.rand((20, 15), 0.3, storagetype=storagetype)
+                A = sppy.csarray(numpy.array(A.toarray()*10, dtype), dtype=dtype, storagetype=storagetype)
+                D = A.toarray()
+                
+                for slc1 in slices: 
+                    for slc2 in slices: 
+                        B = A[slc1, slc2]
+                        self.assertEquals(B.shape, D[slc1, slc2].shape)
+                        self.assertEquals(B.dtype, A.dtype)
+                        nptst.assert_array_equal(B.toarray(), D[slc1, slc2])
+                        
+                        outerIndexPtr, innerIndexPtr = B.outerIndexPtr(), B.innerIndexPtr()
+                        for i in range(outerIndexPtr.shape[0]-1): 
+                            self.assertTrue((numpy.diff(innerIndexPtr[outerIndexPtr[i]:outerIndexPtr[i+1]]) > 0).all())
+                            
+                    inds = numpy.array([4, 0, 4, -1])
+                    nptst.assert_array_equal(A[inds, slc1].toarray(), D[inds, :][:, slc1])
+                    nptst.assert_array_equal(A[slc1, inds].toarray(), D[slc1, :][:, inds])
+                
+                nptst.assert_array_equal(A.submatrix(2, 3, 10, 5).toarray(), D[2:12, 3:8])
+                self.assertEquals(A.submatrix(2, 3, 10, 5).shape, (10, 5))
+
+    def testPointLookups(self): 
+        for storagetype in ["row", "col"]: 
+            for dtype in [numpy.float64, numpy.int32]: 
+                A = sppy.rand((50, 40), 0.6, storagetype=storagetype)
+                A = sppy.csarray(numpy.array(A.toarray()*10, dtype), dtype=dtype, storagetype=storagetype)
+                D = A.toarray()
+                
+                #Pairs are grouped by outer vector unless there are very few or more than nnz 
+                for numPairs in [300, 3000, 3]: 
+                    rowInds = numpy.random.randint(-50, 50, numPairs)
+                    colInds = numpy.random.randint(-40, 40, numPairs)
+                    
+                    values = A[rowInds, colInds]
+                    self.assertEquals(values.dtype, A.dtype)
+                    nptst.assert_array_equal(values, D[rowInds, colInds])
+                    nptst.assert_array_equal(A[list(rowInds), list(colInds)], D[rowInds, colInds])
+                
+                rowInds, colInds = A.nonzero()
+                perm = numpy.random.permutation(rowInds.shape[0])
+                nptst.assert_array_equal(A[rowInds[perm], colInds[perm]], A.values()[perm])
+                
+                self.assertEquals(A[numpy.array([], numpy.int), numpy.array([], numpy.int)].shape[0], 0)
+                self.assertRaises(ValueError, A.__getitem__, (numpy.array([0, 1]), numpy.array([0])))
+                self.assertRaises(ValueError, A.__getitem__, (numpy.array([50]), numpy.array([0])))
+
+    def testAxisReductions(self): 
+        for storagetype in ["row", "col"]: 
+            for dtype in [numpy.float64, numpy.float32, numpy.int32]: 
+                D = numpy.array(numpy.random.randint(-5, 6, (30, 20)), dtype)
+                D[numpy.random.rand(30, 20) < 0.5] = 0 
+                D[3, :] = 0 
+                D[:, 4] = 0 
+                D[5, :] = -numpy.arange(1, 21)
+                D[:, 7] = numpy.arange(1, 31)
+                D[8, 8:] = -1
+                A = sppy.csarray(D, dtype=dtype, storagetype=storagetype)
+                
+                for axis in [0, 1]: 
+                    nptst.assert_array_almost_equal(A.sum(axis), D.sum(axis), 4)
+                    nptst.assert_array_almost_equal(A.mean(axis), D.mean(axis), 4)
+                    nptst.assert_array_almost_equal(A.var(axis), D.var(axis), 4)
+                    nptst.assert_array_almost_equal(A.std(axis), D.std(axis), 4)
+                    nptst.assert_array_equal(A.max(axis), D.max(axis))
+                    nptst.assert_array_equal(A.min(axis), D.min(axis))
+                    nptst.assert_array_equal(A.argmax(axis), D.argmax(axis))
+                    nptst.assert_array_equal(A.argmin(axis), D.argmin(axis))
+                    self.assertEquals(A.argmax(axis).dtype, D.argmax(axis).dtype)
+                    nptst.assert_array_equal(A.countNonzero(axis), numpy.count_nonzero(D, axis))
+                    nptst.assert_array_almost_equal(A.norm(axis), numpy.linalg.norm(D, axis=axis), 4)
+                    nptst.assert_array_almost_equal(A.norm(axis, 1), numpy.linalg.norm(D, 1, axis), 4)
+                    nptst.assert_array_almost_equal(A.norm(axis, numpy.inf), numpy.linalg.norm(D, numpy.inf, axis), 4)
+                    nptst.assert_array_almost_equal(A._array.reduceAxis("sum", axis, numThreads=3)[0], D.sum(axis), 4)
+                    
+                    self.assertEquals(A.max(axis).dtype, A.dtype)
+                    self.assertEquals(A.sum(axis, numpy.float64).dtype, numpy.float64)
+                    if dtype == numpy.int32: 
+                        self.assertEquals(A.sum(axis).dtype, numpy.int64)
+                        self.assertEquals(A.mean(axis).dtype, numpy.float64)
+                    else: 
+                        self.assertEquals(A.sum(axis).dtype, A.dtype)
+                
+                self.assertEquals(A.argmax(), D.argmax())
+                self.assertEquals(A.argmin(), D.argmin())
+                self.assertEquals(A.countNonzero(), numpy.count_nonzero(D))
+                
+                #Explicitly stored zeros are not counted as nonzeros 
+                A.valuePtr()[0] = 0 
+                self.assertEquals(A.countNonzero(), numpy.count_nonzero(D) - 1)
+                self.assertEquals(A.countNonzero(0).sum(), numpy.count_nonzero(D) - 1)
+            
+        A = sppy.csarray((0, 3))
+        self.assertRaises(ValueError, A.max, 0)
+        nptst.assert_array_equal(A.sum(0), numpy.zeros(3))
+        self.assertRaises(ValueError, self.B.sum, 2)
+        self.assertRaises(ValueError, self.B.norm, 1, 3)
+
+    def testToarrayBlocks(self): 
+        for storagetype in ["row", "col"]: 
+            for dtype in [numpy.float64, numpy.float32, numpy.int32]: 
+                A = sppy.rand((50, 40), 0.2, storagetype=storagetype)
+                A = sppy.csarray(numpy.array(A.toarray()*10, dtype), dtype=dtype, storagetype=storagetype)
+                D = numpy.array(A.toarray())
+                
+                self.assertEquals(D.dtype, dtype)
+                self.assertEquals(A.toarray(num_threads=3).dtype, dtype)
+                nptst.assert_array_equal(A.toarray(num_threads=3), D)
+                
+                for rows, cols in [(slice(10, 20), None), (None, slice(5, 35)), (slice(-10, None), slice(3, 4)), (slice(5, 5), slice(0, 40))]: 
+                    nptst.assert_array_equal(A.toarray(rows=rows, cols=cols, num_threads=2), D[rows or slice(None), cols or slice(None)])
+                
+                #The output array is overwritten, whatever its order 
+                for order in ["C", "F"]: 
+                    for outDtype in [dtype, numpy.float64]: 
+                        out = numpy.ones((10, 40), outDtype, order=order)
+                        result = A.toarray(out, rows=slice(20, 30))
+                        self.assertTrue(result is out)
+                        nptst.assert_array_equal(out, D[20:30, :])
+                
+                out = numpy.ones((30, 20))[::3, ::2]
+                A.toarray(out, rows=slice(0, 10), cols=slice(10, 20))
+                nptst.assert_array_equal(out, D[0:10, 10:20])
+                
+                self.assertRaises(ValueError, A.toarray, numpy.zeros((50, 41)))
+                self.assertRaises(ValueError, A.toarray, numpy.zeros((50, 40), numpy.int8))
+                self.assertRaises(ValueError, A.toarray, None, slice(0, 10, 2))
+
+    def testUfuncs(self): 
+        for storagetype in ["row", "col"]: 
+            for dtype in [numpy.float64, numpy.float32, numpy.int32]: 
+                A = sppy.rand((50, 40), 0.2, storagetype=storagetype)
+                A = sppy.csarray(numpy.array(A.toarray()*10 - 5, dtype), dtype=dtype, storagetype=storagetype)
+                A.compress()
+                D = A.toarray()
+                
+                for ufunc in [numpy.abs, numpy.negative, numpy.sin, numpy.expm1]: 
+                    B = ufunc(A)
+                    self.assertEquals(B.dtype, ufunc(D).dtype)
+                    self.assertEquals(B.storagetype, storagetype)
+                    nptst.assert_array_equal(B.outerIndexPtr(), A.outerIndexPtr())
+                    nptst.assert_array_equal(B.innerIndexPtr(), A.innerIndexPtr())
+                    nptst.assert_array_almost_equal(B.toarray(), ufunc(D), 5)
+                
+                nptst.assert_array_almost_equal(numpy.sqrt(abs(A)).toarray(), numpy.sqrt(abs(D)), 5)
+                nptst.assert_array_equal(numpy.multiply(A, 3).toarray(), D*3)
+                nptst.assert_array_equal(numpy.multiply(3, A).toarray(), 3*D)
+                nptst.assert_array_almost_equal(numpy.power(A, 2).toarray(), D**2, 4)
+                nptst.assert_array_equal(A.mapValues(numpy.maximum, (0, ), num_threads=3).toarray(), numpy.maximum(D, 0))
+                
+                #Functions which do not map 0 to 0 and dense operands of other shapes are not applied 
+                self.assertRaises(ValueError, numpy.cos, A)
+                self.assertRaises(ValueError, numpy.power, 2, A)
+                self.assertRaises(TypeError, numpy.add, A, numpy.ones((5, 4)))
+                
+                B = A.copy()
+                result = numpy.multiply(B, 2, out=(B, ))
+                self.assertTrue(result is B)
+                nptst.assert_array_equal(B.toarray(), D*2)
+                
+                if dtype == numpy.int32: 
+                    self.assertRaises(TypeError, numpy.sqrt, B, out=(B, ))
+                else: 
+                    numpy.negative(B, out=(B, ))
+                    nptst.assert_array_equal(B.toarray(), -D*2)
+        
+        #Results of dtypes which csarray does not support, such as float16 and bool for int8 arrays, are promoted 
+        numpy.random.seed(21)
+        for storagetype in ["row", "col"]: 
+            D = numpy.array(numpy.random.randint(-3, 4, (20, 10)) * (numpy.random.rand(20, 10) < 0.3), numpy.int8)
+            A = sppy.csarray(D, dtype=numpy.int8, storagetype=storagetype)
+            
+            for B, E in [(A.sin(), numpy.sin(D)), (numpy.sqrt(abs(A)), numpy.sqrt(abs(D))), (numpy.log1p(abs(A)), numpy.log1p(abs(D)))]: 
+                self.assertEquals(B.dtype, numpy.float64)
+                nptst.assert_array_almost_equal(B.toarray(), E, 3)
+            
+            B = A.cos()
+            self.assertEquals(B.dtype, numpy.float64)
+            nptst.assert_array_almost_equal(B.toarray(), numpy.cos(D)*(D != 0), 3)
+            
+            B = numpy.isnan(A)
+            self.assertEquals(B.dtype, numpy.int8)
+            self.assertEquals(B.getnnz(), A.getnnz())
+            nptst.assert_array_equal(B.toarray(), numpy.zeros((20, 10)))
+            self.assertEquals(A.sign().dtype, numpy.int8)
+        
+        #Large arrays are mapped by several threads 
+        A = sppy.rand((2000, 1000), 0.1)
+        nptst.assert_array_almost_equal(A.mapValues(numpy.log1p, num_threads=4).values(), numpy.log1p(A.values()))
+
+    def testInPlaceOperators(self): 
+        for storagetype in ["row", "col"]: 
+            for dtype in [numpy.float64, numpy.int32]: 
+                A = sppy.rand((50, 40), 0.2, storagetype=storagetype)
+                A = sppy.csarray(numpy.array((A.toarray()*10 + 0.5)*(A.toarray() != 0), dtype), dtype=dtype, storagetype=storagetype)
+                B = sppy.rand((50, 40), 0.2, storagetype=storagetype)
+                B = sppy.csarray(numpy.array((B.toarray()*10 + 0.5)*(B.toarray() != 0), dtype), dtype=dtype, storagetype=storagetype)
+                D = A.toarray()
+                
+                #Same structure: the value buffer is updated where it is 
+                C = A.copy()
+                values = C.valuePtr()
+                C += A*2
+                nptst.assert_array_equal(C.toarray(), 3*D)
+                nptst.assert_array_equal(values, C.valuePtr())
+                self.assertEquals(values.__array_interface__["data"], C.valuePtr().__array_interface__["data"])
+                
+                C -= A 
+                nptst.assert_array_almost_equal(C.toarray(), 2*D)
+                C += C
+                nptst.assert_array_almost_equal(C.toarray(), 4*D)
+                
+                #A subset of the structure 
+                rowInds, colInds = A.nonzero()
+                E2 = sppy.csarray(A.shape, dtype, storagetype)
+                E2.put(numpy.array(D[rowInds[::2], colInds[::2]], dtype), rowInds[::2], colInds[::2], init=True)
+                C = A.copy()
+                C -= E2
+                nptst.assert_array_equal(C.toarray(), D - E2.toarray())
+                self.assertEquals(C.nnz, A.nnz)
+                
+                #Different structures are merged 
+                C = A.copy()
+                C += B 
+                nptst.assert_array_equal(C.toarray(), D + B.toarray())
+                C -= B 
+                nptst.assert_array_almost_equal(C.toarray(), D)
+                
+                C = A.copy()
+                C *= 3 
+                nptst.assert_array_equal(C.toarray(), 3*D)
+                nptst.assert_array_equal((2*A).toarray(), 2*D)
+                nptst.assert_array_equal((A*2).toarray(), D*2)
+                nptst.assert_array_equal((-A).toarray(), -D)
+                self.assertEquals((-A).storagetype, storagetype)
+                nptst.assert_array_almost_equal((A/4).toarray(), D/4)
+                
+                if dtype == numpy.float64: 
+                    C /= 4 
+                    nptst.assert_array_equal(C.toarray(), 3*D/4)
+                else: 
+                    self.assertRaises(TypeError, C.__itruediv__, 4)
+                    self.assertRaises(TypeError, C.__imul__, 0.5)
+                
+                self.assertRaises(ValueError, C.__iadd__, A[0:10, :])
+        
+        #Read-only mapped arrays cannot be changed in place 
+        A = sppy.rand((10, 10), 0.5)
+        B = sppy.csarray.fromCompressed(A.shape, A.outerIndexPtr(), A.innerIndexPtr(), A.valuePtr(), copy=False)
+        self.assertRaises(ValueError, B.__iadd__, A)
+        self.assertRaises(ValueError, B.__imul__, 2)
+
+    def testScaleLines(self): 
+        for storagetype in ["row", "col"]: 
+            for dtype in [numpy.float64, numpy.float32, numpy.int32]: 
+                A = sppy.rand((50, 40), 0.2, storagetype=storagetype)
+                A = sppy.csarray(numpy.array(A.toarray()*10, dtype), dtype=dtype, storagetype=storagetype)
+                A.compress()
+                D = A.toarray()
+                r = numpy.random.rand(50) + 0.5 
+                c = numpy.random.rand(40) + 0.5 
+                
+                B = A.multiplyRows(r, num_threads=3)
+                self.assertEquals(B.dtype, numpy.result_type(dtype, r.dtype))
+                nptst.assert_array_equal(B.innerIndexPtr(), A.innerIndexPtr())
+                nptst.assert_array_almost_equal(B.toarray(), D*r[:, None])
+                nptst.assert_array_almost_equal(A.multiplyCols(c).toarray(), D*c)
+                nptst.assert_array_almost_equal(A.divideRows(r).toarray(), D/r[:, None])
+                nptst.assert_array_almost_equal(A.divideCols(c).toarray(), D/c)
+                nptst.assert_array_equal(A.multiplyRows(numpy.arange(50, dtype=dtype)).toarray(), D*numpy.arange(50, dtype=dtype)[:, None])
+                self.assertEquals(A.multiplyRows(numpy.arange(50, dtype=dtype)).dtype, dtype)
+                
+                nptst.assert_array_almost_equal((A * r[:, None]).toarray(), D*r[:, None])
+                nptst.assert_array_almost_equal((r[:, None] * A).toarray(), D*r[:, None])
+                nptst.assert_array_almost_equal((A * c).toarray(), D*c)
+                nptst.assert_array_almost_equal((A * c[None, :]).toarray(), D*c)
+                nptst.assert_array_almost_equal((A / r[:, None]).toarray(), D/r[:, None])
+                nptst.assert_array_almost_equal(numpy.true_divide(A, c).toarray(), D/c)
+                
+                #Normalising the rows in place 
+                if dtype != numpy.int32: 
+                    B = A.copy()
+                    norms = B.norm(1)
+                    norms[norms == 0] = 1 
+                    self.assertTrue(B.divideRows(norms, out=B) is B)
+                    nptst.assert_array_almost_equal(B.toarray(), D/norms[:, None], 5)
+                    numpy.multiply(B, norms[:, None], out=(B, ))
+                    nptst.assert_array_almost_equal(B.toarray(), D, 4)
+                else: 
+                    self.assertRaises(TypeError, A.divideRows, r, A)
+                    self.assertRaises(TypeError, A.multiplyRows, r, A)
+                
+                self.assertRaises(ValueError, A.multiplyRows, c)
+                self.assertRaises(TypeError, numpy.true_divide, r[:, None], A)
+                self.assertRaises(TypeError, numpy.multiply, A, numpy.ones((5, 4)))
+
+    #@unittest.skip("")
+    def testDenseArithmetic(self): 
+        numpy.random.seed(21)
+        
+        for storagetype in ["col", "row"]: 
+            for dtype in [numpy.float64, numpy.float32, numpy.int32]: 
+                D = numpy.array(numpy.random.randint(-5, 5, (50, 40)) * (numpy.random.rand(50, 40) < 0.2), dtype)
+                A = csarray(D, dtype=dtype, storagetype=storagetype)
+                X = numpy.random.randn(50, 40)
+                F = numpy.asfortranarray(X)
+                
+                #Sums with a dense array are dense 
+                for Y in [X, F, X[:, ::-1], numpy.array(X, dtype)]: 
+                    nptst.assert_array_almost_equal(A + Y, D + Y, 5)
+                    nptst.assert_array_almost_equal(Y + A, Y + D, 5)
+                    nptst.assert_array_almost_equal(A - Y, D - Y, 5)
+                    nptst.assert_array_almost_equal(Y - A, Y - D, 5)
+                
+                result = A + X 
+                self.assertTrue(isinstance(result, numpy.ndarray))
+                self.assertEquals(result.dtype, numpy.float64)
+                self.assertEquals((A + numpy.ones((50, 40), dtype)).dtype, dtype)
+                
+                #In place through out 
+                Y = F.copy()
+                self.assertTrue(numpy.add(Y, A, out=Y) is Y)
+                nptst.assert_array_almost_equal(Y, F + D, 5)
+                Y = X.copy()
+                numpy.subtract(Y, A, out=Y)
+                nptst.assert_array_almost_equal(Y, X - D, 5)
+                Y = numpy.zeros((50, 40))
+                numpy.subtract(A, X, out=Y)
+                nptst.assert_array_almost_equal(Y, D - X, 5)
+                
+                #Multiplying by a dense array is sparse 
+                for Y in [X, F, numpy.array(X, dtype)]: 
+                    B = A.hadamard(Y)
+                    self.assertTrue(isinstance(B, csarray))
+                    self.assertEquals(B.getnnz(), A.getnnz())
+                    nptst.assert_array_almost_equal(B.toarray(), D*Y, 5)
+                    nptst.assert_array_almost_equal(numpy.multiply(Y, A).toarray(), Y*D, 5)
+                    nptst.assert_array_almost_equal((A * Y).toarray(), D*Y, 5)
+                
+                self.assertEquals(A.hadamard(X).dtype, numpy.float64)
+                self.assertEquals(A.hadamard(numpy.array(X, dtype)).dtype, dtype)
+                
+                B = A.copy()
+                Y = numpy.array(numpy.random.randint(-3, 3, (50, 40)), dtype)
+                self.assertTrue(numpy.multiply(B, Y, out=(B, )) is B)
+                nptst.assert_array_equal(B.toarray(), D*Y)
+                
+                self.assertRaises(ValueError, A.hadamard, numpy.ones((40, 50)))
+                self.assertRaises(ValueError, A.__add__, numpy.ones((40, 50)))
+
     #@unittest.skip("")          
     def testNonZeroInds(self): 
         
@@ -1169,14 +1553,159 @@ class csarrayTest(unittest.TestCase):
            
            C = A.dot(B)
            
-           Ahat = csarray(A, storagetype="row")
-           Chat = Ahat.pdot(B)
+           for storagetype in self.storagetypes: 
+               Ahat = csarray(A, storagetype=storagetype)
+               Chat = Ahat.pdot(B)
+               
+               nptst.assert_array_almost_equal(C, Chat, 3)
+               
+               u = A.dot(v)
+               uHat = Ahat.pdot(v)
+               nptst.assert_array_almost_equal(u, uHat)
+               
+               w = numpy.random.rand(n)
+               nptst.assert_array_almost_equal(Ahat.pdot(w), A.dot(w))
+               
+       #Test a sparse col major matrix with more columns than rows 
+       for storagetype in self.storagetypes: 
+           B = csarray(self.B, storagetype=storagetype)
+           v = numpy.random.rand(self.B.shape[1])
+           V = numpy.random.rand(self.B.shape[1], 3)
+           nptst.assert_array_almost_equal(B.pdot(v), self.B.toarray().dot(v))
+           nptst.assert_array_almost_equal(B.pdot(V), self.B.toarray().dot(V))
+           
+       #Test the number of threads and a skewed matrix 
+       A = numpy.random.rand(30, 20)
+       A[1:, :] = 0 
+       A[:, 5:] = 0 
+       A[:, 2] = numpy.random.rand(30)
+       v = numpy.random.rand(20)
+       V = numpy.random.rand(20, 4)
+       
+       for storagetype in self.storagetypes: 
+           Ahat = csarray(A, storagetype=storagetype)
            
-           nptst.assert_array_almost_equal(C, Chat, 3)
+           for numThreads in [1, 2, 3, 8, 50]: 
+               nptst.assert_array_almost_equal(Ahat.pdot(v, num_threads=numThreads), A.dot(v))
+               nptst.assert_array_almost_equal(Ahat.pdot(V, num_threads=numThreads), A.dot(V))
+               
+               B = csarray(self.B, storagetype=storagetype)
+               u = numpy.random.rand(self.B.shape[1])
+               nptst.assert_array_almost_equal(B.pdot(u, num_threads=numThreads), self.B.toarray().dot(u))
+               
+       #Uncompressed arrays 
+       for storagetype in self.storagetypes: 
+           Ahat = csarray(A.shape, storagetype=storagetype)
+           Ahat.reserve(10)
+           Ahat[0, 1] = 2
+           Ahat[5, 2] = 3
+           Ahat[29, 19] = -1 
+           nptst.assert_array_almost_equal(Ahat.pdot(v, num_threads=3), Ahat.toarray().dot(v))
            
-           u = A.dot(v)
-           uHat = Ahat.pdot(v)
-           nptst.assert_array_almost_equal(u, uHat)
+       self.assertRaises(ValueError, Ahat.pdot, v, 0)
+
+    def testDotPruned(self): 
+        numpy.random.seed(21)
+        
+        def pruned(P, threshold, topk, byRow): 
+            P = P.copy() if byRow else P.T.copy()
+            P[numpy.abs(P) < threshold] = 0 
+            
+            for i in range(P.shape[0] if topk is not None else 0): 
+                order = numpy.lexsort((numpy.arange(P.shape[1]), -numpy.abs(P[i, :])))
+                P[i, order[topk:]] = 0 
+            
+            return P if byRow else P.T 
+        
+        for storagetype in self.storagetypes: 
+            for dtype in [numpy.float64, numpy.int32]: 
+                X = numpy.array(numpy.random.randint(-3, 4, (60, 30)) * (numpy.random.rand(60, 30) < 0.2), dtype)
+                Y = numpy.array(numpy.random.randint(-3, 4, (30, 45)) * (numpy.random.rand(30, 45) < 0.2), dtype)
+                Xhat = csarray(X, dtype=dtype, storagetype=storagetype)
+                Yhat = csarray(Y, dtype=dtype, storagetype=storagetype)
+                P = X.dot(Y)
+                
+                for numThreads in [1, 3]: 
+                    Z = Xhat.dot(Yhat, num_threads=numThreads)
+                    self.assertEquals(Z.storagetype, storagetype)
+                    self.assertEquals(Z.dtype, numpy.dtype(dtype))
+                    nptst.assert_array_equal(Z.toarray(), P)
+                    
+                    Z = Xhat.dot(Yhat, threshold=4, num_threads=numThreads)
+                    nptst.assert_array_equal(Z.toarray(), pruned(P, 4, None, True))
+                    self.assertEquals(Z.getnnz(), numpy.sum(numpy.abs(P) >= 4))
+                    
+                    for topk in [0, 1, 3]: 
+                        Z = Xhat.dot(Yhat, topk=topk, num_threads=numThreads)
+                        nptst.assert_array_equal(Z.toarray(), pruned(P, 0, topk, storagetype == "row"))
+                        
+                        Z = Xhat.dot(Yhat, threshold=2, topk=topk, num_threads=numThreads)
+                        nptst.assert_array_equal(Z.toarray(), pruned(P, 2, topk, storagetype == "row"))
+                        self.assertTrue(numpy.all(numpy.diff(Z.outerIndexPtr()) <= topk))
+                
+                #Item-item similarities 
+                Z = Xhat.T.dot(Xhat, topk=5)
+                nptst.assert_array_equal(Z.toarray(), pruned(X.T.dot(X), 0, 5, storagetype == "row"))
+                
+                Z = csarray((60, 0), dtype, storagetype).dot(csarray((0, 45), dtype, storagetype))
+                self.assertEquals(Z.shape, (60, 45))
+                self.assertEquals(Z.getnnz(), 0)
+        
+        #Short rows of the product are accumulated in hash tables 
+        for storagetype in self.storagetypes: 
+            X = numpy.random.randn(50, 40) * (numpy.random.rand(50, 40) < 0.2)
+            Y = numpy.random.randn(40, 5000) * (numpy.random.rand(40, 5000) < 0.002)
+            if storagetype == "col": 
+                X, Y = Y.T.copy(), X.T.copy()
+            
+            Xhat = csarray(X, storagetype=storagetype)
+            Yhat = csarray(Y, storagetype=storagetype)
+            P = X.dot(Y)
+            
+            for numThreads in [1, 3]: 
+                nptst.assert_array_almost_equal(Xhat.dot(Yhat, num_threads=numThreads).toarray(), P)
+                Z = Xhat.dot(Yhat, threshold=0.5, topk=3, num_threads=numThreads)
+                nptst.assert_array_almost_equal(Z.toarray(), pruned(P, 0.5, 3, storagetype == "row"))
+        
+        self.assertRaises(ValueError, Xhat.dot, Yhat, None, -1)
+        self.assertRaises(ValueError, Xhat.dot, Yhat, None, 2.5)
+        self.assertRaises(ValueError, Xhat.dot, Y, 1)
+        self.assertRaises(ValueError, Xhat.dot, Xhat)
+
+    def testDotDtypes(self): 
+        numpy.random.seed(21)
+        dtypes = [numpy.float32, numpy.float64, numpy.int8, numpy.int16, numpy.int32, numpy.int64]
+        
+        for dtype in dtypes: 
+            for storagetype in self.storagetypes: 
+                X = numpy.array(numpy.random.randint(-3, 3, (10, 8)), dtype)
+                X[X < 0] = 0 
+                Xhat = csarray(X, dtype=dtype, storagetype=storagetype)
+                
+                v = numpy.array(numpy.random.randint(-3, 3, 8), dtype)
+                V = numpy.array(numpy.random.randint(-3, 3, (8, 4)), dtype)
+                
+                u = Xhat.dot(v)
+                self.assertEquals(u.dtype, numpy.dtype(dtype))
+                nptst.assert_array_almost_equal(u, X.dot(v))
+                
+                U = Xhat.dot(V)
+                self.assertEquals(U.dtype, numpy.dtype(dtype))
+                nptst.assert_array_almost_equal(U, X.dot(V))
+                
+                u = Xhat.pdot(v)
+                self.assertEquals(u.dtype, numpy.dtype(dtype))
+                nptst.assert_array_almost_equal(u, X.dot(v))
+                
+                U = Xhat.pdot(V)
+                self.assertEquals(U.dtype, numpy.dtype(dtype))
+                nptst.assert_array_almost_equal(U, X.dot(V))
+                
+                #Other dense dtypes are computed in float64 
+                u = Xhat.dot(numpy.array(v, numpy.float64) + 0.5)
+                self.assertEquals(u.dtype, numpy.float64)
+                nptst.assert_array_almost_equal(u, X.dot(v + 0.5))
+                
 
     def testTranspose(self): 
         
@@ -1230,6 +1759,55 @@ class csarrayTest(unittest.TestCase):
         nptst.assert_array_equal(self.D.colInds(0), numpy.array([0, 2, 3]))
         nptst.assert_array_equal(self.D.colInds(2), numpy.array([]))
 
+    def testSecondaryIndex(self): 
+        for storagetype in ["col", "row"]: 
+            A = sppy.rand((30, 20), 0.2, storagetype=storagetype)
+            X = A.toarray()
+            
+            indPtr, outerInds, positions = A.secondaryIndex()
+            self.assertEquals(indPtr[indPtr.shape[0]-1], A.nnz)
+            self.assertFalse(indPtr.flags.writeable)
+            self.assertTrue(A.secondaryIndex()[0] is indPtr)
+            
+            for i in range(A.shape[0]): 
+                nptst.assert_array_equal(A.rowInds(i), numpy.flatnonzero(X[i, :]))
+                nptst.assert_array_equal(A[i, :].toarray().ravel(), X[i, :])
+                nptst.assert_array_equal(A[i, 5:15].toarray().ravel(), X[i, 5:15])
+                
+            for j in range(A.shape[1]): 
+                nptst.assert_array_equal(A.colInds(j), numpy.flatnonzero(X[:, j]))
+                nptst.assert_array_equal(A[:, j].toarray().ravel(), X[:, j])
+                
+            #Slices with negative bounds and a step 
+            for slc in [slice(-5, None), slice(None, None, 2), slice(8, 1, -3), slice(-15, -2, 4), slice(None, None, -1)]: 
+                B = A[3, slc]
+                self.assertEquals(B.shape, (X[3, slc].shape[0], 1))
+                nptst.assert_array_equal(B.toarray()[:, 0], X[3, slc])
+                B = A[slc, 2]
+                self.assertEquals(B.shape, (X[slc, 2].shape[0], 1))
+                nptst.assert_array_equal(B.toarray()[:, 0], X[slc, 2])
+                
+            nptst.assert_array_equal(A.rowInds(-1), numpy.flatnonzero(X[29, :]))
+            self.assertRaises(ValueError, A.rowInds, 30)
+            self.assertRaises(ValueError, A.colInds, 20)
+            
+            #The index is rebuilt after the array changes 
+            A[3, 4] = 5
+            A[10, 0] = 2
+            X[3, 4] = 5
+            X[10, 0] = 2
+            self.assertFalse(A.secondaryIndex()[0] is indPtr)
+            nptst.assert_array_equal(A.rowInds(3), numpy.flatnonzero(X[3, :]))
+            nptst.assert_array_equal(A.colInds(0), numpy.flatnonzero(X[:, 0]))
+            nptst.assert_array_equal(A[10, :].toarray().ravel(), X[10, :])
+            
+            A.setZero()
+            nptst.assert_array_equal(A.rowInds(3), numpy.array([]))
+            
+            indPtr, colInds = sppy.rand((30, 20), 0.2, storagetype=storagetype).nonzeroRowsPtr()
+            self.assertEquals(indPtr.dtype, numpy.int32)
+            self.assertEquals(colInds.dtype, numpy.int32)
+
     def testValues(self): 
         nptst.assert_array_equal(self.A.values(), self.A[self.A.nonzero()])
         nptst.assert_array_equal(self.B.values(), self.B[self.B.nonzero()])
@@ -1299,6 +1877,210 @@ class csarrayTest(unittest.TestCase):
         except ImportError as err: 
             print(err)        
         
+    def testFromScipySparse(self): 
+        try: 
+            import scipy.sparse
+        except ImportError as err: 
+            print(err)
+            return 
+            
+        numpy.random.seed(21)
+        A = scipy.sparse.rand(20, 15, 0.2, format="coo")
+        
+        for storagetype in self.storagetypes: 
+            for B in [A, A.tocsc(), A.tocsr()]: 
+                C = csarray.fromScipySparse(B, storagetype=storagetype)
+                self.assertEquals(C.storagetype, storagetype)
+                self.assertEquals(C.nnz, A.nnz)
+                nptst.assert_array_equal(C.toarray(), A.toarray())
+                
+        #Non-canonical input with duplicates and unsorted indices 
+        B = scipy.sparse.csr_matrix((numpy.array([1.0, 2.0, 3.0]), numpy.array([3, 1, 3]), numpy.array([0, 3, 3])), shape=(2, 4))
+        C = csarray.fromScipySparse(B, storagetype="row")
+        nptst.assert_array_equal(C.toarray(), B.toarray())
+        self.assertEquals(C.nnz, 2)
+        
+        B = scipy.sparse.csc_matrix((10, 5), dtype=numpy.float32)
+        C = csarray.fromScipySparse(B)
+        self.assertEquals(C.dtype, numpy.float32)
+        self.assertEquals(C.nnz, 0)
+        
+        #Round trip without copying 
+        for storagetype in self.storagetypes: 
+            B = csarray(self.B, storagetype=storagetype)
+            nptst.assert_array_equal(B.toScipyCsc(copy=False).toarray(), self.B.toarray())
+            nptst.assert_array_equal(B.toScipyCsr(copy=False).toarray(), self.B.toarray())
+
+    def testFromChunks(self): 
+        numpy.random.seed(21)
+        m, n = 30, 20 
+        numChunks = 7
+        chunks = [] 
+        
+        for i in range(numChunks): 
+            size = numpy.random.randint(0, 60)
+            chunks.append((numpy.random.randint(0, m, size), numpy.random.randint(0, n, size), numpy.random.randn(size)))
+        
+        Y = numpy.zeros((m, n))
+        for rowInds, colInds, vals in chunks: 
+            numpy.add.at(Y, (rowInds, colInds), vals)
+        
+        for storagetype in self.storagetypes: 
+            #A list, a callable and a generator 
+            sources = [chunks, lambda: iter(chunks), (chunk for chunk in chunks)]
+            
+            for source in sources: 
+                A = csarray.fromChunks((m, n), source, storagetype=storagetype)
+                self.assertEquals(A.storagetype, storagetype)
+                self.assertEquals(A.nnz, numpy.count_nonzero(Y))
+                nptst.assert_array_almost_equal(A.toarray(), Y)
+                
+                #Inner indices must come out sorted 
+                B = csarray.fromCompressed(A.shape, A.outerIndexPtr(), A.innerIndexPtr(), A.valuePtr(), storagetype=storagetype)
+                nptst.assert_array_equal(B.toarray(), A.toarray())
+        
+        #Duplicate policies agree with put 
+        rowInds = numpy.concatenate([c[0] for c in chunks]).astype(numpy.int32)
+        colInds = numpy.concatenate([c[1] for c in chunks]).astype(numpy.int32)
+        vals = numpy.concatenate([c[2] for c in chunks])
+        
+        for duplicates in ["last", "max", "min"]: 
+            for storagetype in self.storagetypes: 
+                A = csarray.fromChunks((m, n), (chunk for chunk in chunks), storagetype=storagetype, duplicates=duplicates)
+                B = csarray((m, n), storagetype=storagetype)
+                B.put(vals, rowInds, colInds, init=True, duplicates=duplicates)
+                nptst.assert_array_equal(A.toarray(), B.toarray())
+        
+        #Scalar values, dtypes and empty inputs 
+        A = csarray.fromChunks((5, 5), [([0, 1, 1], [2, 3, 3], 2)], dtype=numpy.int8, storagetype="row")
+        self.assertEquals(A.dtype, numpy.int8)
+        self.assertEquals(A[1, 3], 4)
+        self.assertEquals(A.nnz, 2)
+        
+        A = csarray.fromChunks((5, 5), [])
+        self.assertEquals(A.nnz, 0)
+        A = csarray.fromChunks((5, 0), iter([([], [], [])]))
+        self.assertEquals(A.shape, (5, 0))
+        
+        self.assertRaises(ValueError, csarray.fromChunks, (5, 5), [([5], [0], [1.0])])
+        self.assertRaises(ValueError, csarray.fromChunks, (5, 5), [([0], [0], [1.0])], duplicates="first")
+
+    def testFromCompressed(self): 
+        outerIndexPtr = numpy.array([0, 2, 2, 3, 5])
+        innerIndexPtr = numpy.array([0, 2, 1, 0, 3])
+        values = numpy.array([1.0, 2.0, 3.0, 4.0, 5.0], numpy.float32)
+        
+        A = csarray.fromCompressed((4, 4), outerIndexPtr, innerIndexPtr, values)
+        B = numpy.zeros((4, 4))
+        B[[0, 2, 1, 0, 3], [0, 0, 2, 3, 3]] = values 
+        
+        self.assertEquals(A.dtype, numpy.float32)
+        self.assertEquals(A.storagetype, "col")
+        nptst.assert_array_equal(A.toarray(), B)
+        
+        A = csarray.fromCompressed((4, 4), outerIndexPtr, innerIndexPtr, values, storagetype="row")
+        self.assertEquals(A.storagetype, "row")
+        nptst.assert_array_equal(A.toarray(), B.T)
+        
+        A = csarray.fromCompressed((4, 5), outerIndexPtr, innerIndexPtr, values, storagetype="row")
+        self.assertEquals(A.shape, (4, 5))
+        
+        A = csarray.fromCompressed((3, 0), numpy.array([0]), numpy.array([]), numpy.array([]))
+        self.assertEquals(A.shape, (3, 0))
+        
+        #Invalid inputs 
+        self.assertRaises(ValueError, csarray.fromCompressed, (4, 5), outerIndexPtr, innerIndexPtr, values)
+        self.assertRaises(ValueError, csarray.fromCompressed, (3, 4), outerIndexPtr, innerIndexPtr, values)
+        self.assertRaises(ValueError, csarray.fromCompressed, (4, 4), numpy.array([0, 2, 1, 3, 5]), innerIndexPtr, values)
+        self.assertRaises(ValueError, csarray.fromCompressed, (4, 4), numpy.array([0, 2, 2, 3, 6]), innerIndexPtr, values)
+        self.assertRaises(ValueError, csarray.fromCompressed, (4, 4), outerIndexPtr, numpy.array([2, 0, 1, 0, 3]), values)
+        self.assertRaises(ValueError, csarray.fromCompressed, (4, 4), outerIndexPtr, numpy.array([0, 0, 1, 0, 3]), values)
+        
+    def testMapCompressed(self): 
+        for storagetype in self.storagetypes: 
+            A = csarray(self.B, storagetype=storagetype)
+            outerIndexPtr = A.outerIndexPtr().copy()
+            innerIndexPtr = A.innerIndexPtr().copy()
+            values = A.valuePtr().copy()
+            
+            B = csarray.fromCompressed(A.shape, outerIndexPtr, innerIndexPtr, values, storagetype=storagetype, copy=False)
+            self.assertTrue(B.isMapped())
+            nptst.assert_array_equal(B.toarray(), A.toarray())
+            
+            #Changes to the buffers show up in the array 
+            values[0] = 12
+            self.assertEquals(B.valuePtr()[0], 12)
+            self.assertEquals(B.sum(), A.sum() - A.valuePtr()[0] + 12)
+            
+            self.assertRaises(ValueError, B.__setitem__, (0, 0), 1)
+            self.assertRaises(ValueError, B.put, 1, numpy.array([0], numpy.int32), numpy.array([0], numpy.int32))
+            self.assertRaises(ValueError, B.reserve, 10)
+            self.assertRaises(ValueError, B.ones)
+            
+            #Operations which create new arrays work 
+            nptst.assert_array_equal(B.transpose().toarray(), B.toarray().T)
+            nptst.assert_array_equal((B + A).toarray(), B.toarray() + A.toarray())
+            nptst.assert_array_equal(B[1:3, :].toarray(), B.toarray()[1:3, :])
+            
+            #The buffers are kept alive 
+            del outerIndexPtr, innerIndexPtr, values 
+            nptst.assert_array_equal(B.nonzero()[0], A.nonzero()[0])
+            
+            #Copy on write 
+            C = csarray(A.shape, storagetype=storagetype)
+            values = A.valuePtr().copy()
+            C._array.mapCompressed(A.outerIndexPtr().copy(), A.innerIndexPtr().copy(), values, True)
+            self.assertTrue(C.isMapped())
+            C[0, 0] = 1 
+            self.assertFalse(C.isMapped())
+            self.assertEquals(C[0, 0], 1)
+            nptst.assert_array_equal(values, A.valuePtr())
+            
+            #Replacing the storage 
+            B.setCompressed(A.outerIndexPtr(), A.innerIndexPtr(), A.valuePtr())
+            self.assertFalse(B.isMapped())
+            B[0, 0] = 2 
+            self.assertEquals(B[0, 0], 2)
+            
+        self.assertRaises(ValueError, csarray.fromCompressed, (2, 2), numpy.array([0, 1]), numpy.array([0]), numpy.array([1.0]), check=False, copy=False)
+
+    def testCompressedBuffers(self): 
+        for storagetype in self.storagetypes: 
+            A = csarray(self.B, storagetype=storagetype)
+            A.reserve(10)
+            A[2, 2] = 0.5
+            
+            outerIndexPtr = A.outerIndexPtr()
+            innerIndexPtr = A.innerIndexPtr()
+            values = A.valuePtr()
+            
+            if storagetype == "col": 
+                B = A.toarray().T 
+            else: 
+                B = A.toarray()
+                
+            self.assertEquals(outerIndexPtr.shape[0], B.shape[0]+1)
+            self.assertEquals(innerIndexPtr.shape[0], A.nnz)
+            self.assertEquals(values.dtype, A.dtype)
+            
+            for i in range(B.shape[0]): 
+                nptst.assert_array_equal(innerIndexPtr[outerIndexPtr[i]:outerIndexPtr[i+1]], B[i, :].nonzero()[0])
+                nptst.assert_array_equal(values[outerIndexPtr[i]:outerIndexPtr[i+1]], B[i, B[i, :].nonzero()[0]])
+            
+            #Values are writeable views, indices are not 
+            values[:] = 1 
+            self.assertEquals(A.sum(), A.nnz)
+            self.assertRaises(ValueError, innerIndexPtr.__setitem__, 0, 1)
+            
+            #The views keep the storage alive 
+            del A 
+            self.assertEquals(values.sum(), values.shape[0])
+            
+        A = csarray((5, 5))
+        self.assertEquals(A.valuePtr().shape[0], 0)
+        self.assertEquals(A.innerIndexPtr().shape[0], 0)
+        nptst.assert_array_equal(A.outerIndexPtr(), numpy.zeros(6))
+        
     def testPut(self): 
         A = csarray((10, 10))
         
@@ -1313,6 +2095,109 @@ class csarrayTest(unittest.TestCase):
             
         self.assertEquals(A.nnz, rowInds.shape[0])
 
+    def testPutDuplicates(self): 
+        rowInds = numpy.array([4, 1, 4, 0, 1, 4], numpy.int32)
+        colInds = numpy.array([2, 0, 2, 3, 0, 2], numpy.int32)
+        vals = numpy.array([3, -2, -5, 0, 7, 1], numpy.float32)
+        
+        expected = {"sum": (-1, 5, 0), "last": (1, 7, 0), "max": (3, 7, 0), "min": (-5, -2, 0)}
+        
+        for storagetype in self.storagetypes: 
+            for duplicates, (v1, v2, v3) in expected.items(): 
+                A = csarray((5, 4), dtype=numpy.float32, storagetype=storagetype)
+                A[2, 2] = 1 
+                A.put(vals, rowInds, colInds, init=True, duplicates=duplicates)
+                
+                self.assertEquals(A.nnz, 3)
+                self.assertEquals(A[4, 2], v1)
+                self.assertEquals(A[1, 0], v2)
+                self.assertEquals(A[0, 3], v3)
+                self.assertEquals(A[2, 2], 0)
+                
+                A = csarray((5, 4), dtype=numpy.int32, storagetype=storagetype)
+                A.put(2, rowInds, colInds, init=True, duplicates=duplicates)
+                self.assertEquals(A[4, 2], 6 if duplicates == "sum" else 2)
+                self.assertEquals(A.nnz, 3)
+        
+        #Large integers are not rounded through doubles 
+        A = csarray((3, 3), dtype=numpy.int64)
+        A.put(numpy.array([2**60+1, 2**60+3], numpy.int64), numpy.array([0, 1], numpy.int32), numpy.array([0, 1], numpy.int32), init=True)
+        self.assertEquals(A[0, 0], 2**60+1)
+        self.assertEquals(A[1, 1], 2**60+3)
+        
+        self.assertRaises(ValueError, A.put, 1, numpy.array([0], numpy.int32), numpy.array([0], numpy.int32), init=True, duplicates="first")
+
+    def testPutMerge(self): 
+        numpy.random.seed(21)
+        
+        for storagetype in self.storagetypes: 
+            for dtype in [numpy.float64, numpy.int32]: 
+                X = numpy.zeros((8, 12), dtype)
+                X[numpy.random.randint(0, 8, 20), numpy.random.randint(0, 12, 20)] = numpy.random.randint(-5, 5, 20)
+                X[1, 3] = 2 
+                
+                rowInds = numpy.random.randint(0, 8, 50).astype(numpy.int32)
+                colInds = numpy.random.randint(0, 12, 50).astype(numpy.int32)
+                vals = numpy.random.randint(-5, 5, 50).astype(dtype)
+                
+                #Overwrite, the last of repeated indices wins 
+                A = csarray(X, dtype=dtype, storagetype=storagetype)
+                A.put(vals, rowInds, colInds)
+                Y = X.copy()
+                for i in range(rowInds.shape[0]): 
+                    Y[rowInds[i], colInds[i]] = vals[i]
+                nptst.assert_array_equal(A.toarray(), Y)
+                self.assertEquals(A.dtype, dtype)
+                
+                #Accumulate 
+                A = csarray(X, dtype=dtype, storagetype=storagetype)
+                A.put(vals, rowInds, colInds, mode="accumulate")
+                Y = X.copy()
+                numpy.add.at(Y, (rowInds, colInds), vals)
+                nptst.assert_array_equal(A.toarray(), Y)
+                
+                #Maximum 
+                A = csarray(X, dtype=dtype, storagetype=storagetype)
+                A.put(vals, rowInds, colInds, mode="max")
+                Y = X.copy()
+                numpy.maximum.at(Y, (rowInds, colInds), vals)
+                nptst.assert_array_equal(A.toarray(), Y)
+                
+                #Elements which are not stored are zero, so negative values do not create them 
+                A = csarray((5, 4), dtype=dtype, storagetype=storagetype)
+                A.put(numpy.array([-2, -5], dtype), numpy.array([1, 3], numpy.int32), numpy.array([0, 2], numpy.int32), mode="max")
+                self.assertEquals(A.getnnz(), 0)
+                
+                #Scalar values 
+                A = csarray(X, dtype=dtype, storagetype=storagetype)
+                A.put(3, rowInds, colInds, mode="accumulate")
+                Y = X.copy()
+                numpy.add.at(Y, (rowInds, colInds), 3)
+                nptst.assert_array_equal(A.toarray(), Y)
+                
+        #Zeros are not stored for new elements but existing ones are kept 
+        A = csarray((5, 5))
+        A[1, 1] = 2 
+        A.put(numpy.array([0.0, 0.0]), numpy.array([1, 2], numpy.int32), numpy.array([1, 2], numpy.int32))
+        self.assertEquals(A.nnz, 1)
+        self.assertEquals(A[1, 1], 0)
+        
+        #Works on an uncompressed matrix and with __setitem__ 
+        A = csarray((5, 5), storagetype="row")
+        A.reserve(10)
+        A[0, 4] = 1
+        A[numpy.array([3, 0, 3]), numpy.array([2, 1, 2])] = numpy.array([1, 2, 3])
+        nptst.assert_array_equal(A.nonzero()[0], numpy.array([0, 0, 3]))
+        nptst.assert_array_equal(A.values(), numpy.array([2, 1, 3]))
+        
+        A.put(numpy.array([]), numpy.array([], numpy.int32), numpy.array([], numpy.int32))
+        self.assertEquals(A.nnz, 3)
+        
+        self.assertRaises(ValueError, A.put, 1, numpy.array([5], numpy.int32), numpy.array([0], numpy.int32))
+        self.assertRaises(ValueError, A.put, 1, numpy.array([0], numpy.int32), numpy.array([-1], numpy.int32))
+        self.assertRaises(ValueError, A.put, numpy.array([1, 2]), numpy.array([0], numpy.int32), numpy.array([0], numpy.int32))
+        self.assertRaises(ValueError, A.put, 1, numpy.array([0], numpy.int32), numpy.array([0], numpy.int32), mode="min")
+
     def testPutInit(self): 
         A = csarray((10, 10), storagetype="col")  
         
@@ -1478,6 +2363,54 @@ class csarrayTest(unittest.TestCase):
         self.assertEquals(self.F.dtype, F.dtype)
         self.assertEquals(self.F.storagetype, F.storagetype)      
       
+    def testPickleProtocols(self): 
+        protocols = list(range(pickle.HIGHEST_PROTOCOL+1))
+        dtypes = [numpy.float32, numpy.float64, numpy.int8, numpy.int16, numpy.int32, numpy.int64]
+        
+        for A in [self.A, self.B, self.F, self.G, csarray((0, 3))]: 
+            for dtype in dtypes: 
+                for storagetype in ["col", "row"]: 
+                    A2 = csarray(A, dtype=dtype, storagetype=storagetype)
+                    
+                    for protocol in protocols: 
+                        B = pickle.loads(pickle.dumps(A2, protocol))
+                        
+                        self.assertEquals(B.shape, A2.shape)
+                        self.assertEquals(B.dtype, A2.dtype)
+                        self.assertEquals(B.storagetype, A2.storagetype)
+                        nptst.assert_array_equal(B.toarray(), A2.toarray())
+                        nptst.assert_array_equal(B.outerIndexPtr(), A2.outerIndexPtr())
+                        nptst.assert_array_equal(B.innerIndexPtr(), A2.innerIndexPtr())
+        
+        #Pickles of the old form are still loaded 
+        B = csarray.__new__(csarray)
+        B.__setstate__(self.B.__getstate__())
+        nptst.assert_array_equal(B.toarray(), self.B.toarray())
+        
+        if pickle.HIGHEST_PROTOCOL < 5: 
+            return 
+        
+        #Out-of-band buffers are used as the storage without copying 
+        buffers = []
+        s = pickle.dumps(self.B, 5, buffer_callback=buffers.append)
+        self.assertEquals(len(buffers), 3)
+        
+        B = pickle.loads(s, buffers=buffers)
+        nptst.assert_array_equal(B.toarray(), self.B.toarray())
+        self.assertTrue(B.isMapped())
+        
+        values = numpy.frombuffer(buffers[2], B.dtype)
+        self.assertTrue(numpy.shares_memory(B.valuePtr(), values))
+        
+        #Writing copies the storage and leaves the original buffers alone 
+        B[0, 0] = 100
+        self.assertFalse(B.isMapped())
+        self.assertEquals(B[0, 0], 100)
+        nptst.assert_array_equal(values, self.B.values())
+        
+        C = B*2 
+        self.assertEquals(C[0, 0], 200)
+
     def testNonzeroRowsList(self): 
         omegaList = self.B.nonzeroRowsList()
         